@@ -82,6 +82,10 @@ class BusinessValidator:
             "finalize_cancel_reservation",
             "finalize_update_reservation",
             "core.get_available_datetimes",
+            "core.get_available_datetimes_batch",
+            "core.get_first_available",
+            "core.get_nearest_alternatives",
+            "core.get_available_days",
             "core.get_daily_opening_hours",           
         ]
         
@@ -227,7 +231,7 @@ class BusinessValidator:
     def _get_param_visibility(param_name: str) -> List[UserRole]:
         base = BusinessValidator._get_base_param(param_name)
 
-        if base == 'actor':
+        if base in ['actor', 'idempotency_key']:
             return []
         # user param restricted
         if base == "user":
@@ -16,6 +16,9 @@ _SAVE_EACH_N_REQUESTS: int -- N.of minutes to continuously run checkpoint (only
 """
 _SAVE_EVERY_N_REQUESTS = 5
 _SAVE_EACH_MINUTES = 3
+_MAINTENANCE_DELAY_SECONDS = 60 ## daily calendar maintenance runs this long after the business midnight
+_PENDING_SWEEP_MAX_SECONDS = 60 ## the expired pending operations sweeper wakes up at least this often
+_PENDING_SWEEP_BATCH = 50 ## max expired pending operations canceled at each sweep (the backend gate is held meanwhile)
 
 class ApplicationOrchestrator:
     
@@ -32,10 +35,16 @@ class ApplicationOrchestrator:
         self._need_to_freeze_to_checkpoint = False
         self.__schedule_checkpoint_task__ = None
         self.__checkpoint_task__ = None
+        self.__calendar_maintenance_task__ = None
+        self.__pending_expiry_sweeper_task__ = None
         self._checkpoint_cond = asyncio.Condition()
         self._checkpoint_lock = asyncio.Lock()
         
-    async def handle_message(self, user_id: str, message: str, past_conversation_messages: list[tuple[str, str]]):   
+    async def handle_message(self, user_id: str, message: str, past_conversation_messages: list[tuple[str, str]], response_id: int = None):   
+        """
+        response_id: id of the chat response being processed, if any. The requests of a response run with idempotency keys derived from it,
+        so that processing the same response again (e.g. a retry after a later failure) answers the already run operations from the backend idempotency table.
+        """
         import datetime as dt
         from backend import backend_storing_utils
         from backend.business_event import updates_backend_data
@@ -75,10 +84,12 @@ class ApplicationOrchestrator:
 
             try:
                 # Phase 3: Execute the changes immediately
-                for request_dct in requests_to_run:
+                for request_idx, request_dct in enumerate(requests_to_run):
                     request_dct[globals_shared.USER_ATTRIBUTE] = user
                     structured_request = self.request_handler.build_structured_request(request_dct, raise_error=False)                            
                     structured_request._id = ApplicationOrchestrator.__generate_req_id__()
+                    if response_id is not None:
+                        structured_request._idempotency_key = f'{user_id}:{response_id}:{request_idx}'
                     
                     executable_req, response = await self.request_handler.run(structured_request)
                     executable_req.timestamp = dt.datetime.now(dt.UTC)
@@ -242,9 +253,109 @@ class ApplicationOrchestrator:
             async with self._checkpoint_cond:
                 self._need_to_freeze_to_checkpoint = False
                 self._checkpoint_cond.notify_all()
-        
-        
-        
+
+
+    def start_calendar_maintenance(self, future_days: int, archive_after_days: int = 0):
+        """
+        Starts the daily calendar maintenance (rolling_days generation mode): the calendar window is rolled now and then at every business midnight.
+        """
+        if self.__calendar_maintenance_task__ is None or self.__calendar_maintenance_task__.done():
+            self.__calendar_maintenance_task__ = asyncio.create_task(self._calendar_maintenance_loop(future_days, archive_after_days))
+
+    async def _calendar_maintenance_loop(self, future_days: int, archive_after_days: int = 0):
+        import datetime as dt
+        from utils.datetimes_utils import to_default_tz
+
+        while True:
+            try:
+                await self.roll_calendar_window(future_days, archive_after_days)
+            except Exception as e:
+                print(f'\nCalendar maintenance ended UNSUCCESSFULLY -- Error: {e}.\t {dt.datetime.now(dt.UTC)}\n\n')
+            now = to_default_tz(dt.datetime.now(dt.UTC))
+            next_midnight = dt.datetime.combine(now.date() + dt.timedelta(days=1), dt.time.min, tzinfo=now.tzinfo)
+            await asyncio.sleep(max(0, (next_midnight - now).total_seconds()) + _MAINTENANCE_DELAY_SECONDS)
+
+    async def roll_calendar_window(self, future_days: int, archive_after_days: int = 0):
+        """
+        Evicts the past segments and the reservations ended more than archive_after_days ago from the backend (moving the reservations to the archive on disk)
+        and appends the next days' segments.
+        Runs with the requests gate closed, as a checkpoint does. The reservations are written to the archive before being evicted: if the archive
+        write fails, the backend is left unchanged. The maintenance is not logged as a request: a checkpoint follows to persist it.
+        """
+        async with self._checkpoint_lock:
+            async with self._checkpoint_cond:
+                self._need_to_freeze_to_checkpoint = True
+                while self._active_backend_operations > 0:
+                    await self._checkpoint_cond.wait()
+            try:
+                event = await self.request_handler.business_manager.core.roll_calendar_window(future_days=future_days, archive_after_days=archive_after_days, actor=UserRole.SYSTEM,
+                                                                                               archive_reservations=self.storage_manager.archive_reservations)
+            finally:
+                async with self._checkpoint_cond:
+                    self._need_to_freeze_to_checkpoint = False
+                    self._checkpoint_cond.notify_all()
+
+        evicted_reservations = event.data.old
+        if self.cache is not None:
+            for reservation in evicted_reservations:
+                if (user_cache := self.cache.get_user_cache(reservation.user)) is not None:
+                    await user_cache.remove_reservation(reservation.reservation_id)
+        print(f'\nCalendar maintenance successful -- {event.message}.\t {event.timestamp}\n\n')
+        await self.checkpoint()
+        return event
+
+
+    def start_pending_expiry_sweeper(self):
+        """
+        Starts the background cancelation of the pending reservation operations (creations, cancelations, updates) whose confirmation time expired.
+        Only for backends requiring confirmations.
+        """
+        if not hasattr(self.request_handler.business_manager.core, 'sweep_expired_pending_reservations'):
+            return
+        if self.__pending_expiry_sweeper_task__ is None or self.__pending_expiry_sweeper_task__.done():
+            self.__pending_expiry_sweeper_task__ = asyncio.create_task(self._pending_expiry_sweeper_loop())
+
+    async def _pending_expiry_sweeper_loop(self):
+        import datetime as dt
+
+        while True:
+            try:
+                while await self.sweep_expired_pending_reservations(): ## a full batch may leave more expired operations
+                    await asyncio.sleep(0)
+            except Exception as e:
+                print(f'\nPending operations sweep ended UNSUCCESSFULLY -- Error: {e}.\t {dt.datetime.now(dt.UTC)}\n\n')
+            next_expiry = self.request_handler.business_manager.core.get_next_pending_expiry()
+            seconds_to_next_expiry = (next_expiry - dt.datetime.now(dt.UTC)).total_seconds() if next_expiry is not None else _PENDING_SWEEP_MAX_SECONDS
+            await asyncio.sleep(min(max(0, seconds_to_next_expiry) + 1, _PENDING_SWEEP_MAX_SECONDS))
+
+    async def sweep_expired_pending_reservations(self, max_batch: int = _PENDING_SWEEP_BATCH) -> bool:
+        """
+        Cancels a batch of expired pending reservation operations, entering the backend gate as a request does, then updates the users caches by the
+        resulting events. The sweep is not logged as a request (replaying the log expires the same operations): a checkpoint is scheduled to persist it.
+        Returns whether a full batch was canceled.
+        """
+        from application.request_handler import _map_execute_output_to_response
+
+        async with self._checkpoint_cond:
+            while self._need_to_freeze_to_checkpoint:
+                await self._checkpoint_cond.wait()
+            self._active_backend_operations += 1
+        try:
+            events = await self.request_handler.business_manager.core.sweep_expired_pending_reservations(max_batch=max_batch, actor=UserRole.SYSTEM)
+        finally:
+            async with self._checkpoint_cond:
+                self._active_backend_operations -= 1
+                if self._active_backend_operations == 0:
+                    self._checkpoint_cond.notify_all()
+        if not events:
+            return False
+
+        if self.cache is not None:
+            await self._update_cache_by_response_output(_map_execute_output_to_response(events))
+        self._ensure_checkpoint_scheduled()
+        return len(events) >= max_batch
+
+
     async def _ensure_system_cache_init(self):
         # 1. Fast path: If already initialized, exit immediately (No locking overhead)
         if self.cache is not None:
@@ -34,6 +34,14 @@ class ActorInjectionRule(ParamInjectionRule):
     def resolve(self, request: StructuredRequest):
         return request.user.user_role
 
+
+class IdempotencyKeyInjectionRule(ParamInjectionRule):
+    def match(self, param_name: str, method: str = None) -> bool:
+        return param_name == "idempotency_key"
+
+    def resolve(self, request: StructuredRequest):
+        return request._idempotency_key ## set by the orchestrator; missing -> AttributeError -> default (no key)
+
         
 class ForceGridRule(ParamInjectionRule):
     def match(self, param_name: str, method: str = None) -> bool:
@@ -88,7 +96,7 @@ class RequestHandler:
         self._build_cached_exposed_params()
 
         # injection policy setup
-        self.injection_policy = InjectionPolicy([UserInjectionRule(), ActorInjectionRule(), ForceGridRule()])
+        self.injection_policy = InjectionPolicy([UserInjectionRule(), ActorInjectionRule(), IdempotencyKeyInjectionRule(), ForceGridRule()])
     # -------------------------
     
     
@@ -186,11 +186,13 @@ def _reservation_to_snapshot(reservation) -> ReservationSnapshot:
 from backend.reservations import Reservation
 from backend.policy import Service
 from backend.business_calendar import BusinessCalendar, Segment, Slot
+from backend.multi_resource_calendar import MultiResourceCalendar
 
 _SNAPSHOT_MAPPERS = {
     Reservation: _reservation_to_snapshot,
     Service: _service_to_snapshot,
     BusinessCalendar: _calendar_to_snapshot,
+    MultiResourceCalendar: _calendar_to_snapshot,
     Segment: _segment_to_snapshot,
     Slot: _slot_to_snapshot,
 }
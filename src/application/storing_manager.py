@@ -1,11 +1,12 @@
 from pathlib import Path
-import asyncio
+import asyncio, json
 from storage.file_storers import BinaryRecordStorage
 from storage.serializers import RecordPickleSerializer
 
 
 REQUESTS_FILENAME = "requests.jsonl"
 MANAGER_FILENAME = "manager.jsonl"
+ARCHIVED_RESERVATIONS_FILENAME = "archived_reservations.jsonl"
 
 _REQUESTS_STEM, _REQUESTS_SUFFIX = Path(REQUESTS_FILENAME).stem, Path(REQUESTS_FILENAME).suffix
 _MANAGER_STEM, _MANAGER_SUFFIX = Path(MANAGER_FILENAME).stem, Path(MANAGER_FILENAME).suffix
@@ -22,10 +23,13 @@ class AppStoringManager:
         self._requests_filepath.parent.mkdir(parents=True, exist_ok=True)
         self._backend_manager_filepath = Path(backend_manager_filepath)
         self._backend_manager_filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._archived_reservations_filepath = self._backend_manager_filepath.parent / ARCHIVED_RESERVATIONS_FILENAME
+        self.reservation_archive = ReservationArchive(self._archived_reservations_filepath)
         self._init_archived_shard()
         self._init_n_requests_from_disk()
         self._requests_lock = asyncio.Lock() 
         self._backend_manager_lock = asyncio.Lock()
+        self._archived_reservations_lock = asyncio.Lock()
         
         
     @property
@@ -79,6 +83,15 @@ class AppStoringManager:
         return
         
     
+    async def archive_reservations(self, reservations: list["Reservation"]):
+        """ Cold storage of the reservations evicted from the backend: appended as json lines, never rewritten. """
+        if not reservations:
+            return self._archived_reservations_filepath
+        async with self._archived_reservations_lock:
+            self.reservation_archive.append(reservations)
+        return self._archived_reservations_filepath
+        
+    
     async def load_manager(self):
         from backend import backend_storing_utils
         async with self._backend_manager_lock:
@@ -88,6 +101,88 @@ class AppStoringManager:
     #async def checkpoint(self):        
     
     
+class ReservationArchive:
+    """
+    Cold tier of the reservations: the append-only json lines file of the evicted reservations, with an in-memory index of
+    reservation id -> line offset (and user -> reservation id -> line offset). The index is built by a single scan at the first lookup, then kept updated by append.
+    Each reservation is archived once: appending an already archived one (e.g. evicted again after reloading a checkpoint preceding its eviction) is a no-op,
+    and a file holding a reservation twice is indexed on its last record. Reservations are read back from disk only when looked up.
+    """
+    def __init__(self, filepath: Path):
+        self.filepath = Path(filepath)
+        self._offsets_by_id = None
+        self._offsets_by_user = None
+
+    def __deepcopy__(self, memo):
+        return self ## shared by the backend snapshots: the archived records are never modified
+
+    def __len__(self):
+        self._ensure_index()
+        return len(self._offsets_by_id)
+
+    def append(self, reservations: list["Reservation"]):
+        """ Appends all the reservations not archived yet, or none: on a write error the file is truncated back and the error raised, with the index unchanged. """
+        self._ensure_index()
+        reservations = list({r.reservation_id: r for r in reservations if r.reservation_id not in self._offsets_by_id}.values())
+        if not reservations:
+            return
+        lines = [(json.dumps(reservation.to_dict(), default=str) + '\n').encode() for reservation in reservations]
+        with open(self.filepath, 'ab') as f:
+            start_offset = f.tell()
+            try:
+                f.write(b''.join(lines))
+                f.flush()
+            except BaseException:
+                f.truncate(start_offset)
+                raise
+        offset = start_offset
+        for reservation, line in zip(reservations, lines):
+            self._index_record(reservation.reservation_id, reservation.user, offset)
+            offset += len(line)
+
+    def get_reservation(self, reservation_id: str) -> "Reservation":
+        self._ensure_index()
+        offset = self._offsets_by_id.get(reservation_id)
+        return self._read_reservations([offset])[0] if offset is not None else None
+
+    def get_reservations_by_user(self, user: str) -> list["Reservation"]:
+        self._ensure_index()
+        return self._read_reservations(sorted(self._offsets_by_user.get(user, {}).values()))
+
+    def get_all_reservations(self) -> list["Reservation"]:
+        self._ensure_index()
+        return self._read_reservations(sorted(self._offsets_by_id.values()))
+
+    def _ensure_index(self):
+        if self._offsets_by_id is not None:
+            return
+        self._offsets_by_id, self._offsets_by_user = {}, {}
+        if not self.filepath.exists():
+            return
+        with open(self.filepath, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._index_record(record['reservation_id'], record['user'], offset)
+                offset += len(line)
+
+    def _index_record(self, reservation_id: str, user: str, offset: int):
+        self._offsets_by_id[reservation_id] = offset
+        self._offsets_by_user.setdefault(user, {})[reservation_id] = offset
+
+    def _read_reservations(self, offsets: list[int]) -> list["Reservation"]:
+        from backend.backend_storing_utils import _dict_to_reservation
+        if not offsets:
+            return []
+        reservations = []
+        with open(self.filepath, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                reservations.append(_dict_to_reservation(json.loads(f.readline())))
+        return reservations
+    
+    
 def request_serializer(request):
     import pickle
     return pickle.dumps(request)
@@ -7,6 +7,7 @@ def store_business_core(business_manager: "BusinessCore", filename_path: str):
     with open(filename_path, 'w') as f:
         json_dct = {}
         json_dct['segments'] = [(s.start_time.isoformat(), s.end_time.isoformat(), s.slot_duration) for s in business_manager.calendar.segments]
+        json_dct['n_resources'] = business_manager.calendar.n_resources
         json_dct['reservations'] = [r.to_dict() for r in business_manager.reservation_manager.reservations_id_mappings.values()]
         """
         if isinstance(business_manager, BusinessManagerWithConfirmation):
@@ -20,6 +21,10 @@ def store_business_core(business_manager: "BusinessCore", filename_path: str):
         json_dct['policy'] = policy_manager_dct
 
         json_dct['default_grid_minutes'] = business_manager.default_grid_minutes
+        json_dct['optimistic_concurrency'] = business_manager.optimistic_concurrency
+        idempotency_table = business_manager.idempotency_table
+        json_dct['idempotency_table'] = {'max_entries': idempotency_table.max_entries, 'ttl_seconds': idempotency_table.ttl_seconds,
+                                         'entries': [(key, expires_at, fingerprint, _encode_operation_result(result)) for key, expires_at, fingerprint, result in idempotency_table.items()]}
         
         if isinstance(business_manager, BusinessCoreWithConfirmation):
             for attr in ['max_confirmation_minutes', '__unconfirmed_updates_timestamps__', '__unconfirmed_services_timestamps__']:
@@ -28,15 +33,21 @@ def store_business_core(business_manager: "BusinessCore", filename_path: str):
 
 async def load_business_core(json_filepath: str) -> "BusinessCore":
     from backend.business_calendar import BusinessCalendar
+    from backend.multi_resource_calendar import MultiResourceCalendar
     from backend.reservations import ReservationManager
     from backend.policy import Service, PolicyManager
     from backend.business_core import BusinessCore, BusinessCoreWithConfirmation
+    from backend.idempotency_table import IdempotencyTable
     
     with open(json_filepath, 'r') as f:
         data_dct = json.load(f)
 
     segments_times = data_dct.pop('segments')
-    calendar = BusinessCalendar(slot_minutes_duration=segments_times[0][-1])
+    n_resources = data_dct.pop('n_resources', 1)
+    if n_resources > 1:
+        calendar = MultiResourceCalendar(n_resources=n_resources, slot_minutes_duration=segments_times[0][-1])
+    else:
+        calendar = BusinessCalendar(slot_minutes_duration=segments_times[0][-1])
     for start_time, end_time, slots_duration in segments_times: 
         calendar.add_new_segment(start_time=dt.datetime.fromisoformat(start_time), end_time=dt.datetime.fromisoformat(end_time), force_past_slots=True)
 
@@ -46,13 +57,15 @@ async def load_business_core(json_filepath: str) -> "BusinessCore":
         reservation = _dict_to_reservation(res_dct)
         await res_manager.insert_reservation(reservation)
         if reservation.is_confirmed or not reservation.is_confirmation_expired():
-            await calendar.reserve_slots(calendar.get_slots(start_time=reservation.start_time, end_time=reservation.end_time, same_segment_only=True))
+            await calendar.reserve_slots(calendar.get_booked_slots(start_time=reservation.start_time, end_time=reservation.end_time, resource=reservation.resource))
     
     policy_manager_dct = data_dct.pop('policy')
     policy_manager_dct['services'] = [Service(**serv_dct) for serv_dct in policy_manager_dct['services']]
     policy_manager = PolicyManager(**policy_manager_dct)
 
     default_grid_minutes = data_dct.pop('default_grid_minutes', None)
+    optimistic_concurrency = data_dct.pop('optimistic_concurrency', False)
+    idempotency_table_dct = data_dct.pop('idempotency_table', None)
 
     if 'max_confirmation_minutes' in data_dct:
         other_attrs = {k:data_dct[k] for k in ['max_confirmation_minutes', '__unconfirmed_updates_timestamps__', '__unconfirmed_services_timestamps__']}
@@ -64,10 +77,70 @@ async def load_business_core(json_filepath: str) -> "BusinessCore":
     
     if default_grid_minutes:
         business_manager.default_grid_minutes = default_grid_minutes
+    business_manager.optimistic_concurrency = optimistic_concurrency
+    if idempotency_table_dct is not None:
+        business_manager.idempotency_table = IdempotencyTable(max_entries=idempotency_table_dct['max_entries'], ttl_seconds=idempotency_table_dct['ttl_seconds'])
+        for key, expires_at, fingerprint, result in idempotency_table_dct['entries']:
+            business_manager.idempotency_table.record(key, fingerprint, _decode_operation_result(result), expires_at=expires_at)
     return business_manager
 
-def _dict_to_reservation(reservation_dict: dict):
+
+def _encode_operation_result(result):
+    """ Json-ready form of a BookingService operation result (as recorded in the idempotency table): events, errors and lists of them. """
+    from backend.business_event import BusinessEvent
     from backend.reservations import Reservation
+    from backend.policy import Service
+
+    def _encode_data(obj):
+        if obj is None:
+            return None
+        if isinstance(obj, Reservation):
+            return {'reservation': obj.to_dict()}
+        if isinstance(obj, Service):
+            return {'service': obj.to_dict()}
+        return {'value': obj}
+
+    if isinstance(result, list):
+        return {'results': [_encode_operation_result(r) for r in result]}
+    if isinstance(result, BusinessEvent):
+        return {'event': {'event_type': f'{type(result.event_type).__name__}.{result.event_type.name}', 'actor': result.actor.value, 'message': result.message,
+                          'timestamp': result.timestamp.isoformat(), 'old': _encode_data(result.data.old), 'new': _encode_data(result.data.new)}}
+    if isinstance(result, Exception):
+        return {'error': type(result).__name__, 'message': str(result)}
+    return {'value': result}
+
+def _decode_operation_result(result_dict: dict):
+    from backend import business_event, domain_errors
+    from backend.business_event import BusinessEvent
+    from backend.policy import Service
+    from shared.user_role import UserRole
+
+    def _decode_data(data_dict: dict):
+        if data_dict is None:
+            return None
+        if 'reservation' in data_dict:
+            return _dict_to_reservation(data_dict['reservation'])
+        if 'service' in data_dict:
+            return Service(**data_dict['service'])
+        return data_dict['value']
+
+    if 'results' in result_dict:
+        return [_decode_operation_result(r) for r in result_dict['results']]
+    if 'event' in result_dict:
+        event_dict = result_dict['event']
+        event_type_class, _, event_type_name = event_dict['event_type'].partition('.')
+        return BusinessEvent(event_type=getattr(business_event, event_type_class)[event_type_name], actor=UserRole(event_dict['actor']), message=event_dict['message'],
+                             timestamp=dt.datetime.fromisoformat(event_dict['timestamp']), data=BusinessEvent.EventData(old=_decode_data(event_dict['old']), new=_decode_data(event_dict['new'])))
+    if 'error' in result_dict:
+        error_class = getattr(domain_errors, result_dict['error'], None)
+        try:
+            return error_class(result_dict['message'])
+        except Exception: ## e.g. builtin errors
+            return Exception(result_dict['message'])
+    return result_dict['value']
+
+def _dict_to_reservation(reservation_dict: dict):
+    from backend.reservations import Reservation, ReservationStatus
 
     res_default_keys = ['reservation_id', 'user', 'start_time', 'end_time', 'service_name']
     
@@ -76,6 +149,8 @@ def _dict_to_reservation(reservation_dict: dict):
         if k in ['timestamp', 'status_change_timestamp', '_expires_at']:
             if isinstance(v, str):
                 v = dt.datetime.fromisoformat(v)
+        if k=='status' and isinstance(v, str): ## stored as str(ReservationStatus.X)
+            v = ReservationStatus[v.rpartition('.')[2]]
         if k=='__update_reservation__':
             v = _dict_to_reservation(v)
         object.__setattr__(res, k, v)
@@ -5,10 +5,31 @@ from backend.policy import Service
 from backend.domain_errors import *
 from utils.datetimes_utils import map_datetime_to_default, minutes_between
 
-import datetime as dt, warnings
+import datetime as dt, warnings, functools
 from enum import Enum
 
 
+def _idempotent(method):
+    """
+    Makes a BookingService mutation idempotent over its idempotency_key argument (when given): a repeat of the operation with the same key and
+    arguments is answered with the first result from the core idempotency table, in O(1) and without running the operation again (no validation,
+    lookup or calendar lock). Only the results are recorded, not the errors: a failed operation changed nothing, its repeat runs again.
+    The arguments fingerprint ignores actor and the force_ flags, which replays of the requests log may change.
+    """
+    @functools.wraps(method)
+    async def _idempotent_run(self, *args, **kwargs):
+        idempotency_key = kwargs.get('idempotency_key')
+        if idempotency_key is None:
+            return await method(self, *args, **kwargs)
+        fingerprint = repr((method.__name__, args, sorted((k, v) for k, v in kwargs.items() if k not in ('idempotency_key', 'actor') and not k.startswith('force_'))))
+        if (recorded := self.core.idempotency_table.get(idempotency_key, fingerprint)) is not None:
+            return recorded[1]
+        result = await method(self, *args, **kwargs)
+        self.core.idempotency_table.record(idempotency_key, fingerprint, result)
+        return result
+    return _idempotent_run
+
+
 class BookingService:    
     
     class CoreOperation(Enum):
@@ -31,7 +52,8 @@ class BookingService:
         self._build_dispatch()
             
             
-    async def make_reservation(self, user: str, service_name: str, start_time: dt.datetime, minutes_duration: int=None, actor: UserRole = UserRole.USER, force_past_slots: bool=False, force_advance_reservation: bool=False, force_default_grid: bool=True,):
+    @_idempotent
+    async def make_reservation(self, user: str, service_name: str, start_time: dt.datetime, minutes_duration: int=None, actor: UserRole = UserRole.USER, force_past_slots: bool=False, force_advance_reservation: bool=False, force_default_grid: bool=True, idempotency_key: str=None):
         res_inputs = {'start_time': start_time, 'service_name':service_name, 'user':user}
         if minutes_duration is not None:
             res_inputs.update({'minutes_duration':minutes_duration})
@@ -48,8 +70,33 @@ class BookingService:
             force_advance_reservation=force_advance_reservation, 
             force_past_slots=force_past_slots, 
             force_default_grid=force_default_grid)
+
+    @_idempotent
+    async def make_reservations_bulk(self, reservations: list[dict], actor: UserRole = UserRole.ADMIN, all_or_nothing: bool=True, force_past_slots: bool=False, force_advance_reservation: bool=False, force_default_grid: bool=True, idempotency_key: str=None):
+        """
+        Imports many reservations at once (e.g. bookings taken by phone), each as a dict of user, service_name, start_time and optionally minutes_duration. Admins only.
+        If all_or_nothing, any invalid or failing reservation raises its error and none is made. Otherwise returns, in the input order, the event or the error of each reservation.
+        """
+        if actor not in [UserRole.SYSTEM, UserRole.ADMIN]:
+            raise NotAllowedError('Cannot make bulk reservations. You are not allowed')
+        invalid_inputs = {}
+        for idx, res_inputs in enumerate(reservations):
+            try:
+                self._validate_reservation_inputs(**res_inputs)
+            except Exception as e:
+                if all_or_nothing:
+                    raise
+                invalid_inputs[idx] = e
+        
+        results = iter(await self.core.make_reservations_bulk([res_inputs for idx, res_inputs in enumerate(reservations) if idx not in invalid_inputs], 
+            actor=actor, all_or_nothing=all_or_nothing, 
+            force_advance_reservation=force_advance_reservation, 
+            force_past_slots=force_past_slots, 
+            force_default_grid=force_default_grid))
+        return [invalid_inputs[idx] if idx in invalid_inputs else next(results) for idx in range(len(reservations))]
         
-    async def cancel_reservation(self, user: str, reservation_id: str=None, start_time: dt.datetime=None, service_name: str=None, actor: UserRole = UserRole.USER, force_past_slots: bool=False, force_advance_cancelation: bool=False):
+    @_idempotent
+    async def cancel_reservation(self, user: str, reservation_id: str=None, start_time: dt.datetime=None, service_name: str=None, actor: UserRole = UserRole.USER, force_past_slots: bool=False, force_advance_cancelation: bool=False, idempotency_key: str=None):
         res_inputs = {'reservation_id': reservation_id, 'start_time': start_time, 'service_name':service_name}
         res_inputs = {k:v for k,v in res_inputs.items() if v is not None} | {'user':user}
         self._validate_reservation_inputs(**res_inputs)
@@ -76,7 +123,8 @@ class BookingService:
             force_advance_cancelation=force_advance_cancelation)
         
         
-    async def update_reservation(self, user: str, existing_reservation_id: str=None, existing_reservation_start_time: dt.datetime=None, existing_reservation_service_name: str=None, new_start_time: dt.datetime=None, new_service_name: str=None, new_minutes_duration: int=None, actor: UserRole = UserRole.USER, force_default_grid: bool=True, force_past_slots: bool=False, force_advance_reservation: bool=False, force_advance_cancelation: bool=False):
+    @_idempotent
+    async def update_reservation(self, user: str, existing_reservation_id: str=None, existing_reservation_start_time: dt.datetime=None, existing_reservation_service_name: str=None, new_start_time: dt.datetime=None, new_service_name: str=None, new_minutes_duration: int=None, actor: UserRole = UserRole.USER, force_default_grid: bool=True, force_past_slots: bool=False, force_advance_reservation: bool=False, force_advance_cancelation: bool=False, idempotency_key: str=None):
         #VALIDATING PARAMS FOR THE EXISTING RESERVATION
         old_res_inputs = {'reservation_id': existing_reservation_id, 'start_time': existing_reservation_start_time, 'service_name':existing_reservation_service_name}
         old_res_inputs = {k:v for k,v in old_res_inputs.items() if v is not None} | {'user':user}
@@ -121,7 +169,8 @@ class BookingService:
             force_past_slots=force_past_slots)
                                                 
     
-    async def finalize_make_reservation(self, finalize_operation: FinalizeAction, user: str, reservation_id: str=None, start_time: dt.datetime=None, service_name: str=None, minutes_duration: int=None, actor: UserRole = UserRole.USER):
+    @_idempotent
+    async def finalize_make_reservation(self, finalize_operation: FinalizeAction, user: str, reservation_id: str=None, start_time: dt.datetime=None, service_name: str=None, minutes_duration: int=None, actor: UserRole = UserRole.USER, idempotency_key: str=None):
         finalize_action = BookingService._validate_finalize_action(finalize_operation)           
         res_inputs = {'reservation_id': reservation_id, 'start_time': start_time, 'service_name':service_name, 'minutes_duration':minutes_duration}
         res_inputs = {k:v for k,v in res_inputs.items() if v is not None} | {'user':user}
@@ -140,7 +189,8 @@ class BookingService:
         )
                                                 
                                                 
-    async def finalize_cancel_reservation(self, finalize_operation: FinalizeAction, user: str, reservation_id: str=None, start_time: dt.datetime=None, service_name: str=None, actor: UserRole = UserRole.USER):
+    @_idempotent
+    async def finalize_cancel_reservation(self, finalize_operation: FinalizeAction, user: str, reservation_id: str=None, start_time: dt.datetime=None, service_name: str=None, actor: UserRole = UserRole.USER, idempotency_key: str=None):
         finalize_action = BookingService._validate_finalize_action(finalize_operation)      
         res_inputs = {'reservation_id': reservation_id, 'start_time': start_time, 'service_name':service_name}
         res_inputs = {k:v for k,v in res_inputs.items() if v is not None} | {'user':user}
@@ -159,10 +209,11 @@ class BookingService:
         
         
         
+    @_idempotent
     async def finalize_update_reservation(self, finalize_operation: FinalizeAction, user: str, 
             existing_reservation_id: str=None, existing_reservation_start_time: dt.datetime=None, existing_reservation_service_name: str=None,
             new_start_time: dt.datetime=None, new_service_name: str=None, new_minutes_duration: int=None, 
-            actor: UserRole = UserRole.USER):                   
+            actor: UserRole = UserRole.USER, idempotency_key: str=None):                   
         from datetime import timedelta
         
         finalize_action = BookingService._validate_finalize_action(finalize_operation)
@@ -205,7 +256,8 @@ class BookingService:
         )
         
         
-    async def add_service(self, service_name: str, price: float, minutes_duration: int, description: str='', actor: UserRole = UserRole.ADMIN):        
+    @_idempotent
+    async def add_service(self, service_name: str, price: float, minutes_duration: int, description: str='', actor: UserRole = UserRole.ADMIN, idempotency_key: str=None):        
         self._is_allowed_service_operation(actor)
         
         return await self.__run__(self.CoreOperation.ADD_SERVICE, 
@@ -217,7 +269,8 @@ class BookingService:
         )
         
         
-    async def remove_service(self, service_name: str, actor: UserRole = UserRole.ADMIN):        
+    @_idempotent
+    async def remove_service(self, service_name: str, actor: UserRole = UserRole.ADMIN, idempotency_key: str=None):        
         self._is_allowed_service_operation(actor)
         
         return await self.__run__(self.CoreOperation.CANCEL_SERVICE, 
@@ -228,7 +281,8 @@ class BookingService:
             actor=actor
         )
         
-    async def update_service(self, existing_service_name: str, new_price: int|float=None, new_minutes_duration: int=None, new_description: str = None, actor: UserRole = UserRole.ADMIN):        
+    @_idempotent
+    async def update_service(self, existing_service_name: str, new_price: int|float=None, new_minutes_duration: int=None, new_description: str = None, actor: UserRole = UserRole.ADMIN, idempotency_key: str=None):        
         self._is_allowed_service_operation(actor)
         if all(e is None for e in [new_price, new_minutes_duration, new_description]):
             raise ValueError('Nothing to update')
@@ -242,7 +296,8 @@ class BookingService:
         )
         
         
-    async def finalize_add_service(self, finalize_operation: FinalizeAction, service_name: str, price: float=None, minutes_duration: int=None, description: str = '', actor: UserRole=UserRole.ADMIN):
+    @_idempotent
+    async def finalize_add_service(self, finalize_operation: FinalizeAction, service_name: str, price: float=None, minutes_duration: int=None, description: str = '', actor: UserRole=UserRole.ADMIN, idempotency_key: str=None):
         finalize_action = BookingService._validate_finalize_action(finalize_operation)
         self._is_allowed_service_operation(actor)
         
@@ -257,7 +312,8 @@ class BookingService:
         return await self.__run__(self.CoreOperation.ADD_SERVICE, finalize=finalize_action, 
             service_name = service_name, actor=actor)
        
-    async def finalize_remove_service(self, finalize_operation: FinalizeAction, service_name: str, price: float=None, minutes_duration: int=None, description: str = '', actor: UserRole=UserRole.ADMIN):
+    @_idempotent
+    async def finalize_remove_service(self, finalize_operation: FinalizeAction, service_name: str, price: float=None, minutes_duration: int=None, description: str = '', actor: UserRole=UserRole.ADMIN, idempotency_key: str=None):
         finalize_action = BookingService._validate_finalize_action(finalize_operation)
         self._is_allowed_service_operation(actor)
         
@@ -273,7 +329,8 @@ class BookingService:
             service_name = service_name, actor=actor)
         
         
-    async def finalize_update_service(self, finalize_operation: FinalizeAction, service_name: str, price: float=None, minutes_duration: int=None, description: str = '', actor: UserRole=UserRole.ADMIN):
+    @_idempotent
+    async def finalize_update_service(self, finalize_operation: FinalizeAction, service_name: str, price: float=None, minutes_duration: int=None, description: str = '', actor: UserRole=UserRole.ADMIN, idempotency_key: str=None):
         finalize_action = BookingService._validate_finalize_action(finalize_operation)
         self._is_allowed_service_operation(actor)
 
@@ -300,28 +357,26 @@ class BookingService:
         
         if start_time is not None:
             start_time = map_datetime_to_default(start_time, ignore_seconds=True)
+        reservation_manager = self.core.reservation_manager
         if reservation_id is not None:
-            matching_res = self.core.reservation_manager.get_reservation(reservation_id) 
-            potential_matching_reservations = [matching_res] if matching_res is not None else []
-        else:
-            potential_matching_reservations = self.core.reservation_manager._find_reservations_by_inner_time(start_time) if match_inner_time else self.core.reservation_manager.get_reservations_by_start_time(start_time)
+            matching_res = reservation_manager.get_reservation(reservation_id) 
+            potential_matching_reservations = [matching_res] if matching_res is not None and matching_res.user==user and (service_name is None or matching_res.service_name==service_name) else []
+        else: ## direct lookups on the (user, start_time) and (user, service_name) indexes
+            potential_matching_reservations = reservation_manager.get_user_reservations_at(user, start_time, service_name=service_name) if match_inner_time else reservation_manager.get_user_reservations_by_start_time(user, start_time, service_name=service_name)
         
         if not potential_matching_reservations:
             return None
+        ## candidates already match user and service_name: only the duration (defaulting to the service one) and the start time are left to check
+        expected_minutes_duration = minutes_duration or (self.core._get_duration_from_service_name(service_name) if service_name is not None else None)
         matching_reservations = []
         for reservation in potential_matching_reservations:
-            reservation_params = self.core._resolve_reservation_params_with_defaults(existing_reservation=reservation, start_time=start_time, service_name=service_name, minutes_duration=minutes_duration)
-            validated_start_time, validated_service_name, validated_minutes_duration = reservation_params['start_time'], reservation_params['service_name'], reservation_params['minutes_duration']
-                
-            reservation_duration = minutes_between(reservation.start_time, reservation.end_time)
-            if reservation.user!=user or reservation_duration!=validated_minutes_duration or reservation.service_name!=validated_service_name:
+            if expected_minutes_duration is not None and minutes_between(reservation.start_time, reservation.end_time)!=expected_minutes_duration:
                 continue
-            if reservation.start_time!=validated_start_time:
+            if start_time is not None and reservation.start_time!=start_time:
                 if reservation_id is not None:
-                    if not match_inner_time or validated_start_time<reservation.start_time or validated_start_time>reservation.end_time:
+                    if not match_inner_time or start_time<reservation.start_time or start_time>reservation.end_time:
                         continue
                 warnings.warn(f'Actual start time is {reservation.start_time}')  ##only happens if match_inner_time==True
-                validated_start_time = reservation.start_time
             matching_reservations.append(reservation)
         return matching_reservations
         
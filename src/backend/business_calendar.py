@@ -1,8 +1,12 @@
-import math, warnings, copy, asyncio, datetime
+import math, warnings, copy, datetime, itertools, heapq, functools
+from collections import OrderedDict
 from datetime import timedelta
 from backend.domain_errors import AlreadyBookedError
-from utils.datetimes_utils import minutes_between
+from utils.datetimes_utils import minutes_between, to_epoch_minutes, from_epoch_minutes
+from utils.range_lock import RangeLockManager
+from backend.write_log import record_slots_change, record_segments_replaced
 from enum import Enum
+from bisect import bisect_left, bisect_right
 
 
 class AlignMethod:
@@ -14,70 +18,146 @@ class AlignMethod:
 
 
 class Slot:
-    def __init__(self, start_time: datetime.datetime, is_booked: bool = False, booking_expires_at: datetime.datetime = None):
-        self.start_time = start_time  # datetime or "HH:MM" string
-        self._is_booked = is_booked
-        self._lock =  asyncio.Lock()  # Only locks THIS slot
-        self._booking_expires_at = booking_expires_at
-        
+    """
+    Lightweight view over a single slot of a Segment. It holds no booking state itself: the status is read from (and written to) the segment's occupancy bitset,
+    by using the slot offset from segment.start_time as bit index. Slots are built on demand (e.g. by Segment.get_slots_slice) and can be safely discarded.
+    """
+    __slots__ = ('segment', 'index')
+
+    def __init__(self, segment: "Segment", index: int):
+        self.segment = segment
+        self.index = index
+
+    @property
+    def start_time(self) -> datetime.datetime:
+        return self.segment._get_index_start_time(self.index)
+
+    @property
+    def _is_booked(self) -> bool:
+        return self.segment._is_index_booked(self.index)
+
+    @property
+    def _booking_expires_at(self) -> datetime.datetime:
+        return self.segment._expiries.get(self.index, None)
+
+    @_booking_expires_at.setter
+    def _booking_expires_at(self, expiry_time: datetime.datetime):
+        self.segment._set_indexes_expiry_time([self.index], expiry_time)
+
     def __repr__(self):
         status = "Booked" if self.is_booked() else "Free"
         return f"<Slot {self.start_time} - {status}>"
-        
+
+    def __eq__(self, other):
+        if not isinstance(other, Slot):
+            return False
+        return self.segment is other.segment and self.index==other.index
+
+    def __hash__(self):
+        return hash((id(self.segment), self.index))
+
     def book(self, booking_expires_at: datetime.datetime = None):
-        self._is_booked = True
-        self._booking_expires_at = booking_expires_at
+        self.segment._book_indexes([self.index], booking_expires_at)
 
     def reset(self):
-        self._is_booked = False
-        self._booking_expires_at = None
+        self.segment._free_indexes([self.index])
         return self
-        
-        
+
     def copy(self):
-        slot = Slot(start_time=self.start_time, is_booked=self._is_booked, booking_expires_at=self._booking_expires_at)
-        return slot
-    
-    
+        return Slot(segment=self.segment, index=self.index)
+
     def is_booked(self):
-        self._clear()
-        return self._is_booked
+        return self.segment._is_index_booked(self.index)
 
     def _clear(self, curr_time: datetime.datetime = None):
-        if not self._booking_expires_at:
-            return
-        if curr_time is None:
-            curr_time = datetime.datetime.now(tz=getattr(self._booking_expires_at, 'tzinfo', None))
-        if curr_time>self._booking_expires_at:
-            self.reset()
-            
+        self.segment._clear_expired(curr_time=curr_time, indexes=[self.index])
+
+
+
+_AVAILABILITY_CACHE_MAX_ENTRIES = 512
+
+## containers shared by the untouched segments (never modified in place, see Segment._own_container)
+_NO_EXPIRIES = {}
+_NO_CONTAINERS, _ALL_CONTAINERS = frozenset(), frozenset({'_expiries', '_free_intervals'})
+
+@functools.lru_cache(maxsize=None)
+def _get_untouched_free_intervals(n_slots: int) -> list[tuple[int, int]]:
+    return [(0, n_slots)] if n_slots > 0 else []
+
+
+def _indexes_to_mask(indexes) -> int:
+    mask = 0
+    for i in indexes:
+        mask |= 1 << i
+    return mask
+
+def _range_mask(start_idx: int, end_idx: int) -> int:
+    """ Returns the bitmask covering the slot indexes in [start_idx, end_idx) """
+    if end_idx <= start_idx:
+        return 0
+    return ((1 << (end_idx - start_idx)) - 1) << start_idx
 
 
 class Segment:
     """
     Segment is a collection of fixed duration' slots, ranging from start_time to end_time. 
+    Slots occupancy is stored as an integer bitset: bit i is set if the slot starting at start_time + i*slot_duration is booked.
+    Pending bookings expiry times are stored (sparsely) by slot index in _expiries.
+    The maximal free intervals are kept in _free_intervals as a sorted list of (first_idx, last_idx+1) tuples, updated at each booking/release,
+    together with the number of free slots (_n_free_slots) and the longest free run (_max_free_run).
+    Copies are copy-on-write: the bitset is an immutable int, while _expiries and _free_intervals are shared with the copies
+    until one of them is modified (the instances owning a private container are tracked in _owned_containers).
+    Segments are materialized lazily: an untouched segment is described by (start_time, end_time, slot_duration) only, 
+    its containers being module-level shared ones, until the first booking.
+    start_time and end_time are also kept as epoch minutes (_start_minute, _end_minute), the internal time keys for comparisons and slot offsets.
+    _version is bumped at each booking/release of its slots (or change of their expiry time): cached query results tagged with it are stale as soon as it changes.
     """
+    __slots__ = ('start_time', 'end_time', '_start_minute', '_end_minute', 'slot_duration', 'n_slots', '_booked', '_expiries', '_free_intervals', '_n_free_slots', '_max_free_run', '_owned_containers', '_is_generated', '_version')
+
     def __init__(self, start_time: datetime.datetime, end_time: datetime.datetime, slot_duration: int = 5, force_past_slots: bool = True):
         if start_time>= end_time:
             raise ValueError('End time must be after start time')
         object.__setattr__(self, 'start_time', start_time)
         object.__setattr__(self, 'end_time', end_time)
         object.__setattr__(self, 'slot_duration', slot_duration)
-        object.__setattr__(self, 'slots', [])
+        object.__setattr__(self, 'n_slots', 0)
+        object.__setattr__(self, '_booked', 0)
+        object.__setattr__(self, '_expiries', _NO_EXPIRIES)
+        object.__setattr__(self, '_free_intervals', _get_untouched_free_intervals(0))
+        object.__setattr__(self, '_n_free_slots', 0)
+        object.__setattr__(self, '_max_free_run', 0)
+        object.__setattr__(self, '_owned_containers', _NO_CONTAINERS)
+        object.__setattr__(self, '_version', 0)
+        self._set_time_keys()
 
         self.__generate_slots__(force_past_slots=force_past_slots)
-        self._update_time_index_map()
-    
-    def _update_time_index_map(self):
-        time_index_map = {slot.start_time:i for i,slot in enumerate(self.slots)}
-        object.__setattr__(self, '__time_index_map__', time_index_map)
+
+    @property
+    def slots(self) -> list[Slot]:
+        return [Slot(self, i) for i in range(self.n_slots)]
+
+    def _get_index_start_time(self, index: int) -> datetime.datetime:
+        return self.start_time + timedelta(minutes=index*self.slot_duration)
+
+    def _set_time_keys(self):
+        object.__setattr__(self, '_start_minute', to_epoch_minutes(self.start_time))
+        object.__setattr__(self, '_end_minute', to_epoch_minutes(self.end_time))
+
+    def _get_slots_offset(self, datetime_obj: datetime.datetime) -> float:
+        """ Returns the (possibly fractional) number of slots between self.start_time and datetime_obj """
+        return self._get_minute_slots_offset(to_epoch_minutes(datetime_obj))
+
+    def _get_minute_slots_offset(self, minute: int|float) -> float:
+        """ Same as _get_slots_offset, for a time given as epoch minutes """
+        return (minute - self._start_minute) / self.slot_duration
 
     def get_slot(self, start_time: datetime.datetime, return_index: bool = False):
-        """Get a slot by datetime (O(1) lookup)."""
-        idx = self.__time_index_map__.get(start_time)
-        if idx is not None:
-            return self.slots[idx] if not return_index else idx
-        return None
+        """Get a slot by datetime (O(1) index arithmetic)."""
+        offset = self._get_slots_offset(start_time)
+        idx = int(offset)
+        if idx!=offset or not 0 <= idx < self.n_slots:
+            return None
+        return Slot(self, idx) if not return_index else idx
 
     def join(self, other_segment: "Segment", copy: bool = True):
         if other_segment.slot_duration!=self.slot_duration:
@@ -87,27 +167,44 @@ class Segment:
         if self.end_time == other_segment.start_time:
             # Merge forward
             object.__setattr__(joined_segment, 'end_time', other_segment.end_time)
-            object.__setattr__(joined_segment, 'slots', [s.copy() for s in self.slots] + [s.copy() for s in other_segment.slots])
+            first_segment, second_segment = self, other_segment
         elif other_segment.end_time == self.start_time:
             # Merge backward
             object.__setattr__(joined_segment, 'start_time', other_segment.start_time)
-            object.__setattr__(joined_segment, 'slots', [s.copy() for s in other_segment.slots] + [s.copy() for s in self.slots])
+            first_segment, second_segment = other_segment, self
         else:
             raise ValueError("Segments are not exactly adjacent. Cannot join.")
+        joined_segment._set_time_keys()
 
-        joined_segment._update_time_index_map()
+        shift = first_segment.n_slots
+        object.__setattr__(joined_segment, 'n_slots', first_segment.n_slots + second_segment.n_slots)
+        object.__setattr__(joined_segment, '_booked', first_segment._booked | (second_segment._booked << shift))
+        object.__setattr__(joined_segment, '_expiries', first_segment._expiries | {i+shift: e for i,e in second_segment._expiries.items()})
+        joined_intervals = list(first_segment._free_intervals)
+        for interval_start, interval_end in second_segment._free_intervals:
+            if joined_intervals and joined_intervals[-1][1] == interval_start + shift: ## free run across the junction
+                joined_intervals[-1] = (joined_intervals[-1][0], interval_end + shift)
+            else:
+                joined_intervals.append((interval_start + shift, interval_end + shift))
+        object.__setattr__(joined_segment, '_free_intervals', joined_intervals)
+        object.__setattr__(joined_segment, '_n_free_slots', first_segment._n_free_slots + second_segment._n_free_slots)
+        object.__setattr__(joined_segment, '_max_free_run', max((e-s for s,e in joined_intervals), default=0))
+        object.__setattr__(joined_segment, '_owned_containers', _ALL_CONTAINERS)
         if not copy:
             self = joined_segment
         return joined_segment
 
+    def _get_indexes_slice(self, start_time: datetime.datetime, end_time: datetime.datetime) -> tuple[int, int]:
+        """ Returns (start_idx, end_idx) of the slots overlapping [start_time, end_time) """
+        start_idx = min(max(0, math.floor(self._get_slots_offset(start_time))), self.n_slots)
+        end_idx = min(max(0, math.ceil(self._get_slots_offset(end_time))), self.n_slots)
+        return start_idx, end_idx
+
     def get_slots_slice(self, start_time: datetime.datetime, end_time: datetime.datetime):
         if start_time>self.end_time or end_time<self.start_time:
             return []
-            
-        start_idx = self.__time_index_map__[start_time] if start_time in self.__time_index_map__ else max(0, bisect_right(self.slots, start_time, key=lambda s: s.start_time)-1)
-        end_idx = self.__time_index_map__[end_time] if end_time in self.__time_index_map__ else bisect_left(self.slots, end_time, key=lambda s: s.start_time)
-        
-        return self.slots[start_idx:end_idx]
+        start_idx, end_idx = self._get_indexes_slice(start_time, end_time)
+        return [Slot(self, i) for i in range(start_idx, end_idx)]
 
     def get_subsegment(self, start_time: datetime.datetime, end_time: datetime.datetime):
         if start_time < self.start_time or end_time > self.end_time:
@@ -117,13 +214,157 @@ class Segment:
         if start_time==self.start_time and end_time==self.end_time:
             return self.copy()
         
+        start_idx, end_idx = self._get_indexes_slice(start_time, end_time)
         subsegment = self.copy()
         object.__setattr__(subsegment, 'start_time', start_time)
         object.__setattr__(subsegment, 'end_time', end_time)
-        object.__setattr__(subsegment, 'slots', self.get_slots_slice(start_time=start_time, end_time=end_time))
-        subsegment._update_time_index_map()
+        subsegment._set_time_keys()
+        object.__setattr__(subsegment, 'n_slots', max(0, end_idx-start_idx))
+        object.__setattr__(subsegment, '_booked', (self._booked & _range_mask(start_idx, end_idx)) >> start_idx)
+        object.__setattr__(subsegment, '_expiries', {i-start_idx: e for i,e in self._expiries.items() if start_idx <= i < end_idx})
+        sub_intervals = [(s-start_idx, e-start_idx) for s,e in self._iter_free_intervals(start_idx, end_idx)]
+        object.__setattr__(subsegment, '_free_intervals', sub_intervals)
+        object.__setattr__(subsegment, '_n_free_slots', sum(e-s for s,e in sub_intervals))
+        object.__setattr__(subsegment, '_max_free_run', max((e-s for s,e in sub_intervals), default=0))
+        object.__setattr__(subsegment, '_owned_containers', _ALL_CONTAINERS)
         return subsegment
 
+    def _is_index_booked(self, index: int) -> bool:
+        return bool((self._booked >> index) & 1)
+
+    def _any_booked_indexes(self, indexes: list[int]) -> bool:
+        return bool(self._booked & _indexes_to_mask(indexes))
+
+    def _is_range_free(self, start_idx: int, end_idx: int) -> bool:
+        return not (self._booked & _range_mask(start_idx, end_idx))
+
+    def _iter_free_intervals(self, start_idx: int = 0, end_idx: int = None):
+        """ Yields the maximal free intervals (as (first_idx, last_idx+1) tuples) of the slots in [start_idx, end_idx), ordered by start. """
+        if end_idx is None:
+            end_idx = self.n_slots
+        if end_idx <= start_idx:
+            return
+        for i in range(bisect_right(self._free_intervals, start_idx, key=lambda interval: interval[1]), len(self._free_intervals)):
+            interval_start, interval_end = self._free_intervals[i]
+            if interval_start >= end_idx:
+                return
+            yield max(start_idx, interval_start), min(end_idx, interval_end)
+
+    def _scan_free_intervals(self, start_idx: int = 0, end_idx: int = None) -> list[tuple[int, int]]:
+        """ Computes the maximal free intervals of the slots in [start_idx, end_idx) straight from the occupancy bitset. """
+        if end_idx is None:
+            end_idx = self.n_slots
+        intervals = []
+        if end_idx <= start_idx:
+            return intervals
+        window_len = end_idx - start_idx
+        window_booked = (self._booked >> start_idx) & _range_mask(0, window_len)
+        window_free = ~window_booked & _range_mask(0, window_len)
+        while window_free:
+            interval_start = (window_free & -window_free).bit_length() - 1
+            booked_after = window_booked >> interval_start
+            interval_end = window_len if not booked_after else interval_start + (booked_after & -booked_after).bit_length() - 1
+            intervals.append((start_idx + interval_start, start_idx + interval_end))
+            window_free &= ~_range_mask(0, interval_end)
+        return intervals
+
+    def _rebuild_free_intervals(self):
+        object.__setattr__(self, '_free_intervals', self._scan_free_intervals())
+        object.__setattr__(self, '_owned_containers', self._owned_containers | {'_free_intervals'})
+        object.__setattr__(self, '_n_free_slots', sum(e-s for s,e in self._free_intervals))
+        object.__setattr__(self, '_max_free_run', max((e-s for s,e in self._free_intervals), default=0))
+
+    def _update_free_intervals(self, start_idx: int, end_idx: int):
+        """ 
+        Updates the free intervals index after a status change on slots in [start_idx, end_idx).
+        The intervals overlapping or adjacent to the changed range are replaced by a rescan of the bitset on the region they cover, the other ones are untouched.
+        """
+        self._own_container('_free_intervals')
+        first_involved = bisect_left(self._free_intervals, start_idx, key=lambda interval: interval[1])
+        last_involved = bisect_right(self._free_intervals, end_idx, key=lambda interval: interval[0])
+        involved_intervals = self._free_intervals[first_involved:last_involved]
+        region_start = min(start_idx, involved_intervals[0][0]) if involved_intervals else start_idx
+        region_end = max(end_idx, involved_intervals[-1][1]) if involved_intervals else end_idx
+        region_intervals = self._scan_free_intervals(region_start, region_end)
+        self._free_intervals[first_involved:last_involved] = region_intervals
+        n_free_slots_delta = sum(e-s for s,e in region_intervals) - sum(e-s for s,e in involved_intervals)
+        object.__setattr__(self, '_n_free_slots', self._n_free_slots + n_free_slots_delta)
+        object.__setattr__(self, '_max_free_run', max((e-s for s,e in self._free_intervals), default=0))
+
+    def _find_first_free_start(self, from_idx: int, n_slots_needed: int, grid_step: int = 1) -> int:
+        """ Returns the first index >= from_idx, multiple of grid_step, followed by >= n_slots_needed free slots. None if there is none. """
+        if n_slots_needed > self._max_free_run:
+            return None
+        for interval_start, interval_end in self._iter_free_intervals(start_idx=max(0, from_idx)):
+            candidate_start = interval_start + (-interval_start % grid_step)
+            if candidate_start + n_slots_needed <= interval_end:
+                return candidate_start
+        return None
+
+    def _iter_free_starts(self, n_slots_needed: int, grid_step: int = 1, start_idx: int = 0, end_idx: int = None, reverse: bool = False):
+        """ Yields the grid aligned indexes in [start_idx, end_idx) followed by >= n_slots_needed free slots, in ascending (or descending if reverse) order. """
+        if end_idx is None:
+            end_idx = self.n_slots
+        if n_slots_needed > self._max_free_run:
+            return
+        intervals = list(self._iter_free_intervals(start_idx=max(0, start_idx)))
+        for interval_start, interval_end in (reversed(intervals) if reverse else intervals):
+            first_start, last_start = interval_start + (-interval_start % grid_step), min(interval_end - n_slots_needed, end_idx - 1)
+            if first_start > last_start:
+                continue
+            if reverse:
+                yield from range(last_start - (last_start - first_start) % grid_step, first_start - 1, -grid_step)
+            else:
+                yield from range(first_start, last_start + 1, grid_step)
+
+    def _book_indexes(self, indexes: list[int], expiry_time: datetime.datetime = None):
+        object.__setattr__(self, '_booked', self._booked | _indexes_to_mask(indexes))
+        object.__setattr__(self, '_version', self._version + 1)
+        if indexes:
+            self._update_free_intervals(min(indexes), max(indexes)+1)
+        if expiry_time is not None or self._expiries:
+            self._own_container('_expiries')
+        for i in indexes:
+            if expiry_time is None:
+                self._expiries.pop(i, None)
+            else:
+                self._expiries[i] = expiry_time
+
+    def _free_indexes(self, indexes: list[int]):
+        object.__setattr__(self, '_booked', self._booked & ~_indexes_to_mask(indexes))
+        object.__setattr__(self, '_version', self._version + 1)
+        if indexes:
+            self._update_free_intervals(min(indexes), max(indexes)+1)
+        if self._expiries:
+            self._own_container('_expiries')
+        for i in indexes:
+            self._expiries.pop(i, None)
+
+    def _set_indexes_expiry_time(self, indexes: list[int], expiry_time: datetime.datetime = None):
+        object.__setattr__(self, '_version', self._version + 1)
+        self._own_container('_expiries')
+        for i in indexes:
+            if expiry_time is None:
+                self._expiries.pop(i, None)
+            else:
+                self._expiries[i] = expiry_time
+
+    def _clear_expired(self, curr_time: datetime.datetime = None, indexes: list[int] = None):
+        """ 
+        Frees the pending bookings whose expiry time is past. If indexes is given, only checks such slots indexes.
+        Not used on the query paths: BusinessCalendar releases the expired bookings in batches through its expiry heap (see BusinessCalendar._release_expired_bookings).
+        """
+        if not self._expiries:
+            return
+        candidates = self._expiries.items() if indexes is None else [(i, self._expiries[i]) for i in indexes if i in self._expiries]
+        if not candidates:
+            return
+        if curr_time is None:
+            curr_time = datetime.datetime.now(tz=getattr(next(iter(candidates))[1], 'tzinfo', None))
+        expired_indexes = [i for i,expiry_time in candidates if curr_time>expiry_time]
+        if expired_indexes:
+            self._free_indexes(expired_indexes)
+
     def timedelta_mismatch_from_previous_default(self, datetime_obj: datetime.datetime, default_minutes_grid_range: int = None):
         """
         Returns the mismatch from immediate previous slot.
@@ -140,30 +381,46 @@ class Segment:
         return not bool(self.timedelta_mismatch_from_previous_default(datetime_obj))
        
     def align_to_slot(self, datetime_obj: datetime.datetime, how: AlignMethod):
-        datetime_obj = datetime_obj.astimezone(self.start_time.tzinfo)
-        if datetime_obj < self.start_time:
-            if how==AlignMethod.NEXT:
-                return self.start_time
-            return None
-        if datetime_obj > self.end_time:
-            if how==AlignMethod.PREVIOUS:
-                return self.end_time
+        aligned_offset = self._align_minute_to_slot_offset(to_epoch_minutes(datetime_obj), how=how)
+        if aligned_offset is None:
             return None
-        
-        curr_timedelta_mismatch = self.timedelta_mismatch_from_previous_default(datetime_obj)   
-        if not curr_timedelta_mismatch:
-            return datetime_obj
-            
-        prev_slot_dt = datetime_obj - curr_timedelta_mismatch
-        return prev_slot_dt if how==AlignMethod.PREVIOUS else prev_slot_dt + timedelta(minutes=self.slot_duration)
+        return self.start_time + timedelta(minutes=aligned_offset*self.slot_duration)
+
+    def _align_minute_to_slot_offset(self, minute: int|float, how: AlignMethod):
+        """ align_to_slot on epoch minutes: returns the slots offset from start_time of the aligned time (fractional only when aligned to a not aligned end_time), None if there is none. """
+        if minute < self._start_minute:
+            return 0 if how==AlignMethod.NEXT else None
+        if minute > self._end_minute:
+            return self._get_minute_slots_offset(self._end_minute) if how==AlignMethod.PREVIOUS else None
+        offset = self._get_minute_slots_offset(minute)
+        return math.floor(offset) if how==AlignMethod.PREVIOUS else math.ceil(offset)
     
+    def _own_container(self, attribute: str):
+        """ Copy-on-write: replaces the (possibly shared) container with a private copy before its first modification. """
+        if attribute in self._owned_containers:
+            return
+        object.__setattr__(self, attribute, copy.copy(getattr(self, attribute)))
+        object.__setattr__(self, '_owned_containers', self._owned_containers | {attribute})
+
     def copy(self):
-        other = copy.copy(self)
-        object.__setattr__(other, 'slots', [s.copy() for s in other.slots])
+        """ O(1) copy: the containers are shared with the copy (_booked is an int, hence immutable) and get duplicated by whichever instance modifies them first. """
+        other = object.__new__(type(self))
+        for attribute in Segment.__slots__:
+            object.__setattr__(other, attribute, getattr(self, attribute))
+        object.__setattr__(self, '_owned_containers', _NO_CONTAINERS)
+        object.__setattr__(other, '_owned_containers', _NO_CONTAINERS)
         return other
         
+    def __getstate__(self):
+        return {attribute: getattr(self, attribute) for attribute in Segment.__slots__ if hasattr(self, attribute)}
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_version', 0) ## missing in segments pickled before its introduction
+        for attribute, value in state.items():
+            object.__setattr__(self, attribute, value)
+
     def __repr__(self):
-        return f"<Segment - from {self.start_time} to {self.end_time}. Contains {len(self.slots)} slots)>"
+        return f"<Segment - from {self.start_time} to {self.end_time}. Contains {self.n_slots} slots)>"
 
     def __setattr__(self, attribute, value):
         raise ValueError(f'Cannot set attribute {attribute}. It is final')
@@ -171,12 +428,13 @@ class Segment:
     def __generate_slots__(self, force_past_slots: bool = True):
         """ If force_past_slots is False, only generates slots from max(start_time, current_time + minimum_advance_booking_minutes) on. 
         If start_time < curr_time, sets self.start_time = curr_time. 
+        Slots are not materialized: only the number of slots fitting in [start_time, end_time] is computed, all of them free.
         """
         if getattr(self, '_is_generated', False) is True:
             return
 
         object.__setattr__(self, '_is_generated', True)
-        object.__setattr__(self, 'slots', [])
+        object.__setattr__(self, 'n_slots', 0)
 
         if not force_past_slots:
             curr_time = datetime.now(tz=self.end_time.tzinfo)
@@ -193,29 +451,85 @@ class Segment:
                 starting_minute = starting_time_minutes % 60
                 print(starting_hour, starting_minute)
                 object.__setattr__(self, 'start_time', curr_time.replace(hour=starting_hour, minute=starting_minute))
+                self._set_time_keys()
             if self.end_time <= self.start_time:
                 warnings.warn('End time is too close or already past. Nothing to generate')
                 object.__setattr__(self, 'start_time', self.end_time)
+                self._set_time_keys()
                 return []
         
-        current = self.start_time
-        while current + timedelta(minutes=self.slot_duration) <= self.end_time:
-            self.slots.append(Slot(current))
-            current += timedelta(minutes=self.slot_duration)
+        object.__setattr__(self, 'n_slots', math.floor(self._get_slots_offset(self.end_time)))
+        object.__setattr__(self, '_free_intervals', _get_untouched_free_intervals(self.n_slots))
+        object.__setattr__(self, '_n_free_slots', self.n_slots)
+        object.__setattr__(self, '_max_free_run', self.n_slots)
 
 
-from bisect import bisect_left, bisect_right
+
+class _MaxSegmentTree:
+    """ Array-based max segment tree over a fixed number of positions: point updates and 'first position >= from_pos with value >= min_value' queries, both O(log n). """
+    def __init__(self, values: list[int]):
+        self.size = 1
+        while self.size < max(1, len(values)):
+            self.size *= 2
+        self.tree = [0] * (2*self.size)
+        self.tree[self.size:self.size+len(values)] = values
+        for node in range(self.size-1, 0, -1):
+            self.tree[node] = max(self.tree[2*node], self.tree[2*node+1])
+
+    def update(self, pos: int, value: int):
+        node = self.size + pos
+        self.tree[node] = value
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2*node], self.tree[2*node+1])
+            node //= 2
+
+    def find_first(self, from_pos: int, min_value: int) -> int:
+        """ Returns the first position >= from_pos whose value is >= min_value, None if there is none. """
+        if from_pos >= self.size or self.tree[1] < min_value:
+            return None
+        node = self.size + from_pos
+        if self.tree[node] >= min_value:
+            return from_pos
+        ## climbing up until a right sibling subtree contains a valid value
+        while True:
+            if node == 1:
+                return None
+            if node % 2 == 0 and self.tree[node+1] >= min_value:
+                node += 1
+                break
+            node //= 2
+        ## descending to the leftmost valid leaf
+        while node < self.size:
+            node = 2*node if self.tree[2*node] >= min_value else 2*node+1
+        return node - self.size
+
 
 
 class BusinessCalendar:
     def __init__(self, slot_minutes_duration: int = 5):
         self.slot_minutes_duration = slot_minutes_duration
         self.segments = []
+        self._free_runs_tree = None ## lazily built over self.segments: max free run by segment position
+        self._free_runs_tree_segments = None
+        self._time_keys = None ## lazily built (start minutes, end minutes) of self.segments: bisected in place of the segments datetimes
+        self._time_keys_segments = None
+        self._daily_free_counters = None ## lazily built: date -> (n free slots, longest free run) of the day segments, updated at each booking/release
+        self._daily_segments = None ## date -> segments starting on such (business timezone) date
+        self._daily_counters_segments = None
+        self._expiry_heap = [] ## min-heap of (expiry_time, seq, segment, slots indexes) for the pending bookings, rebuilt whenever self.segments is replaced
+        self._expiry_heap_segments = self.segments
+        self._expiry_seq = 0
+        self._availability_cache = OrderedDict() ## LRU: (min start minute, max start minute, duration, grid span, split_by_segment) -> (involved segments and versions, result)
+        self._availability_cache_segments = self.segments
+        self.availability_cache_hits, self.availability_cache_misses = 0, 0
+        self._range_locks = RangeLockManager()
+        self._changed_segments = None ## segments booked/released since the last pop_changed_segments. None if the segments themselves changed meanwhile (or never popped)
         #self._update_time_index_map()
 
 
     def add_segment(self, segment: Segment):
-        idx = bisect_left(self.segments, segment.start_time, key=lambda x: x.start_time)
+        idx = bisect_left(self._get_time_keys()[0], segment._start_minute)
         # Check left neighbor no-overlaps
         prev_elem_to_del, follow_elem_to_del = False, False
         if idx > 0:
@@ -244,16 +558,90 @@ class BusinessCalendar:
             del self.segments[idx]
 
         self.segments.insert(idx, segment)
+        self._changed_segments = None
+        record_segments_replaced()
+        self._free_runs_tree = None
+        self._time_keys = None
+        self._daily_free_counters = None
+        self._availability_cache.clear()
+        self._schedule_segment_expiries(segment)
         return True
         
     def add_new_segment(self, start_time: datetime.datetime, end_time: datetime.datetime, force_past_slots: bool = True):
         new_segment = Segment(start_time=start_time, end_time=end_time, slot_duration=self.slot_minutes_duration, force_past_slots=force_past_slots)
         return self.add_segment(new_segment)
 
+    def add_segments(self, segments: list[Segment]):
+        """
+        Bulk sorted insert: merges the new segments with the current (sorted) ones in a single pass, joining the adjacent ones.
+        Appending segments that all follow the last one (e.g. the next days of a rolling calendar) costs O(len(segments)).
+        Existing segments are kept as they are (not copied), unless joined with an adjacent new one.
+        Raises ValueError if any overlap is detected, leaving the calendar unchanged.
+        """
+        new_segments = sorted(segments, key=lambda x: x.start_time)
+        if not new_segments:
+            return False
+        self._changed_segments = None
+        record_segments_replaced()
+
+        def _append(sorted_segments: list[Segment], new_segment: Segment): ##appends by checking adjacency and overlaps
+            if sorted_segments and new_segment.start_time < sorted_segments[-1].end_time:
+                raise ValueError(f"Overlap detected between {sorted_segments[-1]} and {new_segment}")
+            if sorted_segments and new_segment.start_time == sorted_segments[-1].end_time:
+                sorted_segments[-1] = sorted_segments[-1].join(new_segment)
+            else:
+                sorted_segments.append(new_segment)
+
+        if not self.segments or self.segments[-1].end_time < new_segments[0].start_time:
+            appended_segments = []
+            for segment in new_segments:
+                _append(appended_segments, segment)
+            if self._time_keys is not None and self._time_keys_segments is self.segments:
+                self._time_keys[0].extend(segment._start_minute for segment in appended_segments)
+                self._time_keys[1].extend(segment._end_minute for segment in appended_segments)
+            self.segments.extend(appended_segments) ## in place: the expiry heap and the time keys stay valid, only the new segments need scheduling
+            for segment in appended_segments:
+                self._schedule_segment_expiries(segment)
+            self._free_runs_tree = None
+            self._daily_free_counters = None
+            self._availability_cache.clear()
+            return True
+
+        first_involved_idx = bisect_right(self._get_time_keys()[1], new_segments[0]._start_minute)
+        if first_involved_idx:
+            first_involved_idx -= 1 ## previous segment may be adjacent to the first new one
+        final_segments = self.segments[:first_involved_idx]
+        old_segments, i, j = self.segments, first_involved_idx, 0
+        while i < len(old_segments) or j < len(new_segments):
+            if j == len(new_segments) or (i < len(old_segments) and old_segments[i].start_time <= new_segments[j].start_time):
+                _append(final_segments, old_segments[i])
+                i += 1
+            else:
+                _append(final_segments, new_segments[j])
+                j += 1
+
+        self.segments = final_segments ## new list -> free runs tree and expiry heap are rebuilt on next query
+        return True
+
+    def evict_segments_before(self, end_time: datetime.datetime) -> list[Segment]:
+        """
+        Removes the segments fully past end_time (i.e. whose end_time <= end_time), returning them sorted.
+        Their pending bookings are dropped from the expiry heap as well, since it is rebuilt on the new segments list.
+        """
+        n_to_evict = bisect_right(self._get_time_keys()[1], to_epoch_minutes(end_time))
+        if not n_to_evict:
+            return []
+        evicted_segments = self.segments[:n_to_evict]
+        self.segments = self.segments[n_to_evict:]
+        self._changed_segments = None
+        record_segments_replaced()
+        return evicted_segments
+
 
     def remove_segment(self, start_time: datetime.datetime, end_time: datetime.datetime, raise_error_if_any_booking: bool = True):
         if end_time<=self.segments[0].start_time or start_time >= self.segments[-1].end_time:
             return
+        self._release_expired_bookings()
         
         first_segment_involved_idx, last_segment_involved_idx = self._get_segments_involved(start_time=start_time, end_time=end_time, return_index=True)
         segments_involved = self.segments[first_segment_involved_idx:last_segment_involved_idx]
@@ -277,46 +665,61 @@ class BusinessCalendar:
         final_segments.extend(self.segments[last_segment_involved_idx:])
 
         self.segments = final_segments
+        self._changed_segments = None
+        record_segments_replaced()
+        self._free_runs_tree = None
         return
    
 
     def find_segment_by_start_time(self, start_time: datetime.datetime):
-        idx = bisect_left(self.segments, start_time, key=lambda s: s.start_time)
+        start_minute = to_epoch_minutes(start_time)
+        segments_start_minutes = self._get_time_keys()[0]
+        idx = bisect_left(segments_start_minutes, start_minute)
         # idx points to the first segment whose start_time >= target_start_time
-        if idx < len(self.segments):
-            curr_segment = self.segments[idx]
-            if curr_segment.start_time == start_time:
-                return curr_segment
+        if idx < len(self.segments) and segments_start_minutes[idx] == start_minute:
+            return self.segments[idx]
         return None  # not found
     
 
     def find_segment_containing(self, start_time: datetime.datetime, end_time: datetime.datetime, return_index: bool = False):
         if start_time > end_time:
             return None
+        self._release_expired_bookings()
+        start_minute, end_minute = to_epoch_minutes(start_time), to_epoch_minutes(end_time)
+        segments_start_minutes, segments_end_minutes = self._get_time_keys()
         # Find the index of the first segment whose start_time is > start_time
-        idx = bisect_right(self.segments, start_time, key=lambda s: s.start_time) - 1
-        if idx >= 0:
-            matching_segment = self.segments[idx]
-            if matching_segment.start_time <= start_time and end_time <= matching_segment.end_time:
-                return matching_segment if not return_index else idx
+        idx = bisect_right(segments_start_minutes, start_minute) - 1
+        if idx >= 0 and end_minute <= segments_end_minutes[idx]:
+            return self.segments[idx] if not return_index else idx
         return None
 
     def _get_segments_involved(self, start_time: datetime.datetime, end_time: datetime.datetime, return_index: bool = False):
-        first_segment_involved_idx = bisect_right(self.segments, start_time, key=lambda x:x.end_time)
-        last_segment_involved_idx = bisect_left(self.segments, end_time, key=lambda x:x.start_time)
+        first_segment_involved_idx, last_segment_involved_idx = self._get_segment_positions_involved(to_epoch_minutes(start_time), to_epoch_minutes(end_time))
         if return_index:
             return first_segment_involved_idx, last_segment_involved_idx
         return self.segments[first_segment_involved_idx:last_segment_involved_idx]
+
+    def _get_segment_positions_involved(self, start_minute: int|float, end_minute: int|float) -> tuple[int, int]:
+        """ Returns the [first, last) positions in self.segments of the segments overlapping [start_minute, end_minute) (epoch minutes). """
+        segments_start_minutes, segments_end_minutes = self._get_time_keys()
+        return bisect_right(segments_end_minutes, start_minute), bisect_left(segments_start_minutes, end_minute)
+
+    def _get_time_keys(self) -> tuple[list[int], list[int]]:
+        if self._time_keys is None or self._time_keys_segments is not self.segments:
+            self._time_keys = ([segment._start_minute for segment in self.segments], [segment._end_minute for segment in self.segments])
+            self._time_keys_segments = self.segments
+        return self._time_keys
         
     def is_available_timeframe(self, start_time: datetime.datetime, end_time: datetime.datetime, as_int_error: bool = False):
         segment = self.find_segment_containing(start_time, end_time)
         if not segment:
             return -1 if as_int_error else False
-        needed_slots = segment.get_slots_slice(start_time=start_time, end_time=end_time)
-        return not any(slot.is_booked() for slot in needed_slots)
+        start_idx, end_idx = segment._get_indexes_slice(start_time=start_time, end_time=end_time)
+        return segment._is_range_free(start_idx, end_idx)
 
 
     def get_slots(self, start_time: datetime.datetime, end_time: datetime.datetime, same_segment_only: bool = False):
+        self._release_expired_bookings()
         slots_found=[]
         if same_segment_only:
             matched_segment = self.find_segment_containing(start_time=start_time, end_time=end_time)
@@ -330,6 +733,23 @@ class BusinessCalendar:
                
         return slots_found
 
+    @property
+    def n_resources(self) -> int:
+        """ Number of resources (e.g. chairs) able to host a booking at the same time: a BusinessCalendar is a single resource one (see MultiResourceCalendar). """
+        return 1
+
+    def get_booked_slots(self, start_time: datetime.datetime, end_time: datetime.datetime, resource: int = None) -> list[Slot]:
+        """ Returns the slots of the booking [start_time, end_time) made on resource. Single resource calendar: same as get_slots(same_segment_only=True). """
+        return self.get_slots(start_time=start_time, end_time=end_time, same_segment_only=True)
+
+    def iter_resources_slots(self, start_time: datetime.datetime, end_time: datetime.datetime, preferred_resource: int = None):
+        """ Yields the slots of [start_time, end_time) on each resource, preferred_resource first. Single resource calendar: yields get_slots(same_segment_only=True) only. """
+        yield self.get_slots(start_time=start_time, end_time=end_time, same_segment_only=True)
+
+    def get_slots_resource(self, slots: list[Slot]) -> int:
+        """ Returns the resource the slots belong to. Single resource calendar: always 0. """
+        return 0
+
     def get_available_booking_slots(self, minutes_duration: int, min_start_time: datetime.datetime, max_start_time: datetime.datetime, minutes_grid_span: int = 15, split_by_segment: bool = True):
         """
         Returns all the slots groups which total duration is >= duration.
@@ -337,109 +757,327 @@ class BusinessCalendar:
         start_time: filtering start_time - will only look for slots after it.
         end_time: filtering end_time - will only look for slots before it.
         minutes_grid_span: will only return slots that start at segment.start_time + k * minutes_grid_span
+        Runs a single pass over the free intervals of each involved segment (see _get_available_start_indexes), instead of checking every slots' group.
+        """
+        return self.get_available_booking_slots_batch(minutes_durations=[minutes_duration], min_start_time=min_start_time, max_start_time=max_start_time,
+                                                      minutes_grid_span=minutes_grid_span, split_by_segment=split_by_segment)[minutes_duration]
+
+    def get_available_booking_slots_batch(self, minutes_durations: list[int], min_start_time: datetime.datetime, max_start_time: datetime.datetime, minutes_grid_span: int = 15, split_by_segment: bool = True) -> dict:
+        """
+        Same as get_available_booking_slots, for several durations at once: returns {minutes_duration: get_available_booking_slots output}.
+        The involved segments (and their free intervals) are walked once for all the durations, see _get_available_start_indexes_batch.
+        Results are cached by (window, duration, grid span) and tagged with the versions of the involved segments: a cached result is reused until
+        a booking/release (or expiry) touches one of them, or the segments change. Cached results are shared, hence must not be modified by callers.
         """
-        from utils.datetimes_utils import map_datetime_to_default
         if minutes_grid_span%self.slot_minutes_duration or minutes_grid_span<=0:
             raise ValueError(f'Grid span must be a multiple of {self.slot_minutes_duration}')
-        if max_start_time<min_start_time:
-            return ([], [])
+        minutes_durations = sorted(set(minutes_durations))
+        if max_start_time<min_start_time or not minutes_durations:
+            return {minutes_duration: ([], []) for minutes_duration in minutes_durations}
 
-        n_slots_needed = math.ceil(minutes_duration / self.slot_minutes_duration)
-        available_default_slots, available_special_slots = [], []
-        segments_involved = self._get_segments_involved(start_time=min_start_time, end_time=max_start_time+timedelta(minutes=minutes_duration))
-        for segment in segments_involved:
-            aligned_min_start_time = segment.align_to_slot(min_start_time, how=AlignMethod.NEXT)
-            aligned_max_start_time = segment.align_to_slot(max_start_time, how=AlignMethod.PREVIOUS)
-            if aligned_min_start_time is None or aligned_max_start_time is None or aligned_min_start_time>aligned_max_start_time:
+        self._release_expired_bookings()
+        if self._availability_cache_segments is not self.segments:
+            self._availability_cache.clear()
+            self._availability_cache_segments = self.segments
+        min_start_minute, max_start_minute = to_epoch_minutes(min_start_time), to_epoch_minutes(max_start_time)
+        available_slots_by_duration, cache_tags = {}, {}
+        for minutes_duration in minutes_durations:
+            cache_key = (min_start_minute, max_start_minute, minutes_duration, minutes_grid_span, split_by_segment)
+            cache_tags[cache_key] = self._get_availability_cache_tag(min_start_minute, max_start_minute + minutes_duration)
+            cached_entry = self._availability_cache.get(cache_key)
+            if cached_entry is not None and cached_entry[0] == cache_tags[cache_key]:
+                self._availability_cache.move_to_end(cache_key)
+                available_slots_by_duration[minutes_duration] = cached_entry[1]
+        self.availability_cache_hits += len(available_slots_by_duration)
+        missing_durations = [minutes_duration for minutes_duration in minutes_durations if minutes_duration not in available_slots_by_duration]
+        self.availability_cache_misses += len(missing_durations)
+        if not missing_durations:
+            return available_slots_by_duration
+
+        for minutes_duration, available_slots in self._compute_available_booking_slots_batch(missing_durations, min_start_minute, max_start_minute, 
+                                                                                             minutes_grid_span, split_by_segment).items():
+            cache_key = (min_start_minute, max_start_minute, minutes_duration, minutes_grid_span, split_by_segment)
+            self._availability_cache[cache_key] = (cache_tags[cache_key], available_slots)
+            available_slots_by_duration[minutes_duration] = available_slots
+        while len(self._availability_cache) > _AVAILABILITY_CACHE_MAX_ENTRIES:
+            self._availability_cache.popitem(last=False)
+        return available_slots_by_duration
+
+    def _get_availability_cache_tag(self, start_minute: int|float, end_minute: int|float) -> tuple:
+        """ Returns the (segment, version) pairs of the segments involved in [start_minute, end_minute), tagging the availability cache entries. """
+        first_segment_pos, last_segment_pos = self._get_segment_positions_involved(start_minute, end_minute)
+        return tuple((segment, segment._version) for segment in itertools.islice(self.segments, first_segment_pos, last_segment_pos))
+
+    def get_availability_cache_stats(self) -> dict:
+        """ Returns the availability cache counters: hits, misses (both counted by duration) and current number of entries. """
+        return {'hits': self.availability_cache_hits, 'misses': self.availability_cache_misses, 'size': len(self._availability_cache)}
+
+    def _compute_available_booking_slots_batch(self, minutes_durations: list[int], min_start_minute: int|float, max_start_minute: int|float, minutes_grid_span: int, split_by_segment: bool) -> dict:
+        """ Uncached get_available_booking_slots_batch, on epoch minutes and sorted not empty minutes_durations. """
+        n_slots_needed = [math.ceil(minutes_duration / self.slot_minutes_duration) for minutes_duration in minutes_durations]
+        available_default_slots, available_special_slots = [[] for _ in minutes_durations], [[] for _ in minutes_durations]
+        first_segment_pos, last_segment_pos = self._get_segment_positions_involved(min_start_minute, max_start_minute + minutes_durations[-1])
+        for segment_pos in range(first_segment_pos, last_segment_pos):
+            segment = self.segments[segment_pos]
+            aligned_min_start_offset = segment._align_minute_to_slot_offset(min_start_minute, how=AlignMethod.NEXT)
+            aligned_max_start_offset = segment._align_minute_to_slot_offset(max_start_minute, how=AlignMethod.PREVIOUS)
+            if aligned_min_start_offset is None or aligned_max_start_offset is None or aligned_min_start_offset>aligned_max_start_offset:
                 continue
-            slot_list = segment.get_slots_slice(start_time=aligned_min_start_time, end_time=aligned_max_start_time + timedelta(minutes=minutes_duration))
-            segment_available_default_slots, segment_available_special_slots = [], []
-            last_slot_booked = False
-            for i in range(len(slot_list) - n_slots_needed + 1):
-                current_slot = slot_list[i]
-                current_slot_group = slot_list[i : i + n_slots_needed]
-                if not any(s.is_booked() for s in current_slot_group): ###if the whole slots'group needed is available
-                    if not segment.timedelta_mismatch_from_previous_default(datetime_obj=current_slot.start_time, default_minutes_grid_range=minutes_grid_span):
-                        segment_available_default_slots.append(current_slot) # Append current slot object to the default availabilities 
-                    elif last_slot_booked:
-                        segment_available_special_slots.append(current_slot)  ##appending current slot as special slot if it starts right after a previous reservation finished
-                last_slot_booked=current_slot.is_booked() 
-
-            available_default_slots.append(segment_available_default_slots)
-            available_special_slots.append(segment_available_special_slots)
-        if not split_by_segment:
-            available_default_slots = [e for l in available_default_slots for e in l]
-            available_special_slots = [e for l in available_special_slots for e in l]
-            return available_default_slots, available_special_slots  
-        else:
-            return list(zip(*[available_default_slots,available_special_slots]))
+            start_idx = min(max(0, math.floor(aligned_min_start_offset)), segment.n_slots)
+            end_idxs = [min(max(0, math.ceil(aligned_max_start_offset + minutes_duration/segment.slot_duration)), segment.n_slots) for minutes_duration in minutes_durations]
+            indexes_by_duration = self._get_available_start_indexes_at(segment_pos, start_idx=start_idx, end_idxs=end_idxs, n_slots_needed=n_slots_needed,
+                                                                       grid_step=minutes_grid_span // segment.slot_duration)
+            for i, (default_indexes, special_indexes) in enumerate(indexes_by_duration):
+                available_default_slots[i].append([Slot(segment, idx) for idx in default_indexes])
+                available_special_slots[i].append([Slot(segment, idx) for idx in special_indexes])
+
+        available_slots_by_duration = {}
+        for i, minutes_duration in enumerate(minutes_durations):
+            if not split_by_segment:
+                available_slots_by_duration[minutes_duration] = ([e for l in available_default_slots[i] for e in l], [e for l in available_special_slots[i] for e in l])
+            else:
+                available_slots_by_duration[minutes_duration] = list(zip(*[available_default_slots[i], available_special_slots[i]]))
+        return available_slots_by_duration
 
-    async def _lock_slots(self, sorted_slots: list[Slot]):
+    def _get_available_start_indexes_at(self, segment_pos: int, start_idx: int, end_idxs: list[int], n_slots_needed: list[int], grid_step: int = 1) -> list[tuple[list[int], list[int]]]:
+        """ _get_available_start_indexes_batch on the segment at segment_pos. """
+        return _get_available_start_indexes_batch(self.segments[segment_pos], start_idx=start_idx, end_idxs=end_idxs, n_slots_needed=n_slots_needed, grid_step=grid_step)
+
+    def get_first_available_slot(self, minutes_duration: int, min_start_time: datetime.datetime, minutes_grid_span: int = 15) -> Slot:
         """
-        Locks the given slots in a consistent order to avoid deadlocks.
+        Returns the first (grid aligned) slot starting at or after min_start_time followed by enough free slots for minutes_duration. None if there is none.
+        Segments with no long enough free run are skipped through the free runs tree, so the cost is O(log n_segments) plus the check of the candidate segments.
         """
-        acquired = []
-        try:
-            for slot in sorted_slots:
-                await slot._lock.acquire()
-                acquired.append(slot)
-        except:
-            self._unlock_slots(acquired)
-            raise
-        return acquired
+        self._release_expired_bookings()
+        n_slots_needed = math.ceil(minutes_duration / self.slot_minutes_duration)
+        grid_step = max(1, minutes_grid_span // self.slot_minutes_duration)
+        free_runs_tree = self._get_free_runs_tree()
+        segment_pos = bisect_right(self._get_time_keys()[1], to_epoch_minutes(min_start_time))
+        while (segment_pos := free_runs_tree.find_first(segment_pos, n_slots_needed)) is not None and segment_pos < len(self.segments):
+            segment = self.segments[segment_pos]
+            from_idx = max(0, math.ceil(segment._get_slots_offset(min_start_time)))
+            start_idx = segment._find_first_free_start(from_idx, n_slots_needed, grid_step)
+            if start_idx is not None:
+                return Slot(segment, start_idx)
+            segment_pos += 1
+        return None
 
-    def _unlock_slots(self, sorted_slots: list[Slot]):
+    def get_nearest_available_slots(self, minutes_duration: int, target_time: datetime.datetime, k: int = 3, minutes_grid_span: int = 15, min_start_time: datetime.datetime = None) -> list[Slot]:
         """
-        Releases lock for the given slots.
+        Returns up to k grid aligned available slots, the closest to target_time first (ties broken in favour of the earlier one).
+        Bidirectional search: free starts are scanned forward from target_time and backward down to min_start_time (if given), always taking the closest of the two fronts.
         """
-        for slot in reversed(sorted_slots):
-            slot._lock.release()
+        self._release_expired_bookings()
+        n_slots_needed = math.ceil(minutes_duration / self.slot_minutes_duration)
+        grid_step = max(1, minutes_grid_span // self.slot_minutes_duration)
+        target_pos = bisect_right(self._get_time_keys()[1], to_epoch_minutes(target_time))
+
+        def _forward_starts():
+            for segment in itertools.islice(self.segments, target_pos, None):
+                from_time = target_time if min_start_time is None else max(target_time, min_start_time)
+                for idx in segment._iter_free_starts(n_slots_needed, grid_step, start_idx=math.ceil(segment._get_slots_offset(from_time))):
+                    yield Slot(segment, idx)
+
+        def _backward_starts():
+            for segment_pos in range(min(target_pos, len(self.segments)-1), -1, -1):
+                segment = self.segments[segment_pos]
+                if min_start_time is not None and segment.end_time <= min_start_time:
+                    return
+                from_idx = 0 if min_start_time is None else math.ceil(segment._get_slots_offset(min_start_time))
+                for idx in segment._iter_free_starts(n_slots_needed, grid_step, start_idx=from_idx, end_idx=math.ceil(segment._get_slots_offset(target_time)), reverse=True):
+                    yield Slot(segment, idx)
+
+        nearest_slots = []
+        forward_starts, backward_starts = _forward_starts(), _backward_starts()
+        next_forward, next_backward = next(forward_starts, None), next(backward_starts, None)
+        while len(nearest_slots) < k and (next_forward is not None or next_backward is not None):
+            if next_forward is None or (next_backward is not None and target_time - next_backward.start_time <= next_forward.start_time - target_time):
+                nearest_slots.append(next_backward)
+                next_backward = next(backward_starts, None)
+            else:
+                nearest_slots.append(next_forward)
+                next_forward = next(forward_starts, None)
+        return nearest_slots
+
+    def _schedule_expiry(self, segment: Segment, indexes: list[int], expiry_time: datetime.datetime):
+        heapq.heappush(self._expiry_heap, (expiry_time, self._expiry_seq, segment, tuple(indexes)))
+        self._expiry_seq += 1
+
+    def _schedule_segment_expiries(self, segment: Segment):
+        indexes_by_expiry = {}
+        for i, expiry_time in segment._expiries.items():
+            indexes_by_expiry.setdefault(expiry_time, []).append(i)
+        for expiry_time, indexes in indexes_by_expiry.items():
+            self._schedule_expiry(segment, indexes, expiry_time)
+
+    def _rebuild_expiry_heap(self):
+        self._expiry_heap = []
+        self._expiry_heap_segments = self.segments
+        for segment in self.segments:
+            self._schedule_segment_expiries(segment)
+
+    def _release_expired_bookings(self, curr_time: datetime.datetime = None) -> int:
+        """
+        Tick of the expiry scheduler, run at the start of each query: frees (in one batch per segment) the pending bookings whose expiry time is past.
+        Heap entries are not removed when their slots get confirmed, freed or rescheduled: they are just skipped here if the slot expiry no longer matches.
+        Returns the number of released slots.
+        """
+        if self._expiry_heap_segments is not self.segments:
+            self._rebuild_expiry_heap()
+        if not self._expiry_heap:
+            return 0
+        if curr_time is None:
+            curr_time = datetime.datetime.now(tz=self._expiry_heap[0][0].tzinfo)
+        expired_by_segment = {}
+        while self._expiry_heap and curr_time > self._expiry_heap[0][0]:
+            expiry_time, _, segment, indexes = heapq.heappop(self._expiry_heap)
+            expired_by_segment.setdefault(segment, []).extend(i for i in indexes if segment._expiries.get(i) == expiry_time)
+        for segment, indexes in expired_by_segment.items():
+            segment._free_indexes(indexes)
+        self._refresh_free_runs(expired_by_segment)
+        return sum(len(indexes) for indexes in expired_by_segment.values())
+
+    def _get_free_runs_tree(self) -> _MaxSegmentTree:
+        if self._free_runs_tree is None or self._free_runs_tree_segments is not self.segments:
+            self._free_runs_tree = _MaxSegmentTree([segment._max_free_run for segment in self.segments])
+            self._free_runs_tree_segments = self.segments
+        return self._free_runs_tree
+
+    def get_daily_free_counters(self, from_date: datetime.date, to_date: datetime.date) -> dict[datetime.date, tuple[int, int]]:
+        """
+        Returns (n free slots, longest free run in slots) by day, for the days in [from_date, to_date] having any segment.
+        Answered from the per-day counters (kept up to date at each booking/release): O(n_days), with no slots scan.
+        """
+        self._release_expired_bookings()
+        daily_free_counters = self._get_daily_free_counters()
+        days = (from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1))
+        return {day: daily_free_counters[day] for day in days if day in daily_free_counters}
+
+    def _get_daily_free_counters(self) -> dict[datetime.date, tuple[int, int]]:
+        if self._daily_free_counters is None or self._daily_counters_segments is not self.segments:
+            self._daily_segments = {}
+            for segment in self.segments:
+                self._daily_segments.setdefault(_get_segment_date(segment), []).append(segment)
+            self._daily_free_counters = {day: _sum_free_counters(day_segments) for day, day_segments in self._daily_segments.items()}
+            self._daily_counters_segments = self.segments
+        return self._daily_free_counters
+
+    def _refresh_free_runs(self, segments):
+        """ 
+        Propagates the free runs of the given (just modified) segments to the calendar level indexes: the free runs tree and the daily counters, if built.
+        segments maps each segment to its changed slots indexes, also recorded in the running write log (if any).
+        """
+        if self._changed_segments is not None:
+            self._changed_segments.update(segments)
+        record_slots_change(self, segments)
+        if self._daily_free_counters is not None and self._daily_counters_segments is self.segments:
+            for day in {_get_segment_date(segment) for segment in segments}:
+                if day in self._daily_segments:
+                    self._daily_free_counters[day] = _sum_free_counters(self._daily_segments[day])
+        if self._free_runs_tree is None or self._free_runs_tree_segments is not self.segments:
+            return ## will be rebuilt on next query
+        for segment in segments:
+            segment_pos = bisect_left(self._get_time_keys()[0], segment._start_minute)
+            if segment_pos < len(self.segments) and self.segments[segment_pos] is segment:
+                self._free_runs_tree.update(segment_pos, segment._max_free_run)
+
+    async def _lock_slots(self, slots: list[Slot]):
+        """
+        Locks the (segment, slot indexes range) intervals covering the given slots, all together in a single acquire.
+        Since no range is ever held while waiting for others, no deadlock can arise (whatever the slots order).
+        Returns the lock grant, to be passed to _unlock_slots.
+        """
+        return await self._range_locks.acquire(_group_slots_index_ranges(slots))
+
+    def _unlock_slots(self, locks_grant):
+        """
+        Releases the ranges locked by _lock_slots.
+        """
+        self._range_locks.release(locks_grant)
+
+    def _are_slots_locked(self, slots: list[Slot]) -> bool:
+        """
+        Check of a lock free (optimistic) commit: True if another operation holds a lock on any of the slots ranges.
+        Otherwise slots can be booked/freed right away, with no lock, as long as the commit does not await in between.
+        """
+        return self._range_locks.any_locked(_group_slots_index_ranges(slots))
 
     async def reserve_slots(self, slots, expiry_time=None):
-        locked_slots = await self._lock_slots(sorted(slots, key=lambda s: s.start_time))
+        locks_grant = await self._lock_slots(slots)
         try:
-            return self._reserve_slots_no_lock(locked_slots, expiry_time)
+            return self._reserve_slots_no_lock(slots, expiry_time)
         finally:
-            self._unlock_slots(locked_slots)
+            self._unlock_slots(locks_grant)
             
     async def free_slots(self, slots: list[Slot]):
-        locked_slots = await self._lock_slots(sorted(slots, key=lambda s: s.start_time))
+        locks_grant = await self._lock_slots(slots)
         try:
-            return self._free_slots_no_lock(locked_slots)
+            return self._free_slots_no_lock(slots)
         finally:
-            self._unlock_slots(locked_slots)
+            self._unlock_slots(locks_grant)
     
     async def _update_slots_expiry_time(self, slots: list[Slot], expiry_time):
-        locked_slots = await self._lock_slots(sorted(slots, key=lambda s: s.start_time))
+        locks_grant = await self._lock_slots(slots)
         try:
-            return self._set_slots_expiry_time_no_lock(locked_slots, expiry_time)
+            return self._set_slots_expiry_time_no_lock(slots, expiry_time)
         finally:
-            self._unlock_slots(locked_slots)
+            self._unlock_slots(locks_grant)
         
     def _reserve_slots_no_lock(self, slots: list[Slot], expiry_time: datetime.datetime=None):
-        if any(slot.is_booked() for slot in slots):
+        self._release_expired_bookings()
+        slots_by_segment = _group_slots_indexes_by_segment(slots)
+        if any(segment._any_booked_indexes(indexes) for segment, indexes in slots_by_segment.items()):
             raise AlreadyBookedError('Already booked')
-        for slot in slots:
-            slot.book(expiry_time)
+        for segment, indexes in slots_by_segment.items():
+            segment._book_indexes(indexes, expiry_time)
+            if expiry_time is not None:
+                self._schedule_expiry(segment, indexes, expiry_time)
+        self._refresh_free_runs(slots_by_segment)
         return True
 
     def _free_slots_no_lock(self, slots: list[Slot]):
-        for slot in slots:
-            slot.reset()
+        slots_by_segment = _group_slots_indexes_by_segment(slots)
+        for segment, indexes in slots_by_segment.items():
+            segment._free_indexes(indexes)
+        self._refresh_free_runs(slots_by_segment)
         return True
         
     def _set_slots_expiry_time_no_lock(self, slots: list[Slot], expiry_time):
-        if any(not s._is_booked for s in slots):
+        slots_by_segment = _group_slots_indexes_by_segment(slots)
+        if any((segment._booked & _indexes_to_mask(indexes)) != _indexes_to_mask(indexes) for segment, indexes in slots_by_segment.items()):
             raise ValueError('cannot set expiry time on unbooked slots')
-        for slot in slots:
-            slot._booking_expires_at = expiry_time
+        for segment, indexes in slots_by_segment.items():
+            segment._set_indexes_expiry_time(indexes, expiry_time)
+            if expiry_time is not None:
+                self._schedule_expiry(segment, indexes, expiry_time)
+        self._refresh_free_runs(slots_by_segment)
         return True
 
-    def copy(self):
+    def copy(self, previous_copy: "BusinessCalendar" = None, changed_segments: set[Segment] = None):
+        """
+        previous_copy: an earlier copy of this calendar (e.g. the previous read snapshot), taken with the same segments, which only changed_segments
+        (see pop_changed_segments) were booked/released since. Only those are copied again: the others are shared with previous_copy, hence both copies are to be only read.
+        """
         calendar = BusinessCalendar(self.slot_minutes_duration)
-        calendar.segments = [segment.copy() for segment in self.segments]
+        if previous_copy is None or changed_segments is None:
+            calendar.segments = [segment.copy() for segment in self.segments]
+            return calendar
+        copied_segments, time_keys = list(previous_copy.segments), self._get_time_keys()[0]
+        for segment in changed_segments:
+            segment_pos = bisect_left(time_keys, segment._start_minute)
+            if segment_pos < len(self.segments) and self.segments[segment_pos] is segment:
+                copied_segments[segment_pos] = segment.copy()
+        calendar.segments = copied_segments
         return calendar
 
+    def pop_changed_segments(self) -> set[Segment]:
+        """
+        Returns (and forgets) the segments booked/released, or whose bookings expiry times changed, since the previous call, through the calendar methods.
+        Returns None at the first call, or if the segments themselves changed meanwhile (added, joined, removed, evicted).
+        """
+        changed_segments, self._changed_segments = self._changed_segments, set()
+        return changed_segments
+
     def join(self, other: "BusinessCalendar") -> "BusinessCalendar":
         """
         Merge two BusinessCalendar into a new one.
@@ -523,4 +1161,65 @@ class BusinessCalendar:
         if j < len(other_copy.segments):
             _extend(merged.segments, other_copy.segments[j:])
 
-        return merged
\ No newline at end of file
+        return merged
+
+
+
+def _get_segment_date(segment: Segment) -> datetime.date:
+    """ Returns the date (in the business timezone) segment starts on. """
+    return from_epoch_minutes(segment._start_minute).date()
+
+
+def _sum_free_counters(segments: list[Segment]) -> tuple[int, int]:
+    """ Returns (n free slots, longest free run) over the given segments. """
+    return sum(segment._n_free_slots for segment in segments), max((segment._max_free_run for segment in segments), default=0)
+
+
+def _group_slots_indexes_by_segment(slots: list[Slot]) -> dict[Segment, list[int]]:
+    slots_by_segment = {}
+    for slot in slots:
+        slots_by_segment.setdefault(slot.segment, []).append(slot.index)
+    return slots_by_segment
+
+
+def _group_slots_index_ranges(slots: list[Slot]) -> list[tuple[Segment, int, int]]:
+    """ Returns the maximal (segment, first_idx, last_idx+1) ranges of consecutive slots covering the given slots. """
+    index_ranges = []
+    for segment, indexes in _group_slots_indexes_by_segment(slots).items():
+        indexes = sorted(set(indexes))
+        range_start = indexes[0]
+        for prev_idx, idx in zip(indexes, indexes[1:]):
+            if idx != prev_idx + 1:
+                index_ranges.append((segment, range_start, prev_idx + 1))
+                range_start = idx
+        index_ranges.append((segment, range_start, indexes[-1] + 1))
+    return index_ranges
+
+
+def _get_available_start_indexes(segment: Segment, start_idx: int, end_idx: int, n_slots_needed: int, grid_step: int = 1) -> tuple[list[int], list[int]]:
+    """
+    Returns (default_indexes, special_indexes): the slot indexes in [start_idx, end_idx - n_slots_needed] followed by >= n_slots_needed free slots (all within end_idx).
+    default_indexes are the ones aligned to the grid (i.e. index % grid_step == 0). 
+    special_indexes are the not aligned ones starting right after a booked slot (i.e. starting a free interval, excluding start_idx itself).
+    Single pass over the segment free intervals: O(n_free_intervals + n_results).
+    """
+    return _get_available_start_indexes_batch(segment, start_idx=start_idx, end_idxs=[end_idx], n_slots_needed=[n_slots_needed], grid_step=grid_step)[0]
+
+
+def _get_available_start_indexes_batch(segment: Segment, start_idx: int, end_idxs: list[int], n_slots_needed: list[int], grid_step: int = 1) -> list[tuple[list[int], list[int]]]:
+    """
+    _get_available_start_indexes for several (end_idx, n_slots_needed) pairs (i.e. durations), returning a (default_indexes, special_indexes) tuple by pair.
+    Single pass over the segment free intervals up to max(end_idxs), each interval being clipped by pair: O(n_free_intervals * n_pairs + n_results).
+    """
+    indexes_by_pair = [([], []) for _ in n_slots_needed]
+    for interval_start, max_interval_end in segment._iter_free_intervals(start_idx, max(end_idxs, default=start_idx)):
+        for end_idx, pair_n_slots_needed, (default_indexes, special_indexes) in zip(end_idxs, n_slots_needed, indexes_by_pair):
+            last_valid_start = min(max_interval_end, end_idx) - pair_n_slots_needed
+            if last_valid_start < interval_start:
+                continue
+            if interval_start % grid_step:
+                if interval_start > start_idx:
+                    special_indexes.append(interval_start)
+            first_grid_start = interval_start + (-interval_start % grid_step)
+            default_indexes.extend(range(first_grid_start, last_valid_start+1, grid_step))
+    return indexes_by_pair
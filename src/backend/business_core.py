@@ -1,5 +1,5 @@
 from __future__ import annotations    
-import datetime as dt, warnings
+import datetime as dt, warnings, math, heapq, functools, inspect, asyncio
 from datetime import timedelta
 from collections import defaultdict
 from utils.datetimes_utils import  map_datetime_to_default
@@ -8,31 +8,72 @@ from backend.business_calendar import BusinessCalendar, Slot
 from backend.reservations import *
 from backend.domain_errors import *
 from backend.business_event import *
+from backend.read_snapshot import ReadSnapshot
+from backend.write_log import WriteLog, begin_write_log, end_write_log
+from backend.idempotency_table import IdempotencyTable
 from shared.user_role import UserRole
 
 from enum import Enum
+
+_MAX_OPTIMISTIC_ATTEMPTS = 3 ## lock free commits of an operation finding its slots locked, before committing it under the slots locks
+
+
+def _write_operation(method):
+    """
+    Marks a BusinessCore method changing the calendar or the reservations: while any of them is in progress, the read methods answer from the
+    read snapshot of the last committed version (see BusinessCore._begin_write), not from the state being changed.
+    """
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def _async_write(self, *args, **kwargs):
+            write_log = self._begin_write()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                self._end_write(write_log)
+        return _async_write
+
+    @functools.wraps(method)
+    def _write(self, *args, **kwargs):
+        write_log = self._begin_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._end_write(write_log)
+    return _write
         
 
 class BusinessCore:
     
 
     class ReservationOperationContext:
-        def __init__(self, new_reservation: Reservation = None, existing_reservation_id: str=None, new_res_slots: list[Slot]=None, existing_res_slots: list[Slot]=None):
+        def __init__(self, new_reservation: Reservation = None, existing_reservation_id: str=None, new_res_slots: list[Slot]=None, existing_res_slots: list[Slot]=None, lock_free_commit: bool=False):
             self.new_reservation = new_reservation
             self.new_res_slots = new_res_slots
             self.existing_reservation_id = existing_reservation_id
             self.existing_res_slots = existing_res_slots
+            self.lock_free_commit = lock_free_commit ## optimistic concurrency only: committing with no slots lock (False to commit under the slots locks)
             
     class ServiceOperationContext:
         def __init__(self, old: Service = None, new: Service = None):
             self.old = old
             self.new = new
 
-    def __init__(self, reservation_manager: ReservationManager, calendar: BusinessCalendar, policy_manager: PolicyManager, default_grid_minutes: int = 15):
+    def __init__(self, reservation_manager: ReservationManager, calendar: BusinessCalendar, policy_manager: PolicyManager, default_grid_minutes: int = 15, optimistic_concurrency: bool = False):
+        """
+        optimistic_concurrency: reservations are committed with no slots lock. A prepare and its commit run within the same event loop step, so nothing can change
+        the slots in between: the only conflict is a locked commit of another operation still holding them (e.g. waiting for the locks of another resource).
+        On conflict the operation yields to the event loop and is prepared again, and after _MAX_OPTIMISTIC_ATTEMPTS it is committed under the slots locks.
+        """
         self.calendar = calendar
         self.policy_manager = policy_manager
         self.reservation_manager = reservation_manager
         self.default_grid_minutes = default_grid_minutes
+        self.optimistic_concurrency = optimistic_concurrency
+        self._committed_version = 0 ## bumped at the end of each write operation
+        self._writes_in_progress = 0
+        self._read_snapshot = None ## ReadSnapshot of the last committed state, built lazily, advanced incrementally and published to at the end of each write
+        self.idempotency_table = IdempotencyTable() ## results of the BookingService operations by idempotency key: checkpointed with the core state they produced
 
 
         
@@ -62,12 +103,15 @@ class BusinessCore:
         if bool(segment_to_reserve.timedelta_mismatch_from_previous_default(start_time, default_minutes_grid_range=self.default_grid_minutes if force_default_grid else None)):
             return False, PolicyError(f'Cannot reserve at {start_time}. Time not aligned to default expected slot times')
         
-        slots_to_book = segment_to_reserve.get_slots_slice(start_time, start_time+timedelta(minutes=minutes_duration))
+        slots_to_book = self.calendar.get_slots(start_time, start_time+timedelta(minutes=minutes_duration), same_segment_only=True) ##on the first free resource, if the calendar has several
         if any(slot.is_booked() for slot in slots_to_book):
             return False, AlreadyBookedError('Cannot reserve. Already booked')
+        if self._get_overlapping_user_reservation(user, start_time, start_time+timedelta(minutes=minutes_duration)) is not None:
+            return False, PolicyError('Cannot reserve. You already have a reservation at the requested time')
             
-        reservation = Reservation(reservation_id=generate_new_reservation_id(), start_time=start_time, end_time=start_time+timedelta(minutes=minutes_duration), user=user, service_name=service_name)
-        return True, BusinessCore.ReservationOperationContext(new_reservation=reservation, new_res_slots=slots_to_book)
+        reservation = Reservation(reservation_id=generate_new_reservation_id(), start_time=start_time, end_time=start_time+timedelta(minutes=minutes_duration), user=user, service_name=service_name, 
+                                  resource=self.calendar.get_slots_resource(slots_to_book))
+        return True, BusinessCore.ReservationOperationContext(new_reservation=reservation, new_res_slots=slots_to_book, lock_free_commit=self.optimistic_concurrency)
         
     def _prepare_cancel_reservation(self, reservation_id: str, force_advance_cancelation: bool=False, force_past_slots: bool=False) -> bool|Exception:
         from backend.domain_logic import check_delete_time_constraints
@@ -130,18 +174,37 @@ class BusinessCore:
             if bool(segment_to_reserve.timedelta_mismatch_from_previous_default(new_start_time, default_minutes_grid_range=self.default_grid_minutes if force_default_grid else None)):
                 return False, PolicyError(f'Cannot reserve at {new_start_time}. Time not aligned to default expected slot times')
         
-        old_res_slots = self.calendar.get_slots(old_reservation.start_time, old_reservation.end_time, same_segment_only=True)
-        slots_to_free, slots_to_book = get_consecutive_slots_join(old_res_slots, new_res_slots, how='difference')
-        
+        old_res_slots = self.calendar.get_booked_slots(old_reservation.start_time, old_reservation.end_time, resource=old_reservation.resource)
+        prev_inner_update_slots = []
         if (prev_inner_upd := old_reservation.get_associated_update_reservation()) and not prev_inner_upd.is_confirmation_expired():
-            prev_inner_update_slots = self.calendar.get_slots(prev_inner_upd.start_time, prev_inner_upd.end_time, same_segment_only=True)
-            slots_to_book, _ = get_consecutive_slots_join(slots_to_book, prev_inner_update_slots, how='difference')
-        
-        if any(s.is_booked() for s in slots_to_book):
+            prev_inner_update_slots = self.calendar.get_booked_slots(prev_inner_upd.start_time, prev_inner_upd.end_time, resource=prev_inner_upd.resource)
+        
+        for new_res_slots in self.calendar.iter_resources_slots(new_start_time, new_end_time, preferred_resource=old_reservation.resource): ##the old reservation resource first, as its own slots can be reused
+            slots_to_free, slots_to_book = get_consecutive_slots_join(old_res_slots, new_res_slots, how='difference')
+            if prev_inner_update_slots:
+                slots_to_book, _ = get_consecutive_slots_join(slots_to_book, prev_inner_update_slots, how='difference')
+            if not any(s.is_booked() for s in slots_to_book):
+                break
+        else:
             return False, AlreadyBookedError('Cannot reserve at the requested time. Already booked')
-        new_reserv = Reservation(reservation_id=generate_new_reservation_id(), start_time=new_start_time, end_time=new_end_time, user=new_user, service_name=new_service_name)
-        return True, BusinessCore.ReservationOperationContext(new_reservation=new_reserv, existing_reservation_id=old_reservation.reservation_id, new_res_slots=new_res_slots, existing_res_slots=old_res_slots)
+        if self._get_overlapping_user_reservation(new_user, new_start_time, new_end_time, exclude_reservation_id=old_reservation.reservation_id) is not None:
+            return False, PolicyError('Cannot reserve at the requested time. You already have another reservation at that time')
+        new_reserv = Reservation(reservation_id=generate_new_reservation_id(), start_time=new_start_time, end_time=new_end_time, user=new_user, service_name=new_service_name, 
+                                 resource=self.calendar.get_slots_resource(new_res_slots))
+        return True, BusinessCore.ReservationOperationContext(new_reservation=new_reserv, existing_reservation_id=old_reservation.reservation_id, new_res_slots=new_res_slots, existing_res_slots=old_res_slots, 
+                                                              lock_free_commit=self.optimistic_concurrency)
+        
+    def _get_overlapping_user_reservation(self, user: str, start_time: dt.datetime, end_time: dt.datetime, exclude_reservation_id: str = None) -> Reservation|None:
+        """ 
+        Returns an active reservation of user overlapping [start_time, end_time) (other than exclude_reservation_id), None if there is none.
+        Needed on calendars with several resources, where the slots of another resource may be free at the times the user already booked.
+        """
+        from backend.domain_logic import is_reservation_active
         
+        for reservation in self.reservation_manager.get_reservations_between(start_time, end_time):
+            if reservation.user==user and reservation.reservation_id!=exclude_reservation_id and is_reservation_active(reservation):
+                return reservation
+        return None
 
     
 
@@ -176,14 +239,58 @@ class BusinessCore:
         return (True, BusinessCore.ServiceOperationContext(old=existing_service, new=new_service))
         
 
+    @_write_operation
     async def make_reservation(self, service_name: str, start_time: dt.datetime, user: str, minutes_duration: int=None, actor: UserRole = UserRole.USER, force_past_slots: bool=False, force_advance_reservation: bool=False, force_default_grid: bool=True, ):     
-        is_reserv_possible, reserv_context = self._prepare_make_reservation(user=user, service_name=service_name, start_time=start_time, minutes_duration=minutes_duration, force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation, force_default_grid=force_default_grid)
-        if not is_reserv_possible:
-            raise reserv_context
+        for attempt in range(1, _MAX_OPTIMISTIC_ATTEMPTS+1):
+            is_reserv_possible, reserv_context = self._prepare_make_reservation(user=user, service_name=service_name, start_time=start_time, minutes_duration=minutes_duration, force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation, force_default_grid=force_default_grid)
+            if not is_reserv_possible:
+                if isinstance(reserv_context, AlreadyBookedError):
+                    self._attach_nearest_alternatives(reserv_context, service_name=service_name, start_time=start_time, minutes_duration=minutes_duration, 
+                                                      force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation, actor=actor)
+                raise reserv_context
+            if attempt == _MAX_OPTIMISTIC_ATTEMPTS:
+                reserv_context.lock_free_commit = False ##last attempt: committing under the slots locks
+            try:
+                return await self._make_reservation(reserv_context, actor=actor)
+            except CommitConflictError:
+                await asyncio.sleep(0) ##letting the commit holding the slots locks go on, before preparing again
+
+    @_write_operation
+    async def make_reservations_bulk(self, reservations: list[dict], actor: UserRole = UserRole.ADMIN, all_or_nothing: bool = True, force_past_slots: bool=False, force_advance_reservation: bool=False, force_default_grid: bool=True) -> list[BusinessEvent|Exception]:
+        """
+        Makes many reservations at once (e.g. bookings imported by an admin), each given as a dict of make_reservation parameters (service_name, start_time, user and optionally minutes_duration).
+        All the requests are validated first, then the slots of all of them are locked together (a single lock pass) and booked in start time order.
+        If all_or_nothing, any failing request raises its error and no reservation is made. 
+        Otherwise returns, in the input order, the event of each made reservation or the error of each failed request.
+        """
+        prepare_kwargs = dict(force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation, force_default_grid=force_default_grid)
+        results = [None] * len(reservations)
+        prepared, prepared_by_user = [], defaultdict(list)
+        for idx, reservation_params in enumerate(reservations):
+            try:
+                is_reserv_possible, reserv_context = self._prepare_make_reservation(**reservation_params, **prepare_kwargs)
+            except (TypeError, ValueError) as e: ## e.g. missing or unknown parameters
+                is_reserv_possible, reserv_context = False, e
+            if is_reserv_possible: ## requests of the same user overlapping each other
+                new_reservation = reserv_context.new_reservation
+                user_reservations = prepared_by_user[new_reservation.user]
+                if any(r.start_time < new_reservation.end_time and new_reservation.start_time < r.end_time for r in user_reservations):
+                    is_reserv_possible, reserv_context = False, PolicyError('Cannot reserve. The user has another reservation at the requested time')
+                else:
+                    user_reservations.append(new_reservation)
+            if is_reserv_possible:
+                prepared.append((idx, reservation_params, reserv_context))
+            elif all_or_nothing:
+                raise BusinessCore._bulk_item_error(idx, reserv_context)
+            else:
+                results[idx] = reserv_context
 
-        return await self._make_reservation(reserv_context, actor=actor)  
+        for idx, outcome in (await self._make_reservations_bulk(prepared, actor=actor, all_or_nothing=all_or_nothing, prepare_kwargs=prepare_kwargs)).items():
+            results[idx] = outcome
+        return results
             
 
+    @_write_operation
     async def cancel_reservation(self, reservation_id: str, actor: UserRole = UserRole.USER, force_past_slots: bool=False, force_advance_cancelation: bool=False):
         is_delete_possible, reserv_context = self._prepare_cancel_reservation(reservation_id=reservation_id, force_past_slots=force_past_slots, force_advance_cancelation=force_advance_cancelation)
         if not is_delete_possible:
@@ -192,18 +299,30 @@ class BusinessCore:
         return await self._cancel_reservation(reserv_context, actor=actor)      
 
 
+    @_write_operation
     async def update_reservation(self, existing_reservation_id: str, new_start_time: dt.datetime=None, new_service_name: str=None, new_minutes_duration: int=None, actor: UserRole = UserRole.USER, force_default_grid: bool=True, force_past_slots: bool=False, force_advance_cancelation: bool=False, force_advance_reservation=False):                    
-        is_update_possible, update_context = self._prepare_update_reservation(existing_reservation_id=existing_reservation_id, 
-                                                            new_start_time=new_start_time, 
-                                                            new_minutes_duration=new_minutes_duration, 
-                                                            new_service_name=new_service_name,
-                                                            force_default_grid=force_default_grid,
-                                                            force_past_slots=force_past_slots, 
-                                                            force_advance_cancelation=force_advance_cancelation, 
-                                                            force_advance_reservation=force_advance_reservation)
-        if not is_update_possible:
-            raise update_context
-        return await self._update_reservation(update_context, actor=actor)
+        for attempt in range(1, _MAX_OPTIMISTIC_ATTEMPTS+1):
+            is_update_possible, update_context = self._prepare_update_reservation(existing_reservation_id=existing_reservation_id, 
+                                                                new_start_time=new_start_time, 
+                                                                new_minutes_duration=new_minutes_duration, 
+                                                                new_service_name=new_service_name,
+                                                                force_default_grid=force_default_grid,
+                                                                force_past_slots=force_past_slots, 
+                                                                force_advance_cancelation=force_advance_cancelation, 
+                                                                force_advance_reservation=force_advance_reservation)
+            if not is_update_possible:
+                if isinstance(update_context, AlreadyBookedError):
+                    old_reservation = self.reservation_manager.get_reservation(existing_reservation_id)
+                    new_params = self._resolve_reservation_params_with_defaults(existing_reservation=old_reservation, start_time=new_start_time, service_name=new_service_name, minutes_duration=new_minutes_duration)
+                    self._attach_nearest_alternatives(update_context, service_name=new_params['service_name'], start_time=new_params['start_time'], minutes_duration=new_params['minutes_duration'], 
+                                                      force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation, actor=actor)
+                raise update_context
+            if attempt == _MAX_OPTIMISTIC_ATTEMPTS:
+                update_context.lock_free_commit = False ##last attempt: committing under the slots locks
+            try:
+                return await self._update_reservation(update_context, actor=actor)
+            except CommitConflictError:
+                await asyncio.sleep(0) ##letting the commit holding the slots locks go on, before preparing again
         
         
 
@@ -237,26 +356,64 @@ class BusinessCore:
         return BusinessEvent(event_type=ServiceEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=services))
         
         
+    @_write_operation
     def add_new_calendar(self, calendar: BusinessCalendar, actor: UserRole = UserRole.ADMIN):
         self.calendar = self.calendar.join(calendar)
         return BusinessEvent(SystemEventType.CALENDAR_UPDATED, data=BusinessEvent.EventData(new=calendar), actor=actor)
         
         
+    @_write_operation
     def remove_time_from_calendar(self, start_time: dt.datetime, end_time: dt.datetime, actor: UserRole = UserRole.ADMIN):
         raise NotImplementedError('')
         if end_time<=start_time:
             raise ValueError('End time must be after start_time')
         self.calendar.remove_segment(start_time=start_time, end_time=end_time, raise_error_if_any_booking=True)
         return BusinessEvent(SystemEventType.CALENDAR_UPDATED, data=BusinessEvent.EventData(old=(start_time, end_time), actor=actor))
+
+
+    @_write_operation
+    async def roll_calendar_window(self, future_days: int, curr_time: dt.datetime = None, archive_after_days: int = 0, actor: UserRole = UserRole.SYSTEM, archive_reservations=None):
+        """
+        Rolling window maintenance (to be run once per day): evicts the calendar segments fully past curr_time and the reservations ended
+        more than archive_after_days before curr_time, then appends the segments (by the current opening hours) of the days missing up to curr_time.date() + future_days, in a single bulk sorted insert.
+        The evicted reservations are returned as event old data; the added segments as new data.
+        archive_reservations: async callable moving the reservations to cold storage, awaited with them before anything is evicted: if it raises, nothing changes.
+        Without it, the caller is responsible for moving the returned reservations to cold storage.
+        """
+        from utils.datetimes_utils import to_default_tz
+        from backend.business_calendar import Segment
+
+        curr_time = map_datetime_to_default(curr_time or dt.datetime.now(tz=dt.UTC))
+        reservations_to_evict = self.reservation_manager.get_reservations_ended_before(curr_time - timedelta(days=archive_after_days))
+        if archive_reservations is not None and reservations_to_evict:
+            await archive_reservations(reservations_to_evict)
+        evicted_segments = self.calendar.evict_segments_before(curr_time)
+        evicted_reservations = [await self.reservation_manager.remove_reservation(reservation.reservation_id) for reservation in reservations_to_evict]
+
+        first_date, last_date = curr_time.date(), curr_time.date() + timedelta(days=future_days)
+        if self.calendar.segments:
+            first_date = max(first_date, to_default_tz(self.calendar.segments[-1].end_time).date() + timedelta(days=1))
+        new_segments = []
+        for day in range((last_date - first_date).days + 1):
+            curr_date = first_date + timedelta(days=day)
+            for opening_time, closing_time in self.policy_manager.opening_hours:
+                new_segments.append(Segment(start_time=map_datetime_to_default(dt.datetime.combine(curr_date, opening_time), ignore_seconds=True),
+                                            end_time=map_datetime_to_default(dt.datetime.combine(curr_date, closing_time), ignore_seconds=True),
+                                            slot_duration=self.calendar.slot_minutes_duration, force_past_slots=True))
+        self.calendar.add_segments(new_segments)
+        message = f'Evicted {len(evicted_segments)} past segments and {len(evicted_reservations)} past reservations. Added {len(new_segments)} segments'
+        return BusinessEvent(SystemEventType.CALENDAR_UPDATED, actor=actor, data=BusinessEvent.EventData(old=evicted_reservations, new=new_segments), message=message)
+
         
-        
-    def get_user_reservations(self, user: str, actor: UserRole = UserRole.USER) -> list[Reservation]:
-        user_reservations = self.reservation_manager.get_reservations_by_user(user)
+    def get_user_reservations(self, user: str, include_archived: bool = False, actor: UserRole = UserRole.USER) -> list[Reservation]:
+        _, reservations = self._get_read_view()
+        user_reservations = reservations.get_reservations_by_user(user, include_archived=include_archived)
         return BusinessEvent(event_type=ReservationEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=user_reservations))
 
 
     def get_daily_reservations(self, date: dt.date, actor: UserRole = UserRole.USER) -> list[Reservation]:
-        daily_reservations = self.reservation_manager.get_reservations_by_date(date)
+        _, reservations = self._get_read_view()
+        daily_reservations = reservations.get_reservations_by_date(date)
         return BusinessEvent(event_type=ReservationEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=daily_reservations))
 
     def get_default_opening_hours(self, actor: UserRole = UserRole.USER):
@@ -268,7 +425,8 @@ class BusinessCore:
         from utils.datetimes_utils import to_default_tz
         
         date_start, date_end = to_default_tz(dt.datetime.combine(date, dt.time.min)), to_default_tz(dt.datetime.combine(date, dt.time.max))
-        segments_involved = self.calendar._get_segments_involved(start_time= date_start, end_time = date_end)
+        calendar, _ = self._get_read_view()
+        segments_involved = calendar._get_segments_involved(start_time= date_start, end_time = date_end)
         if segments_involved:
             op_hours = [(max(date_start, segment.start_time), min(date_end, segment.end_time)) for segment in segments_involved]
         else:
@@ -276,8 +434,9 @@ class BusinessCore:
         return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=op_hours))
 
 
-    def get_all_reservations(self, actor: UserRole = UserRole.ADMIN):
-        reservations = sorted(self.reservation_manager.reservations_id_mappings.values(), key=lambda x: x.start_time)
+    def get_all_reservations(self, include_archived: bool = False, actor: UserRole = UserRole.ADMIN):
+        _, reservations = self._get_read_view()
+        reservations = reservations.get_all_reservations(include_archived=include_archived)
         return BusinessEvent(event_type=ReservationEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=reservations))
         
         
@@ -300,6 +459,37 @@ class BusinessCore:
     """
         
     def get_available_datetimes(self, service_name: str, min_start_time: dt.datetime, max_start_time: dt.datetime = None, minutes_duration: int = None, force_past_slots: bool = False, force_advance_reservation: bool = False, actor: UserRole = UserRole.USER):
+        min_start_time, max_start_time = self._get_availability_window(min_start_time=min_start_time, max_start_time=max_start_time, 
+                                                                       force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation)
+        calendar, _ = self._get_read_view()
+        available_slots = calendar.get_available_booking_slots(min_start_time=min_start_time, max_start_time=max_start_time, minutes_duration=minutes_duration, 
+                                                              minutes_grid_span=15)
+        default, special = [str(slot.start_time) for s in list(map(lambda x: x[0], available_slots)) for slot in s], \
+                           [str(slot.start_time) for s in list(map(lambda x: x[1], available_slots)) for slot in s]
+        return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=(default, special)) )
+
+
+    def get_available_datetimes_batch(self, service_names: list[str], min_start_time: dt.datetime, max_start_time: dt.datetime = None, force_past_slots: bool = False, force_advance_reservation: bool = False, actor: UserRole = UserRole.USER):
+        """
+        Returns (as strings) the available (default, special) start times of each service in the window: {service_name: (default, special)}, as get_available_datetimes does for a single service.
+        The calendar is scanned once for all the services (services with the same duration share their results).
+        """
+        unknown_services = [service_name for service_name in service_names if service_name not in self.policy_manager.services]
+        if unknown_services:
+            raise PolicyError(f'Cannot look for availabilities: unknown services {unknown_services}')
+        min_start_time, max_start_time = self._get_availability_window(min_start_time=min_start_time, max_start_time=max_start_time, 
+                                                                       force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation)
+        durations_by_service = {service_name: self._get_duration_from_service_name(service_name) for service_name in service_names}
+        calendar, _ = self._get_read_view()
+        available_slots_by_duration = calendar.get_available_booking_slots_batch(minutes_durations=list(durations_by_service.values()), min_start_time=min_start_time, 
+                                                                                      max_start_time=max_start_time, minutes_grid_span=15, split_by_segment=False)
+        available_datetimes = {service_name: tuple([str(slot.start_time) for slot in slots] for slots in available_slots_by_duration[minutes_duration]) 
+                               for service_name, minutes_duration in durations_by_service.items()}
+        return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=available_datetimes) )
+
+
+    def _get_availability_window(self, min_start_time: dt.datetime, max_start_time: dt.datetime = None, force_past_slots: bool = False, force_advance_reservation: bool = False) -> tuple[dt.datetime, dt.datetime]:
+        """ Validates and maps to the business timezone the availability window, moving min_start_time to the first bookable time (unless force_past_slots). """
         from utils.datetimes_utils import map_datetime_to_default
         if max_start_time is None:
             max_start_time = min_start_time
@@ -322,15 +512,102 @@ class BusinessCore:
             if min_start_time < curr_time+min_adv_delta:
                 warnings.warn('Providing availabilities on future slots only.')
                 min_start_time = curr_time+min_adv_delta
+        return min_start_time, max_start_time
+
+
+    def get_first_available(self, service_name: str, min_start_time: dt.datetime = None, minutes_duration: int = None, force_past_slots: bool = False, force_advance_reservation: bool = False, actor: UserRole = UserRole.USER):
+        """ Returns (as string) the first available start time for the service, starting at min_start_time (now if not given). None if the calendar has no availability left. """
+        from utils.datetimes_utils import map_datetime_to_default
+        if service_name not in self.policy_manager.services:
+            raise PolicyError(f'Cannot look for availabilities: unknown service {service_name}')
+        if minutes_duration is None:
+            minutes_duration = self._get_duration_from_service_name(service_name)
+        if min_start_time is None:
+            min_start_time = dt.datetime.now()
+        try:
+            min_start_time = map_datetime_to_default(min_start_time, ignore_seconds=True)
+        except:
+            raise TypeError('min_start_time must be a valid datetime object containing date, hours and minutes')
         
+        if not force_past_slots:
+            curr_time = map_datetime_to_default(dt.datetime.now(tz=min_start_time.tzinfo), ignore_seconds=True, map_to_default_tz=False)
+            min_adv_delta = timedelta(minutes=0 if force_advance_reservation else self.policy_manager.min_advance_booking_minutes)
+            min_start_time = max(min_start_time, curr_time+min_adv_delta)
         
-        available_slots = self.calendar.get_available_booking_slots(min_start_time=min_start_time, max_start_time=max_start_time, minutes_duration=minutes_duration, 
-                                                              minutes_grid_span=15)
-        default, special = [str(slot.start_time) for s in list(map(lambda x: x[0], available_slots)) for slot in s], \
-                           [str(slot.start_time) for s in list(map(lambda x: x[1], available_slots)) for slot in s]
-        return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=(default, special)) )
+        calendar, _ = self._get_read_view()
+        first_slot = calendar.get_first_available_slot(minutes_duration=minutes_duration, min_start_time=min_start_time, minutes_grid_span=self.default_grid_minutes)
+        return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=str(first_slot.start_time) if first_slot else None) )
 
 
+    def get_nearest_alternatives(self, service_name: str, start_time: dt.datetime, k: int = 3, minutes_duration: int = None, force_past_slots: bool = False, force_advance_reservation: bool = False, actor: UserRole = UserRole.USER):
+        """ Returns (as strings) the k available grid aligned start times closest to start_time for the service, the closest first. """
+        if service_name not in self.policy_manager.services:
+            raise PolicyError(f'Cannot look for availabilities: unknown service {service_name}')
+        if minutes_duration is None:
+            minutes_duration = self._get_duration_from_service_name(service_name)
+        try:
+            start_time = map_datetime_to_default(start_time, ignore_seconds=True)
+        except:
+            raise TypeError('start_time must be a valid datetime object containing date, hours and minutes')
+        
+        min_start_time = None
+        if not force_past_slots:
+            curr_time = map_datetime_to_default(dt.datetime.now(tz=start_time.tzinfo), ignore_seconds=True, map_to_default_tz=False)
+            min_start_time = curr_time + timedelta(minutes=0 if force_advance_reservation else self.policy_manager.min_advance_booking_minutes)
+        
+        calendar, _ = self._get_read_view()
+        nearest_slots = calendar.get_nearest_available_slots(minutes_duration=minutes_duration, target_time=start_time, k=k, minutes_grid_span=self.default_grid_minutes, min_start_time=min_start_time)
+        return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=[str(slot.start_time) for slot in nearest_slots]) )
+
+    def get_available_days(self, service_name: str, from_date: dt.date, to_date: dt.date = None, minutes_duration: int = None, force_past_slots: bool = False, force_advance_reservation: bool = False, actor: UserRole = UserRole.USER):
+        """
+        Returns (as strings) the days in [from_date, to_date] that still have room for the service.
+        The calendar per-day counters discard the days whose longest free run is too short for the service; the remaining ones are checked through the
+        first available (grid aligned) slot, since a long enough run may still have no bookable start (e.g. after off-grid admin bookings).
+        """
+        from utils.datetimes_utils import map_to_date, to_default_tz
+        if service_name not in self.policy_manager.services:
+            raise PolicyError(f'Cannot look for availabilities: unknown service {service_name}')
+        if minutes_duration is None:
+            minutes_duration = self._get_duration_from_service_name(service_name)
+        try:
+            from_date, to_date = [d.date() if isinstance(d, dt.datetime) else map_to_date(d) for d in (from_date, from_date if to_date is None else to_date)]
+        except:
+            raise TypeError('from_date and to_date must be valid dates')
+        if to_date<from_date:
+            raise ValueError('to_date cannot be a previous date than from_date')
+
+        min_start_time = None
+        if not force_past_slots:
+            curr_time = map_datetime_to_default(dt.datetime.now(), ignore_seconds=True)
+            min_start_time = curr_time + timedelta(minutes=0 if force_advance_reservation else self.policy_manager.min_advance_booking_minutes)
+
+        calendar, _ = self._get_read_view()
+        n_slots_needed = math.ceil(minutes_duration / calendar.slot_minutes_duration)
+        available_days = []
+        for day, (n_free_slots, max_free_run) in calendar.get_daily_free_counters(from_date=from_date, to_date=to_date).items():
+            if max_free_run < n_slots_needed or (min_start_time is not None and day < min_start_time.date()):
+                continue
+            day_start_time = map_datetime_to_default(dt.datetime.combine(day, dt.time()))
+            first_slot = calendar.get_first_available_slot(minutes_duration=minutes_duration, min_start_time=day_start_time if min_start_time is None else max(day_start_time, min_start_time), 
+                                                           minutes_grid_span=self.default_grid_minutes)
+            if first_slot is not None and to_default_tz(first_slot.start_time).date() == day:
+                available_days.append(day)
+        return BusinessEvent(event_type=SystemEventType.NOOP, actor=actor, data=BusinessEvent.EventData(new=[str(day) for day in available_days]) )
+
+    def _attach_nearest_alternatives(self, error: AlreadyBookedError, service_name: str, start_time: dt.datetime, minutes_duration: int = None, k: int = 3, force_past_slots: bool = False, force_advance_reservation: bool = False, actor: UserRole = UserRole.USER):
+        """ Adds the nearest available start times to an AlreadyBookedError (both in its message and as a NOOP event), so that no further availability request is needed. """
+        try:
+            alternatives_event = self.get_nearest_alternatives(service_name=service_name, start_time=start_time, k=k, minutes_duration=minutes_duration, 
+                                                               force_past_slots=force_past_slots, force_advance_reservation=force_advance_reservation, actor=actor)
+        except Exception:
+            return error
+        if alternatives_event.data.new:
+            error.message = f'{error.message}. Nearest available times: {alternatives_event.data.new}'
+            error.args = (error.message,)
+        error.events = [alternatives_event]
+        return error
+
         
     async def _make_reservation(self, reservation_context: ReservationOperationContext, actor: UserRole, expiry_time: dt.datetime=None):
         reservation = reservation_context.new_reservation
@@ -338,10 +615,15 @@ class BusinessCore:
         
         if not slots_to_book:
             raise ClosingTimeError('Cannot make the reservation: Out of working hours')
+        reservation.resource = self.calendar.get_slots_resource(slots_to_book)
         
         are_slots_reserved = False
         try:
-            are_slots_reserved = await self.calendar.reserve_slots(slots=slots_to_book, expiry_time=expiry_time)
+            locks_grant = await self._lock_slots_for_commit(reservation_context, slots_to_book)
+            try:
+                are_slots_reserved = self.calendar._reserve_slots_no_lock(slots_to_book, expiry_time)
+            finally:
+                self._unlock_slots_after_commit(locks_grant)
             await self.reservation_manager.insert_reservation(reservation)
             return BusinessEvent(event_type=ReservationEventType.CREATED, actor=actor, data=BusinessEvent.EventData(new=reservation))
         except Exception as e:
@@ -349,6 +631,73 @@ class BusinessCore:
                 await self.calendar.free_slots(slots=slots_to_book)
             err_msg = 'Cannot make the reservation: ' + e.message
             raise type(e)(err_msg)
+
+    async def _make_reservations_bulk(self, prepared: list[tuple[int, dict, ReservationOperationContext]], actor: UserRole, all_or_nothing: bool, prepare_kwargs: dict, expiry_time: dt.datetime=None) -> dict[int, BusinessEvent|Exception]:
+        """
+        Books the prepared (request index, request parameters, context) items, returning the event or the error of each request index.
+        The slots of all the items are locked at once, and booked (by start time) without any further lock/unlock cycle.
+        Items whose slots got booked meanwhile (e.g. by a previous item, on calendars with several resources) are prepared again on the updated calendar, and booked one by one.
+        Reservations are inserted only once all the slots are booked: if all_or_nothing, any failure frees the booked slots (no reservation is inserted) and raises.
+        """
+        prepared = sorted(prepared, key=lambda item: (item[2].new_reservation.start_time, item[0]))
+        booked, conflicting, outcomes = [], [], {}
+        if prepared:
+            locks_grant = await self.calendar._lock_slots([slot for _, _, reserv_context in prepared for slot in reserv_context.new_res_slots])
+            try:
+                for item in prepared:
+                    try:
+                        self.calendar._reserve_slots_no_lock(item[2].new_res_slots, expiry_time)
+                        booked.append(item)
+                    except AlreadyBookedError:
+                        conflicting.append(item)
+            except BaseException:
+                for _, _, reserv_context in booked:
+                    self.calendar._free_slots_no_lock(reserv_context.new_res_slots)
+                raise
+            finally:
+                self.calendar._unlock_slots(locks_grant)
+
+        for idx, reservation_params, _ in conflicting:
+            is_reserv_possible, reserv_context = self._prepare_make_reservation(**reservation_params, **prepare_kwargs)
+            try:
+                if not is_reserv_possible:
+                    raise reserv_context
+                await self.calendar.reserve_slots(reserv_context.new_res_slots, expiry_time)
+                booked.append((idx, reservation_params, reserv_context))
+            except Exception as e:
+                outcomes[idx] = e
+
+        if all_or_nothing and outcomes:
+            await self.calendar.free_slots([slot for _, _, reserv_context in booked for slot in reserv_context.new_res_slots])
+            first_idx = min(outcomes)
+            raise BusinessCore._bulk_item_error(first_idx, outcomes[first_idx])
+
+        inserted = []
+        for idx, _, reserv_context in booked:
+            reservation = reserv_context.new_reservation
+            reservation.resource = self.calendar.get_slots_resource(reserv_context.new_res_slots)
+            try:
+                await self.reservation_manager.insert_reservation(reservation)
+            except Exception as e:
+                await self.calendar.free_slots(reserv_context.new_res_slots)
+                if not all_or_nothing:
+                    outcomes[idx] = e
+                    continue
+                for inserted_idx, inserted_context in inserted:
+                    await self.reservation_manager.remove_reservation(inserted_context.new_reservation.reservation_id)
+                await self.calendar.free_slots([slot for booked_idx, _, booked_context in booked if booked_idx!=idx for slot in booked_context.new_res_slots])
+                raise BusinessCore._bulk_item_error(idx, e)
+            inserted.append((idx, reserv_context))
+            outcomes[idx] = BusinessEvent(event_type=ReservationEventType.CREATED, actor=actor, data=BusinessEvent.EventData(new=reservation))
+        return outcomes
+
+    @staticmethod
+    def _bulk_item_error(idx: int, error: Exception) -> Exception:
+        err_msg = f'Cannot make the reservations. Request {idx}: ' + getattr(error, 'message', str(error))
+        try:
+            return type(error)(err_msg)
+        except TypeError:
+            return error
             
             
             
@@ -363,7 +712,7 @@ class BusinessCore:
         if reservation_context.existing_res_slots is not None:
             slots_to_unbook = reservation_context.existing_res_slots
         else:
-            slots_to_unbook = self.calendar.get_slots(start_time=reservation.start_time, end_time=reservation.end_time, same_segment_only=True) #safe check -> retrieving slots from reservation times.
+            slots_to_unbook = self.calendar.get_booked_slots(start_time=reservation.start_time, end_time=reservation.end_time, resource=reservation.resource) #safe check -> retrieving slots from reservation times.
         
         #if not slots_to_unbook: 
             #await self.reservation_manager.insert_reservation(reservation)
@@ -388,14 +737,14 @@ class BusinessCore:
             return BusinessEvent(event_type=ReservationEventType.REPLACED, actor=actor, data=BusinessEvent.EventData(old = old_reservation, new = new_reservation))
            
        
-        old_res_slots = reservation_context.existing_res_slots if reservation_context.existing_res_slots is not None else self.calendar.get_slots(start_time=old_reservation.start_time, end_time=old_reservation.end_time, same_segment_only=True) #safe check -> retrieving slots from reservation times.
+        old_res_slots = reservation_context.existing_res_slots if reservation_context.existing_res_slots is not None else self.calendar.get_booked_slots(start_time=old_reservation.start_time, end_time=old_reservation.end_time, resource=old_reservation.resource) #safe check -> retrieving slots from reservation times.
         new_res_slots = reservation_context.new_res_slots if reservation_context.new_res_slots  is not None else self.calendar.get_slots(start_time=new_reservation.start_time, end_time=new_reservation.end_time, same_segment_only=True) #safe check -> retrieving slots from reservation times.
         if not old_res_slots or not new_res_slots:
             raise ClosingTimeError('Out of working hours')
+        new_reservation.resource = self.calendar.get_slots_resource(new_res_slots)
             
         #slots_to_book, slots_to_free = get_consecutive_slots_join(new_res_slots, old_res_slots, how='difference')  ##slots_to_book and slots_to_free will be only the "exclusive" slots (i.e. not overlapping between old_res_slots and new_res_slots)
-        slots_to_lock = sorted(set(new_res_slots + old_res_slots), key=lambda x: x.start_time)
-        locked_slots = await self.calendar._lock_slots(slots_to_lock)
+        locks_grant = await self._lock_slots_for_commit(reservation_context, new_res_slots + old_res_slots)
         prev_reserv_slots_canceled, new_reserv_slots_booked = False, False
         try:
             """ Locking slots, updating slots status (setting previous slots as "unbooked", new slots as "booked"). 
@@ -413,13 +762,69 @@ class BusinessCore:
                  self.calendar._free_slots_no_lock(new_res_slots)
             raise e
         finally:
-            self.calendar._unlock_slots(locked_slots)
+            self._unlock_slots_after_commit(locks_grant)
             
         await self.reservation_manager.remove_reservation(old_reservation.reservation_id)
         await self.reservation_manager.insert_reservation(new_reservation)
         return BusinessEvent(event_type=ReservationEventType.REPLACED, actor=actor, data=BusinessEvent.EventData(old = old_reservation, new = new_reservation))
         
         
+    async def _lock_slots_for_commit(self, reservation_context: ReservationOperationContext, slots: list[Slot]):
+        """
+        Returns the locks grant of the slots to commit reservation_context on, to be released through _unlock_slots_after_commit.
+        If the context is committed lock free (optimistic concurrency), no lock is acquired: CommitConflictError is raised if another operation holds
+        any of the slots locks, so that the operation gets prepared again. Otherwise the caller must book/free the slots with no await in between
+        (and none since the prepare), as nothing else can run on the event loop meanwhile.
+        """
+        if not reservation_context.lock_free_commit:
+            return await self.calendar._lock_slots(slots)
+        if self.calendar._are_slots_locked(slots):
+            raise CommitConflictError()
+        return None
+
+    def _unlock_slots_after_commit(self, locks_grant):
+        if locks_grant is not None:
+            self.calendar._unlock_slots(locks_grant)
+
+    def _begin_write(self) -> WriteLog|None:
+        """
+        Entering a write operation: if none was in progress, the live state is the committed one and the read snapshot is brought up to it
+        (built at the first write, then advanced by copying only the reservations and segments changed meanwhile).
+        Reads keep answering from such snapshot until no write is in progress anymore: nothing changing the state must bypass the write operations.
+        Returns the write log recording the changes of this write, to be passed to _end_write (None for a write nested in another one of the same task).
+        """
+        if not self._writes_in_progress:
+            if self._read_snapshot is None:
+                self._read_snapshot = ReadSnapshot(self._committed_version, self.calendar, self.reservation_manager)
+            elif self._read_snapshot.version != self._committed_version:
+                self._read_snapshot.advance(self._committed_version, self.calendar, self.reservation_manager)
+        self._writes_in_progress += 1
+        return begin_write_log()
+
+    def _end_write(self, write_log: WriteLog = None):
+        """ 
+        Leaving a write operation. If other writes are still in progress, the changes of this one (only) are published to the read snapshot,
+        so that the reads see it as soon as it ends, and none of the others until they end as well.
+        """
+        self._writes_in_progress -= 1
+        self._committed_version += 1
+        if write_log is None: ## nested write, published with the outermost one
+            return
+        end_write_log(write_log)
+        if self._writes_in_progress and self._read_snapshot is not None:
+            self._read_snapshot.publish(self._committed_version, write_log, self.calendar, self.reservation_manager)
+
+    def _get_read_view(self):
+        """ Returns the (calendar, reservations) the read methods answer from: the live ones, or the read snapshot ones while any write is in progress. """
+        if self._writes_in_progress:
+            return self._read_snapshot.calendar, self._read_snapshot
+        return self.calendar, self.reservation_manager
+
+    def __getstate__(self): ## e.g. the checkpoint deepcopy: the read snapshot is not copied, the copy builds its own at its first write
+        state = self.__dict__.copy()
+        state['_read_snapshot'], state['_writes_in_progress'] = None, 0
+        return state
+
     def _get_duration_from_service_name(self, service_name):
         try:
             return self.policy_manager.services[service_name].minutes_duration
@@ -486,11 +891,13 @@ class BusinessCoreWithConfirmation(BusinessCore):
     }
                             
     
-    def __init__(self, reservation_manager: ReservationManager, calendar: BusinessCalendar, policy_manager: PolicyManager, default_grid_minutes: int=15, max_confirmation_minutes: int=5):
-        super().__init__(reservation_manager=reservation_manager, calendar=calendar, policy_manager=policy_manager, default_grid_minutes=default_grid_minutes)
+    def __init__(self, reservation_manager: ReservationManager, calendar: BusinessCalendar, policy_manager: PolicyManager, default_grid_minutes: int=15, max_confirmation_minutes: int=5, optimistic_concurrency: bool=False):
+        super().__init__(reservation_manager=reservation_manager, calendar=calendar, policy_manager=policy_manager, default_grid_minutes=default_grid_minutes, optimistic_concurrency=optimistic_concurrency)
         self.max_confirmation_minutes = max_confirmation_minutes
         self.__unconfirmed_updates_timestamps__ = {}
         self.__unconfirmed_services_timestamps__ = {}
+        self._pending_expiries = None ## min-heap of (expiry_time, seq, reservation_id, operation) of the pending reservation operations, built lazily from the reservations
+        self._pending_expiries_seq = 0
 
 
     def delete_all_not_confirmed_services(self, expired_only: bool, actor: UserRole = UserRole.ADMIN):
@@ -503,8 +910,9 @@ class BusinessCoreWithConfirmation(BusinessCore):
             events.append(ServiceEventType.DELETED, data=BusinessEvent.EventData(old=serv), actor=actor)
         return events
     
+    @_write_operation
     async def delete_all_not_confirmed_reservations(self, expired_only: bool, user: str=None, actor: UserRole = UserRole.ADMIN):
-        all_reservations = self.get_all_reservations() if user is None else self.get_user_reservations(user)
+        all_reservations = self.reservation_manager.get_all_reservations() if user is None else self.reservation_manager.get_reservations_by_user(user)
         all_not_confirmed_reservations = [r for r in all_reservations if not r.is_confirmed]
         
         all_canceled_reservations_events = []
@@ -520,7 +928,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
             cancel_ev = await super()._cancel_reservation(cancel_operat_context, actor=actor)
             all_canceled_reservations_events.append(cancel_ev)
         
-        all_not_confirmed_updates = self.__unconfirmed_updates_timestamps__.keys() ##the reservations with inner updates are confirmed, hence we are sure we are actually handling all the existing inner updates here.
+        all_not_confirmed_updates = list(self.__unconfirmed_updates_timestamps__.keys()) ##the reservations with inner updates are confirmed, hence we are sure we are actually handling all the existing inner updates here.
         reservations_with_pending_inner_updates = [self.reservation_manager.get_reservation(res_id) for res_id in all_not_confirmed_updates]
         
         for reservation in reservations_with_pending_inner_updates:
@@ -532,6 +940,65 @@ class BusinessCoreWithConfirmation(BusinessCore):
             inner_cancel_event = await self.cancel_pending_update_reservation(reservation_id=reservation.reservation_id, actor=actor)
             all_canceled_reservations_events.append(inner_cancel_event)
         return all_canceled_reservations_events
+
+    @_write_operation
+    async def sweep_expired_pending_reservations(self, curr_time: dt.datetime = None, max_batch: int = None, actor: UserRole = UserRole.SYSTEM) -> list[BusinessEvent]:
+        """
+        Cancels (at most max_batch of) the pending reservation operations whose confirmation time expired, popping them from the expiry heap:
+        pending reservations are deleted, pending cancelations are reverted and pending inner updates are dropped.
+        Each one runs through the corresponding cancel_pending_* method, hence the returned events are the same of an explicit cancelation.
+        Heap entries are not removed when their operation gets confirmed or canceled: they are just skipped here if no longer matching.
+        """
+        if self._pending_expiries is None:
+            self._rebuild_pending_expiries()
+        cancel_methods = {BusinessOperation.MAKE: self.cancel_pending_make_reservation, BusinessOperation.DELETE: self.cancel_pending_cancel_reservation,
+                          BusinessOperation.UPDATE: self.cancel_pending_update_reservation}
+        events, n_canceled = [], 0
+        while self._pending_expiries and (max_batch is None or n_canceled < max_batch):
+            expiry_time, _, reservation_id, operation = self._pending_expiries[0]
+            if not (curr_time or dt.datetime.now(tz=expiry_time.tzinfo)) > expiry_time:
+                break
+            heapq.heappop(self._pending_expiries)
+            if self._get_pending_expiry_time(reservation_id, operation) != expiry_time:
+                continue
+            try:
+                cancel_events = await cancel_methods[operation](reservation_id, actor=actor)
+            except Exception as e:
+                warnings.warn(f'Cannot cancel the expired pending operation on reservation {reservation_id}: {e}')
+                continue
+            events.extend(cancel_events if isinstance(cancel_events, list) else [cancel_events])
+            n_canceled += 1
+        return events
+
+    def get_next_pending_expiry(self) -> dt.datetime:
+        """ Returns the earliest confirmation expiry time among the pending reservation operations (possibly of an already handled one), or None. """
+        if self._pending_expiries is None:
+            self._rebuild_pending_expiries()
+        return self._pending_expiries[0][0] if self._pending_expiries else None
+
+    def _schedule_pending_expiry(self, reservation_id: str, operation: BusinessOperation, expiry_time: dt.datetime):
+        if self._pending_expiries is None or expiry_time is None: ## not built yet: the operation will be found when building it
+            return
+        heapq.heappush(self._pending_expiries, (expiry_time, self._pending_expiries_seq, reservation_id, operation))
+        self._pending_expiries_seq += 1
+
+    def _rebuild_pending_expiries(self):
+        self._pending_expiries = []
+        for status, operation in [(ReservationStatus.PENDING_CONFIRMATION_STATUS, BusinessOperation.MAKE), (ReservationStatus.PENDING_CANCELATION_STATUS, BusinessOperation.DELETE),
+                                  (ReservationStatus.PENDING_UPDATE_STATUS, BusinessOperation.UPDATE)]:
+            for reservation in self.reservation_manager.get_reservations_by_status(status):
+                self._schedule_pending_expiry(reservation.reservation_id, operation, self._get_pending_expiry_time(reservation.reservation_id, operation))
+
+    def _get_pending_expiry_time(self, reservation_id: str, operation: BusinessOperation) -> dt.datetime:
+        """ Returns the confirmation expiry time of the pending operation on the reservation, or None if the reservation has no such pending operation. """
+        reservation = self.reservation_manager.get_reservation(reservation_id)
+        if reservation is None or reservation.status not in BusinessCoreWithConfirmation.ALLOWED_STATUSES_TO_CONFIRM_OP[operation]:
+            return None
+        if operation==BusinessOperation.UPDATE:
+            reservation = reservation.get_associated_update_reservation()
+            if not isinstance(reservation, Reservation):
+                return None
+        return reservation.get_pending_status_expiration()
             
     
     async def _make_reservation(self, reservation_context: BusinessCore.ReservationOperationContext, actor: UserRole, expiry_time: dt.datetime=None):
@@ -541,8 +1008,22 @@ class BusinessCoreWithConfirmation(BusinessCore):
         if isinstance(reservation_ev, BusinessEvent):
             reservation = reservation_ev.data.new
             reservation.mark_as_pending_confirmation(expiry_time) ##if reservation is correctly placed, it is a new reservation (i.e. no confirmation). 'pending' status by default
+            self._schedule_pending_expiry(reservation.reservation_id, BusinessOperation.MAKE, expiry_time)
             return BusinessEvent(BusinessCoreWithConfirmation._get_event_type(operation=BusinessOperation.MAKE, pending_op=PendingOperation.REQUESTED, object_type=Reservation), data=BusinessEvent.EventData(new=reservation), actor=actor)
         return reservation_ev
+
+    async def _make_reservations_bulk(self, prepared: list[tuple[int, dict, BusinessCore.ReservationOperationContext]], actor: UserRole, all_or_nothing: bool, prepare_kwargs: dict, expiry_time: dt.datetime=None) -> dict[int, BusinessEvent|Exception]:
+        if expiry_time is None:
+            expiry_time = map_datetime_to_default(dt.datetime.now()+timedelta(minutes=self.max_confirmation_minutes), ignore_seconds=False)
+        outcomes = await super()._make_reservations_bulk(prepared, actor=actor, all_or_nothing=all_or_nothing, prepare_kwargs=prepare_kwargs, expiry_time=expiry_time)
+        event_type = BusinessCoreWithConfirmation._get_event_type(operation=BusinessOperation.MAKE, pending_op=PendingOperation.REQUESTED, object_type=Reservation)
+        for idx, outcome in outcomes.items():
+            if isinstance(outcome, BusinessEvent):
+                reservation = outcome.data.new
+                reservation.mark_as_pending_confirmation(expiry_time) ##same as _make_reservation: new reservations wait for confirmation
+                self._schedule_pending_expiry(reservation.reservation_id, BusinessOperation.MAKE, expiry_time)
+                outcomes[idx] = BusinessEvent(event_type, data=BusinessEvent.EventData(new=reservation), actor=actor)
+        return outcomes
         
         
     async def _cancel_reservation(self, reservation_context: BusinessCore.ReservationOperationContext, actor: UserRole):
@@ -562,6 +1043,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
         if curr_existing_res.is_confirmed:
             confirmation_expiry_time = map_datetime_to_default(dt.datetime.now()+timedelta(minutes=self.max_confirmation_minutes), ignore_seconds=False )
             curr_existing_res.mark_as_pending_delete(confirmation_expiry_time) ##cancelation on a confirmed reservation -> marking as "pending cancelation" till user confirms it
+            self._schedule_pending_expiry(curr_existing_res.reservation_id, BusinessOperation.DELETE, confirmation_expiry_time)
             
             events.append(BusinessEvent(ReservationEventType.PENDING_DELETE_CREATED, data=BusinessEvent.EventData(old=old_res, new=curr_existing_res), actor=actor))
             return events    
@@ -606,6 +1088,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
                 old_reservation, new_reservation = update_event.data.old, update_event.data.new
                 new_reservation.mark_as_pending_confirmation(new_reservation_expiry_time)
                 old_reservation.mark_as_deleted()
+                self._schedule_pending_expiry(new_reservation.reservation_id, BusinessOperation.MAKE, new_reservation_expiry_time)
             return update_event
         
         
@@ -622,15 +1105,16 @@ class BusinessCoreWithConfirmation(BusinessCore):
         if not isinstance(unconfirmed_previous_requested_update, Reservation) or unconfirmed_previous_requested_update.is_confirmation_expired():
             prev_inner_update_slots_to_release = []
         else:
-            prev_inner_update_slots_to_release = self.calendar.get_slots(start_time=unconfirmed_previous_requested_update.start_time, end_time=unconfirmed_previous_requested_update.end_time, same_segment_only=True)
+            prev_inner_update_slots_to_release = self.calendar.get_booked_slots(start_time=unconfirmed_previous_requested_update.start_time, end_time=unconfirmed_previous_requested_update.end_time, resource=unconfirmed_previous_requested_update.resource)
         
         new_res_slots = reservation_context.new_res_slots if reservation_context.new_res_slots is not None else self.calendar.get_slots(start_time=new_reservation.start_time, end_time=new_reservation.end_time, same_segment_only=True)
-        old_res_slots = reservation_context.existing_res_slots if reservation_context.existing_res_slots is not None else self.calendar.get_slots(start_time=old_reservation.start_time, end_time=old_reservation.end_time, same_segment_only=True) 
+        old_res_slots = reservation_context.existing_res_slots if reservation_context.existing_res_slots is not None else self.calendar.get_booked_slots(start_time=old_reservation.start_time, end_time=old_reservation.end_time, resource=old_reservation.resource) 
+        new_reservation.resource = self.calendar.get_slots_resource(new_res_slots)
         ###slots_to_free -> exclusive slots for the previous update request (if any) related to this old_res.
         slots_to_free = get_consecutive_slots_join(prev_inner_update_slots_to_release, old_res_slots, how='difference')[0]
         ###slots_to_book -> exclusive slots for the current update request (i.e. new_res).
         slots_to_book = get_consecutive_slots_join(new_res_slots, old_res_slots, how='difference')[0]
-        locked_slots = await self.calendar._lock_slots(sorted(set(slots_to_book+slots_to_free), key=lambda x: x.start_time))
+        locks_grant = await self._lock_slots_for_commit(reservation_context, slots_to_book+slots_to_free)
         new_res_slots_booked, old_res_slots_unbooked = False, False                                      
         try: 
             old_res_slots_unbooked = self.calendar._free_slots_no_lock(slots_to_free) ##always freeing old inner update slot    
@@ -644,7 +1128,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
                 pass ##no need to rebook them->they were part of the previous inner_update only. it is fine to free them.
             raise AlreadyBookedError('Cannot update. The requested time is not available for booking')
         finally:
-            self.calendar._unlock_slots(locked_slots)
+            self._unlock_slots_after_commit(locks_grant)
             try:
                 events.append(self._cancel_inner_update_reference(old_reservation, actor=UserRole.SYSTEM)) ##removing previous inner update reference
             except:
@@ -653,6 +1137,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
             raise ClosingTimeError('Cannot update at the requested time slots. Out of working hours')
         old_reservation.mark_as_pending_update(updated_reservation=new_reservation, expires_at=new_reservation_expiry_time) ###setting the new reservation as a parameter within the old one. This way the system will create it -> old res will have status='pending update', new res will have status='pending confirmation'
         self.__unconfirmed_updates_timestamps__[old_reservation.reservation_id] = curr_time
+        self._schedule_pending_expiry(old_reservation.reservation_id, BusinessOperation.UPDATE, new_reservation_expiry_time)
         events.append(
             BusinessEvent(event_type=BusinessCoreWithConfirmation._get_event_type(operation=BusinessOperation.UPDATE, pending_op=PendingOperation.REQUESTED, object_type=Reservation), 
                           actor=actor, data=BusinessEvent.EventData(old=old_res_unedited, new=old_reservation),
@@ -662,6 +1147,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
 
 
     
+    @_write_operation
     async def confirm_pending_make_reservation(self, reservation_id: str, actor: UserRole = UserRole.USER): 
         can_confirm, error, reservation = self._validate_existing_reservation_pending_op(reservation_id = reservation_id, operation=BusinessOperation.MAKE)
         if not can_confirm:
@@ -672,12 +1158,13 @@ class BusinessCoreWithConfirmation(BusinessCore):
         
         old_res = reservation.copy()
         reservation.mark_as_confirmed()
-        res_slots = self.calendar.get_slots(start_time=reservation.start_time, end_time=reservation.end_time, same_segment_only=True)
+        res_slots = self.calendar.get_booked_slots(start_time=reservation.start_time, end_time=reservation.end_time, resource=reservation.resource)
         await self.calendar._update_slots_expiry_time(res_slots, expiry_time=None) ##removing expiry time from reservation' slots -> it is confirmed!
         return BusinessEvent(event_type=BusinessCoreWithConfirmation._get_event_type(operation=BusinessOperation.MAKE, pending_op=PendingOperation.PENDING_CONFIRMED, object_type=Reservation), actor=actor, data=BusinessEvent.EventData(old=old_res, new=reservation))
         
         
         
+    @_write_operation
     async def cancel_pending_make_reservation(self, reservation_id: str, actor: UserRole=UserRole.USER):
         can_cancel, error, _ = self._validate_existing_reservation_pending_op(reservation_id = reservation_id, operation=BusinessOperation.MAKE)
         if not can_cancel:
@@ -693,6 +1180,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
 
         
     
+    @_write_operation
     async def confirm_pending_cancel_reservation(self, reservation_id: str, actor: UserRole = UserRole.USER): 
         can_confirm, error, _ = self._validate_existing_reservation_pending_op(reservation_id=reservation_id, operation=BusinessOperation.DELETE)
         if not can_confirm:
@@ -711,6 +1199,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
 
     
     
+    @_write_operation
     async def cancel_pending_cancel_reservation(self, reservation_id: str, actor: UserRole=UserRole.USER):
         can_cancel, error, reservation = self._validate_existing_reservation_pending_op(reservation_id=reservation_id, operation=BusinessOperation.DELETE)
         if not can_cancel:
@@ -725,6 +1214,7 @@ class BusinessCoreWithConfirmation(BusinessCore):
         
         
     
+    @_write_operation
     async def confirm_pending_update_reservation(self, reservation_id: str, actor: UserRole = UserRole.USER):
         from backend.slots_utils import get_consecutive_slots_join
         
@@ -737,15 +1227,15 @@ class BusinessCoreWithConfirmation(BusinessCore):
         
         pending_update_reserv = existing_reservation.get_associated_update_reservation() 
         
-        new_res_slots = self.calendar.get_slots(start_time=pending_update_reserv.start_time, end_time=pending_update_reserv.end_time, same_segment_only=True)
-        old_res_slots = self.calendar.get_slots(start_time=existing_reservation.start_time, end_time=existing_reservation.end_time, same_segment_only=True)
+        new_res_slots = self.calendar.get_booked_slots(start_time=pending_update_reserv.start_time, end_time=pending_update_reserv.end_time, resource=pending_update_reserv.resource)
+        old_res_slots = self.calendar.get_booked_slots(start_time=existing_reservation.start_time, end_time=existing_reservation.end_time, resource=existing_reservation.resource)
         if not new_res_slots or not old_res_slots:
             raise ClosingTimeError('Out of working hours') ##should never happen as far as there is no modification to the calendar while reservation was "pending_update"
         slots_to_free = get_consecutive_slots_join(new_res_slots, old_res_slots, how='difference')[1]  #slots_to_free will be only the "exclusive" old slots (i.e. old slots - new slots) to free
-        locked_slots = await self.calendar._lock_slots(slots_to_free+new_res_slots)
+        locks_grant = await self.calendar._lock_slots(slots_to_free+new_res_slots)
         self.calendar._set_slots_expiry_time_no_lock(new_res_slots, expiry_time=None) ##removing expiry time from new_reservation' slots -> it is confirmed!
         self.calendar._free_slots_no_lock(slots_to_free) ##releasing old reservation slots
-        self.calendar._unlock_slots(locked_slots)
+        self.calendar._unlock_slots(locks_grant)
         existing_reservation.mark_as_confirmed_update() ##setting the status as 'confirmed' to the new reservation and 'deleted' to the old one
         await self.reservation_manager.remove_reservation(existing_reservation.reservation_id) ##removing old reservation from "db"
         await self.reservation_manager.insert_reservation(pending_update_reserv) ###inserting the new update reservation among reservations
@@ -754,26 +1244,27 @@ class BusinessCoreWithConfirmation(BusinessCore):
   
    
     
+    @_write_operation
     async def cancel_pending_update_reservation(self, reservation_id: str, actor: UserRole=UserRole.USER):
         """ Releases slots of the update, removes update_reservation from __unconfirmed_updates_timestamps__ , removes update_reservation from attributes of the current reservation """
         from backend.slots_utils import get_consecutive_slots_join
 
-        can_cancel, error, existing_reservation = self._validate_existing_reservation_pending_op(reservation=existing_reservation, operation=BusinessOperation.UPDATE)
+        can_cancel, error, existing_reservation = self._validate_existing_reservation_pending_op(reservation_id=reservation_id, operation=BusinessOperation.UPDATE)
         if not can_cancel:
             if isinstance(error, ExpiryError):
                 actor = UserRole.SYSTEM
             else:
-                raise e
+                raise error
         
-        pending_update_reserv = old_reservation.get_associated_update_reservation() 
+        pending_update_reserv = existing_reservation.get_associated_update_reservation() 
         pending_update_canc_ev = self._cancel_inner_update_reference(reservation=existing_reservation, actor=actor)
         
         if pending_update_reserv.is_confirmation_expired():
             update_reservation_slots = []
         else:
-            update_reservation_slots = self.calendar.get_slots(start_time=pending_update_reserv.start_time, end_time=pending_update_reserv.end_time, same_segment_only=True)
+            update_reservation_slots = self.calendar.get_booked_slots(start_time=pending_update_reserv.start_time, end_time=pending_update_reserv.end_time, resource=pending_update_reserv.resource)
         
-        existing_reservation_slots = self.calendar.get_slots(start_time=existing_reservation.start_time, end_time=existing_reservation.end_time, same_segment_only=True)
+        existing_reservation_slots = self.calendar.get_booked_slots(start_time=existing_reservation.start_time, end_time=existing_reservation.end_time, resource=existing_reservation.resource)
         slots_to_free = get_consecutive_slots_join(update_reservation_slots, existing_reservation_slots, how='difference')[0]
         await self.calendar.free_slots(slots_to_free) ##releasing "exclusive" inner update reservation slots. (i.e. new_res_slots - old_res_slots)
         
@@ -52,5 +52,12 @@ class ExpiryError(Exception):
         
 class NotAllowedError(Exception):
     def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class CommitConflictError(Exception):
+    """Exception raised when the slots of a lock free (optimistic) commit are locked by another operation. The operation is to be prepared again.
+    """
+    def __init__(self, message='Slots locked by another operation'):
         self.message = message
         super().__init__(self.message)
\ No newline at end of file
@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+
+_DEFAULT_MAX_ENTRIES = 1024
+_DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+class IdempotencyTable:
+    """
+    Bounded table of the results of the BookingService operations by idempotency key, to answer the repeats of an operation (e.g. the chat layer
+    retrying a message whose requests already ran) with the first result, without running the operation again.
+    Each entry holds a fingerprint of the operation arguments: a key reused for different arguments is a miss.
+    Entries expire ttl_seconds after being recorded, and beyond max_entries the least recently used ones are evicted: lookups and records are O(1) (amortized).
+    Expiries are wall clock (epoch seconds), as the table is persisted with the checkpoints of the BusinessCore holding it.
+    """
+    __slots__ = ('max_entries', 'ttl_seconds', '_entries')
+
+    def __init__(self, max_entries: int = _DEFAULT_MAX_ENTRIES, ttl_seconds: float = _DEFAULT_TTL_SECONDS):
+        if max_entries < 1 or ttl_seconds <= 0:
+            raise ValueError('max_entries and ttl_seconds must be positive')
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() ## key -> (expires_at, fingerprint, result), from the least to the most recently used
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str, fingerprint: str = None):
+        """ The (fingerprint, result) recorded under key, None if missing, expired or (when fingerprint is given) recorded for different arguments. """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, entry_fingerprint, result = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        if fingerprint is not None and fingerprint != entry_fingerprint:
+            return None
+        self._entries.move_to_end(key)
+        return entry_fingerprint, result
+
+    def record(self, key: str, fingerprint: str, result, expires_at: float = None):
+        self._entries[key] = (time.time() + self.ttl_seconds if expires_at is None else expires_at, fingerprint, result)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        now = time.time()
+        while self._entries:
+            oldest_key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and expires_at > now:
+                break
+            del self._entries[oldest_key]
+
+    def items(self) -> list[tuple]:
+        """ (key, expires_at, fingerprint, result) of the live entries, from the least to the most recently used. """
+        now = time.time()
+        return [(key, expires_at, fingerprint, result) for key, (expires_at, fingerprint, result) in self._entries.items() if expires_at > now]
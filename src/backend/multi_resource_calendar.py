@@ -0,0 +1,276 @@
+import datetime, itertools
+from backend.business_calendar import BusinessCalendar, Segment, Slot, _indexes_to_mask, _group_slots_indexes_by_segment
+from backend.domain_errors import AlreadyBookedError
+from utils.datetimes_utils import to_epoch_minutes
+from bisect import bisect_left
+
+
+class MultiResourceCalendar(BusinessCalendar):
+    """
+    Calendar of N resources (e.g. chairs) able to host a booking at the same time, each one tracked by its own BusinessCalendar (self.resources).
+    All the resources share the same timeline (opening hours): structural changes (add/remove/evict segments) are applied to each of them,
+    and self.segments are the first resource segments, used as timeline for the queries on times (find_segment_containing, opening hours...).
+    Availability is the union of the resources ones: a start is available if it is on any resource, the resource being chosen at booking time by get_slots
+    (the first one on which the requested time is free). The resource of each booking is recorded on its reservation (Reservation.resource) and used by get_booked_slots.
+    Queries are answered through merged per-resource indexes (free intervals, first available slot, daily counters), not by scanning the calendars slot by slot.
+    """
+    def __init__(self, n_resources: int, slot_minutes_duration: int = 5):
+        if n_resources < 1:
+            raise ValueError('A calendar needs at least one resource')
+        self.resources = [BusinessCalendar(slot_minutes_duration=slot_minutes_duration) for _ in range(n_resources)]
+        super().__init__(slot_minutes_duration=slot_minutes_duration)
+
+    @property
+    def segments(self) -> list[Segment]:
+        return self.resources[0].segments
+
+    @segments.setter
+    def segments(self, segments: list[Segment]):
+        """ Only meant for BusinessCalendar.__init__: the resources segments are changed through the structural methods (add_segment, remove_segment...) """
+        if segments:
+            raise ValueError('Cannot set the segments of a MultiResourceCalendar. Use add_segments instead')
+
+    @property
+    def n_resources(self) -> int:
+        return len(self.resources)
+
+    def _get_time_keys(self) -> tuple[list[int], list[int]]:
+        return self.resources[0]._get_time_keys()
+
+    def add_segment(self, segment: Segment):
+        self.resources[0].add_segment(segment) ## raises on overlaps before any change
+        for resource_calendar in self.resources[1:]:
+            resource_calendar.add_segment(segment.copy())
+        self._availability_cache.clear()
+        return True
+
+    def add_segments(self, segments: list[Segment]):
+        if not self.resources[0].add_segments(segments): ## raises on overlaps before any change
+            return False
+        for resource_calendar in self.resources[1:]:
+            resource_calendar.add_segments([segment.copy() for segment in segments])
+        self._availability_cache.clear()
+        return True
+
+    def evict_segments_before(self, end_time: datetime.datetime) -> list[Segment]:
+        """ Evicts the segments fully past end_time from every resource, returning the evicted (timeline) segments of the first one. """
+        evicted_segments = [resource_calendar.evict_segments_before(end_time) for resource_calendar in self.resources]
+        self._availability_cache.clear()
+        return evicted_segments[0]
+
+    def remove_segment(self, start_time: datetime.datetime, end_time: datetime.datetime, raise_error_if_any_booking: bool = True):
+        if raise_error_if_any_booking and any(slot.is_booked() for resource_calendar in self.resources for slot in resource_calendar.get_slots(start_time=start_time, end_time=end_time)):
+            raise ValueError(f'Cannot remove segments: they contain bookings.')
+        for resource_calendar in self.resources:
+            resource_calendar.remove_segment(start_time=start_time, end_time=end_time, raise_error_if_any_booking=False)
+        self._availability_cache.clear()
+
+    def copy(self, previous_copy: "MultiResourceCalendar" = None, changed_segments: set[Segment] = None):
+        calendar = MultiResourceCalendar(n_resources=self.n_resources, slot_minutes_duration=self.slot_minutes_duration)
+        if previous_copy is None or changed_segments is None:
+            calendar.resources = [resource_calendar.copy() for resource_calendar in self.resources]
+        else:
+            calendar.resources = [resource_calendar.copy(previous_resource_copy, changed_segments) for resource_calendar, previous_resource_copy in zip(self.resources, previous_copy.resources)]
+        return calendar
+
+    def pop_changed_segments(self) -> set[Segment]:
+        changed_segments = [resource_calendar.pop_changed_segments() for resource_calendar in self.resources]
+        return None if None in changed_segments else set().union(*changed_segments)
+
+    def join(self, other: BusinessCalendar) -> "MultiResourceCalendar":
+        """
+        Merges other into a new MultiResourceCalendar: a (single resource) BusinessCalendar is joined to each resource (e.g. new opening hours),
+        a MultiResourceCalendar resource by resource. Raises OverlappingSegmentsError if any overlap is detected.
+        """
+        other_resources = other.resources if isinstance(other, MultiResourceCalendar) else [other] * self.n_resources
+        if len(other_resources) != self.n_resources:
+            raise ValueError('Resources number mismatch. Cannot join')
+        merged = MultiResourceCalendar(n_resources=self.n_resources, slot_minutes_duration=self.slot_minutes_duration)
+        merged.resources = [resource_calendar.join(other_resource) for resource_calendar, other_resource in zip(self.resources, other_resources)]
+        return merged
+
+    def _release_expired_bookings(self, curr_time: datetime.datetime = None) -> int:
+        return sum(resource_calendar._release_expired_bookings(curr_time) for resource_calendar in self.resources)
+
+    def _find_free_resource(self, start_time: datetime.datetime, end_time: datetime.datetime, preferred_resource: int = None) -> int:
+        """ Returns the first resource (preferred_resource first, if given) on which [start_time, end_time) is free. None if there is none, or it is out of the opening hours. """
+        segment_pos = self.find_segment_containing(start_time=start_time, end_time=end_time, return_index=True)
+        if segment_pos is None:
+            return None
+        start_idx, end_idx = self.segments[segment_pos]._get_indexes_slice(start_time=start_time, end_time=end_time)
+        for resource in self._get_resources_order(preferred_resource):
+            if self.resources[resource].segments[segment_pos]._is_range_free(start_idx, end_idx):
+                return resource
+        return None
+
+    def _find_booked_resource(self, start_time: datetime.datetime, end_time: datetime.datetime) -> int:
+        """ Returns the first resource on which [start_time, end_time) is fully booked. None if there is none. """
+        segment_pos = self.find_segment_containing(start_time=start_time, end_time=end_time, return_index=True)
+        if segment_pos is None:
+            return None
+        start_idx, end_idx = self.segments[segment_pos]._get_indexes_slice(start_time=start_time, end_time=end_time)
+        range_mask = _indexes_to_mask(range(start_idx, end_idx))
+        return next((resource for resource, resource_calendar in enumerate(self.resources) if resource_calendar.segments[segment_pos]._booked & range_mask == range_mask), None)
+
+    def _get_resources_order(self, preferred_resource: int = None) -> list[int]:
+        if preferred_resource is None or not 0 <= preferred_resource < self.n_resources:
+            return list(range(self.n_resources))
+        return [preferred_resource] + [resource for resource in range(self.n_resources) if resource != preferred_resource]
+
+    def is_available_timeframe(self, start_time: datetime.datetime, end_time: datetime.datetime, as_int_error: bool = False):
+        if self.find_segment_containing(start_time, end_time) is None:
+            return -1 if as_int_error else False
+        return self._find_free_resource(start_time, end_time) is not None
+
+    def get_slots(self, start_time: datetime.datetime, end_time: datetime.datetime, same_segment_only: bool = False):
+        """
+        Returns the slots to book for a new booking of [start_time, end_time): those of the first resource on which it is free (of the first resource if there is none,
+        so that booking them raises AlreadyBookedError). Each resource is checked with a single bitset test: O(log n_segments + n_resources).
+        """
+        free_resource = self._find_free_resource(start_time, end_time)
+        return self.resources[free_resource or 0].get_slots(start_time=start_time, end_time=end_time, same_segment_only=same_segment_only)
+
+    def get_booked_slots(self, start_time: datetime.datetime, end_time: datetime.datetime, resource: int = None) -> list[Slot]:
+        """
+        Returns the slots of the booking [start_time, end_time) made on resource.
+        If resource is not known (bookings made before the calendar had several resources), the first resource on which such time is fully booked is taken,
+        or the first one on which it is free if there is none (e.g. when booking it again, while loading).
+        """
+        if resource is None or not 0 <= resource < self.n_resources:
+            resource = self._find_booked_resource(start_time, end_time)
+            if resource is None:
+                resource = self._find_free_resource(start_time, end_time) or 0
+        return self.resources[resource].get_slots(start_time=start_time, end_time=end_time, same_segment_only=True)
+
+    def iter_resources_slots(self, start_time: datetime.datetime, end_time: datetime.datetime, preferred_resource: int = None):
+        for resource in self._get_resources_order(preferred_resource):
+            yield self.resources[resource].get_slots(start_time=start_time, end_time=end_time, same_segment_only=True)
+
+    def get_slots_resource(self, slots: list[Slot]) -> int:
+        """ Returns the resource the slots belong to (the one of the first slot). None if there are no slots or they are not in the calendar. """
+        if not slots:
+            return None
+        return self._get_segment_resource(slots[0].segment)
+
+    def _get_segment_resource(self, segment: Segment) -> int:
+        for resource, resource_calendar in enumerate(self.resources):
+            segment_pos = bisect_left(resource_calendar._get_time_keys()[0], segment._start_minute)
+            if segment_pos < len(resource_calendar.segments) and resource_calendar.segments[segment_pos] is segment:
+                return resource
+        return None
+
+    def _group_slots_by_resource(self, slots: list[Slot]) -> dict[int, list[Slot]]:
+        resource_by_segment = {segment: self._get_segment_resource(segment) for segment in _group_slots_indexes_by_segment(slots)}
+        if None in resource_by_segment.values():
+            raise ValueError('Slots not belonging to the calendar')
+        slots_by_resource = {}
+        for slot in slots:
+            slots_by_resource.setdefault(resource_by_segment[slot.segment], []).append(slot)
+        return slots_by_resource
+
+    async def _lock_slots(self, slots: list[Slot]):
+        """ Locks the slots ranges on each involved resource. Resources are always locked in ascending order, so no deadlock can arise among them. """
+        locks_grants = []
+        try:
+            for resource, resource_slots in sorted(self._group_slots_by_resource(slots).items(), key=lambda x: x[0]):
+                locks_grants.append((resource, await self.resources[resource]._lock_slots(resource_slots)))
+        except BaseException:
+            self._unlock_slots(locks_grants)
+            raise
+        return locks_grants
+
+    def _unlock_slots(self, locks_grants):
+        for resource, locks_grant in locks_grants:
+            self.resources[resource]._unlock_slots(locks_grant)
+
+    def _are_slots_locked(self, slots: list[Slot]) -> bool:
+        return any(self.resources[resource]._are_slots_locked(resource_slots) for resource, resource_slots in self._group_slots_by_resource(slots).items())
+
+    def _reserve_slots_no_lock(self, slots: list[Slot], expiry_time: datetime.datetime = None):
+        self._release_expired_bookings()
+        slots_by_resource = self._group_slots_by_resource(slots)
+        if any(any(slot.is_booked() for slot in resource_slots) for resource_slots in slots_by_resource.values()): ## checking every resource before booking any of them
+            raise AlreadyBookedError('Already booked')
+        for resource, resource_slots in slots_by_resource.items():
+            self.resources[resource]._reserve_slots_no_lock(resource_slots, expiry_time)
+        return True
+
+    def _free_slots_no_lock(self, slots: list[Slot]):
+        for resource, resource_slots in self._group_slots_by_resource(slots).items():
+            self.resources[resource]._free_slots_no_lock(resource_slots)
+        return True
+
+    def _set_slots_expiry_time_no_lock(self, slots: list[Slot], expiry_time):
+        slots_by_resource = self._group_slots_by_resource(slots)
+        if not all(slot.is_booked() for resource_slots in slots_by_resource.values() for slot in resource_slots):
+            raise ValueError('cannot set expiry time on unbooked slots')
+        for resource, resource_slots in slots_by_resource.items():
+            self.resources[resource]._set_slots_expiry_time_no_lock(resource_slots, expiry_time)
+        return True
+
+    def _get_availability_cache_tag(self, start_minute: int|float, end_minute: int|float) -> tuple:
+        first_segment_pos, last_segment_pos = self._get_segment_positions_involved(start_minute, end_minute)
+        return tuple((segment, segment._version) for resource_calendar in self.resources for segment in itertools.islice(resource_calendar.segments, first_segment_pos, last_segment_pos))
+
+    def _get_available_start_indexes_at(self, segment_pos: int, start_idx: int, end_idxs: list[int], n_slots_needed: list[int], grid_step: int = 1) -> list[tuple[list[int], list[int]]]:
+        """ Union over the resources of the available start indexes at segment_pos (see _get_merged_available_start_indexes_batch). """
+        return _get_merged_available_start_indexes_batch([resource_calendar.segments[segment_pos] for resource_calendar in self.resources],
+                                                         start_idx=start_idx, end_idxs=end_idxs, n_slots_needed=n_slots_needed, grid_step=grid_step)
+
+    def get_first_available_slot(self, minutes_duration: int, min_start_time: datetime.datetime, minutes_grid_span: int = 15) -> Slot:
+        """ Earliest of the resources first available slots (the first resource one on ties): O(n_resources * log n_segments) through their free runs trees. """
+        resources_first_slots = [resource_calendar.get_first_available_slot(minutes_duration=minutes_duration, min_start_time=min_start_time, minutes_grid_span=minutes_grid_span)
+                                 for resource_calendar in self.resources]
+        return min((slot for slot in resources_first_slots if slot is not None), key=lambda slot: to_epoch_minutes(slot.start_time), default=None)
+
+    def get_nearest_available_slots(self, minutes_duration: int, target_time: datetime.datetime, k: int = 3, minutes_grid_span: int = 15, min_start_time: datetime.datetime = None) -> list[Slot]:
+        """ Merges the k nearest available slots of each resource: returns the k closest distinct start times (ties broken in favour of the earlier one). """
+        nearest_slots, seen_start_times = [], set()
+        resources_nearest_slots = [slot for resource_calendar in self.resources
+                                   for slot in resource_calendar.get_nearest_available_slots(minutes_duration=minutes_duration, target_time=target_time, k=k,
+                                                                                             minutes_grid_span=minutes_grid_span, min_start_time=min_start_time)]
+        for slot in sorted(resources_nearest_slots, key=lambda slot: (abs(slot.start_time - target_time), slot.start_time)):
+            if slot.start_time not in seen_start_times and len(nearest_slots) < k:
+                seen_start_times.add(slot.start_time)
+                nearest_slots.append(slot)
+        return nearest_slots
+
+    def get_daily_free_counters(self, from_date: datetime.date, to_date: datetime.date) -> dict[datetime.date, tuple[int, int]]:
+        """ Merges the resources per-day counters: (total n free slots, longest free run on a single resource) by day. """
+        daily_free_counters = {}
+        for resource_calendar in self.resources:
+            for day, (n_free_slots, max_free_run) in resource_calendar.get_daily_free_counters(from_date=from_date, to_date=to_date).items():
+                prev_n_free_slots, prev_max_free_run = daily_free_counters.get(day, (0, 0))
+                daily_free_counters[day] = (prev_n_free_slots + n_free_slots, max(prev_max_free_run, max_free_run))
+        return daily_free_counters
+
+
+def _get_merged_available_start_indexes_batch(segments: list[Segment], start_idx: int, end_idxs: list[int], n_slots_needed: list[int], grid_step: int = 1) -> list[tuple[list[int], list[int]]]:
+    """
+    _get_available_start_indexes_batch over several segments with the same bounds (one by resource), returning the union of their available start indexes.
+    Each free interval is mapped to the range of its valid starts, then the ranges of all the segments are merged before emitting the grid starts:
+    O(n_segments * n_free_intervals * n_pairs + n_results), the results being emitted once whatever the number of segments.
+    """
+    starts_ranges_by_pair, special_indexes_by_pair = [[] for _ in n_slots_needed], [set() for _ in n_slots_needed]
+    for segment in segments:
+        if segment._max_free_run < min(n_slots_needed, default=0):
+            continue
+        for interval_start, max_interval_end in segment._iter_free_intervals(start_idx, max(end_idxs, default=start_idx)):
+            for end_idx, pair_n_slots_needed, starts_ranges, special_indexes in zip(end_idxs, n_slots_needed, starts_ranges_by_pair, special_indexes_by_pair):
+                last_valid_start = min(max_interval_end, end_idx) - pair_n_slots_needed
+                if last_valid_start < interval_start:
+                    continue
+                if interval_start % grid_step and interval_start > start_idx:
+                    special_indexes.add(interval_start)
+                starts_ranges.append((interval_start, last_valid_start))
+
+    indexes_by_pair = []
+    for starts_ranges, special_indexes in zip(starts_ranges_by_pair, special_indexes_by_pair):
+        default_indexes, next_start = [], 0 ## the grid starts before next_start are already emitted
+        for first_start, last_start in sorted(starts_ranges):
+            first_grid_start = max(first_start, next_start)
+            first_grid_start += -first_grid_start % grid_step
+            default_indexes.extend(range(first_grid_start, last_start+1, grid_step))
+            next_start = max(next_start, last_start+1)
+        indexes_by_pair.append((default_indexes, sorted(special_indexes)))
+    return indexes_by_pair
@@ -0,0 +1,134 @@
+import datetime
+from bisect import bisect_left
+from collections import defaultdict
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.reservations import Reservation, ReservationManager
+from backend.write_log import WriteLog
+
+
+class ReadSnapshot:
+    """
+    Read-only view of the calendar and of the reservations of a BusinessCore at a committed version: the read queries answer from it while
+    any write operation is in progress, as the live state may then be half changed by a writer suspended on an await.
+    The reservations are copies, indexed by id, user and date; the calendar is a copy whose segments are shared with the previous version when unchanged.
+    Moving to a newer version (advance) only copies again what changed meanwhile, as reported by ReservationManager.pop_changed_reservation_ids and
+    BusinessCalendar.pop_changed_segments. Each write ending while others are still in progress is published on its own (publish), from its write log.
+    Queries are synchronous, hence never read a snapshot across an await: it is advanced and published in place, between two of them.
+    """
+    __slots__ = ('version', 'calendar', 'archive', '_reservations_by_id', '_reservations_by_user', '_reservations_by_date', '_source_calendar', '_is_behind')
+
+    def __init__(self, version: int, calendar: BusinessCalendar, reservation_manager: ReservationManager):
+        self._reservations_by_id = {}
+        self._reservations_by_user = defaultdict(set)
+        self._reservations_by_date = defaultdict(set)
+        self.calendar, self._source_calendar = None, None
+        self._is_behind = False
+        reservation_manager.pop_changed_reservation_ids()
+        for reservation in reservation_manager.reservations_id_mappings.values():
+            self._add_reservation(reservation)
+        self._set_version(version, calendar, reservation_manager)
+
+    def advance(self, version: int, calendar: BusinessCalendar, reservation_manager: ReservationManager):
+        """ Brings the snapshot to the current (committed) state of calendar and reservation_manager, tagging it with version. """
+        for reservation_id in reservation_manager.pop_changed_reservation_ids():
+            self._discard_reservation(reservation_id)
+            if (reservation := reservation_manager.reservations_id_mappings.get(reservation_id)) is not None:
+                self._add_reservation(reservation)
+        self._set_version(version, calendar, reservation_manager)
+
+    def publish(self, version: int, write_log: WriteLog, calendar: BusinessCalendar, reservation_manager: ReservationManager):
+        """
+        Applies the changes of a single ended write, while other writes are still in progress, tagging the snapshot with version: the slots it changed are set to
+        the after images of its write log (not to their live status, which the other writes may be changing), the reservations it changed are copied again.
+        A write replacing calendar segments (or the calendar itself), or changing segments the snapshot does not have, is not published: the snapshot then stays
+        at the previous version, the later writes included, until the next advance.
+        """
+        if self._is_behind or write_log.segments_replaced or calendar is not self._source_calendar:
+            self._is_behind = True
+            return
+        snapshot_calendars = dict(zip(_get_resource_calendars(calendar), _get_resource_calendars(self.calendar)))
+        slots_changes = []
+        for (live_calendar, live_segment), after_images in write_log.slots.items():
+            if (snapshot_calendar := snapshot_calendars.get(live_calendar)) is None: ## not a calendar of this core
+                continue
+            if (snapshot_segment := _find_same_segment(snapshot_calendar, live_segment)) is None:
+                self._is_behind = True
+                return
+            slots_changes.append((snapshot_calendar, snapshot_segment, after_images))
+        for snapshot_calendar, snapshot_segment, after_images in slots_changes:
+            _apply_slots_after_images(snapshot_calendar, snapshot_segment, after_images)
+        for reservation_id in write_log.reservation_ids:
+            self._discard_reservation(reservation_id)
+            if (reservation := reservation_manager.reservations_id_mappings.get(reservation_id)) is not None:
+                self._add_reservation(reservation)
+        self.version = version
+
+    def _set_version(self, version: int, calendar: BusinessCalendar, reservation_manager: ReservationManager):
+        changed_segments = calendar.pop_changed_segments()
+        if calendar is not self._source_calendar: ## e.g. replaced by add_new_calendar
+            changed_segments = None
+        self.calendar = calendar.copy(previous_copy=self.calendar, changed_segments=changed_segments)
+        self._source_calendar = calendar
+        self.archive = reservation_manager.archive
+        self.version = version
+        self._is_behind = False
+
+    def _add_reservation(self, reservation: Reservation):
+        reservation_copy = reservation.copy()
+        if isinstance(update_reservation := reservation.get_associated_update_reservation(), Reservation):
+            object.__setattr__(reservation_copy, '__update_reservation__', update_reservation.copy())
+        self._reservations_by_id[reservation.reservation_id] = reservation_copy
+        self._reservations_by_user[reservation.user].add(reservation.reservation_id)
+        self._reservations_by_date[reservation.start_time.date()].add(reservation.reservation_id)
+
+    def _discard_reservation(self, reservation_id: str):
+        reservation = self._reservations_by_id.pop(reservation_id, None)
+        if reservation is None:
+            return
+        for index, key in ((self._reservations_by_user, reservation.user), (self._reservations_by_date, reservation.start_time.date())):
+            index[key].discard(reservation_id)
+            if not index[key]:
+                del index[key]
+
+    def get_reservations_by_user(self, user: str, include_archived: bool = False) -> list[Reservation]:
+        user_reservations = [self._reservations_by_id[res_id] for res_id in self._reservations_by_user.get(user, ())]
+        if include_archived and self.archive is not None:
+            user_reservations.extend(r for r in self.archive.get_reservations_by_user(user) if r.reservation_id not in self._reservations_by_id)
+        return sorted(user_reservations, key=lambda x: x.start_time)
+
+    def get_all_reservations(self, include_archived: bool = False) -> list[Reservation]:
+        reservations = list(self._reservations_by_id.values())
+        if include_archived and self.archive is not None:
+            reservations.extend(r for r in self.archive.get_all_reservations() if r.reservation_id not in self._reservations_by_id)
+        return sorted(reservations, key=lambda x: x.start_time)
+
+    def get_reservations_by_date(self, date: datetime.date) -> list[Reservation]:
+        return sorted((self._reservations_by_id[res_id] for res_id in self._reservations_by_date.get(date, ())), key=lambda x: x.start_time)
+
+
+def _get_resource_calendars(calendar: BusinessCalendar) -> list[BusinessCalendar]:
+    """ The calendars the slots are booked on: the resources ones for a MultiResourceCalendar, the calendar itself otherwise. """
+    return getattr(calendar, 'resources', [calendar])
+
+def _find_same_segment(calendar: BusinessCalendar, segment: Segment) -> Segment|None:
+    """ The segment of calendar spanning the same times as segment, None if there is none. """
+    segment_pos = bisect_left(calendar._get_time_keys()[0], segment._start_minute)
+    if segment_pos < len(calendar.segments) and (found := calendar.segments[segment_pos])._end_minute == segment._end_minute and found._start_minute == segment._start_minute:
+        return found
+    return None
+
+def _apply_slots_after_images(calendar: BusinessCalendar, segment: Segment, after_images: dict[int, tuple]):
+    """ Books/frees the slots of segment (a segment of calendar) as in after_images (slot index -> (is booked, expiry time)), scheduling the pending ones expiry. """
+    indexes_to_free, indexes_to_book = [], defaultdict(list)
+    for i, (is_booked, expiry_time) in after_images.items():
+        if is_booked:
+            indexes_to_book[expiry_time].append(i)
+        else:
+            indexes_to_free.append(i)
+    if indexes_to_free:
+        segment._free_indexes(indexes_to_free)
+    for expiry_time, indexes in indexes_to_book.items():
+        segment._book_indexes(indexes, expiry_time)
+        if expiry_time is not None:
+            calendar._schedule_expiry(segment, indexes, expiry_time)
+    calendar._refresh_free_runs({segment: list(after_images)})
@@ -1,6 +1,8 @@
-import datetime
+import datetime, sys, time
 from collections import defaultdict
-from utils.datetimes_utils import get_global_timezone
+from bisect import bisect_left, bisect_right, insort
+from utils.datetimes_utils import get_global_timezone, to_epoch_minutes
+from backend.write_log import record_reservation_change
 
 from enum import Enum
 class ReservationStatus(Enum):
@@ -12,16 +14,43 @@ class ReservationStatus(Enum):
 
     
 class Reservation:
-    def __init__(self, reservation_id: str, user: str, start_time: datetime.datetime, end_time: datetime.datetime, service_name: str, status: ReservationStatus = None, expires_at: datetime.datetime=None):
-        object.__setattr__(self, 'timestamp', datetime.datetime.now(tz=get_global_timezone()) )
+    """
+    Compact reservation record (slotted): user and service names are interned, creation and status change times are kept as integer
+    nanoseconds since epoch and exposed as datetimes (timestamp, status_change_timestamp) only when read.
+    """
+    __slots__ = ('reservation_id', 'user', 'start_time', 'end_time', 'service_name', 'status', 'is_confirmed', 'resource', '_expires_at',
+                 '_timestamp_ns', '_status_change_ns', '_change_listener', '__update_reservation__')
+    _FINAL_ATTRIBUTES = frozenset(['reservation_id', 'user', 'start_time', 'end_time', 'service_name', 'timestamp'])
+
+    def __init__(self, reservation_id: str, user: str, start_time: datetime.datetime, end_time: datetime.datetime, service_name: str, status: ReservationStatus = None, expires_at: datetime.datetime=None, resource: int = None):
+        object.__setattr__(self, '_timestamp_ns', time.time_ns())
         object.__setattr__(self, 'reservation_id', reservation_id)
-        object.__setattr__(self, 'user', user)
+        object.__setattr__(self, 'user', sys.intern(user) if isinstance(user, str) else user)
         object.__setattr__(self, 'start_time', start_time)
         object.__setattr__(self, 'end_time', end_time)
-        object.__setattr__(self, 'service_name', service_name)
+        object.__setattr__(self, 'service_name', sys.intern(service_name) if isinstance(service_name, str) else service_name)
+        object.__setattr__(self, '_change_listener', None)
+        object.__setattr__(self, '__update_reservation__', None)
         self.status = status
         self._expires_at = expires_at
         self.is_confirmed = True if not expires_at else False
+        self.resource = resource ## calendar resource (e.g. chair) hosting the reservation, chosen at booking time
+
+    @property
+    def timestamp(self) -> datetime.datetime:
+        return _ns_to_datetime(self._timestamp_ns)
+
+    @timestamp.setter
+    def timestamp(self, value: datetime.datetime): ## only reachable through object.__setattr__ (e.g. when loading from disk): timestamp is final
+        object.__setattr__(self, '_timestamp_ns', _datetime_to_ns(value))
+
+    @property
+    def status_change_timestamp(self) -> datetime.datetime:
+        return _ns_to_datetime(getattr(self, '_status_change_ns', None))
+
+    @status_change_timestamp.setter
+    def status_change_timestamp(self, value: datetime.datetime):
+        object.__setattr__(self, '_status_change_ns', _datetime_to_ns(value))
 
     def mark_as_pending_confirmation(self, expires_at: datetime.datetime = None):
         self.status = ReservationStatus.PENDING_CONFIRMATION_STATUS
@@ -65,59 +94,96 @@ class Reservation:
         return now > expiry
 
     def get_associated_update_reservation(self):
-        return getattr(self, '__update_reservation__', None)
+        return self.__update_reservation__
         
     def get_pending_status_expiration(self):
-        return getattr(self, '_expires_at', None)
+        return self._expires_at
         
     def pop_associated_update_reservation(self):
         associated_res = self.get_associated_update_reservation()
-        if hasattr(self, '__update_reservation__'):            
-            delattr(self, '__update_reservation__')
+        self.__update_reservation__ = None
         return associated_res
 
     def __setattr__(self, attribute, value):
-        if attribute in ['reservation_id', 'user', 'start_time', 'end_time', 'service_name', 'timestamp']:
+        if attribute in Reservation._FINAL_ATTRIBUTES:
             raise ValueError(f'Cannot set attribute {attribute}. It is final')
         if attribute=='status':
-            self.status_change_timestamp = datetime.datetime.now(tz=get_global_timezone())
-        return object.__setattr__(self, attribute, value)
+            object.__setattr__(self, '_status_change_ns', time.time_ns())
+            previous_status = getattr(self, 'status', None)
+        object.__setattr__(self, attribute, value)
+        if (change_listener := self._change_listener) is not None: ## set by the ReservationManager holding the reservation, to keep its status index and its changed ids updated
+            change_listener(self, previous_status if attribute=='status' else self.status)
+
+    def __getstate__(self): ## the change listener is left out: copies are not tracked by the manager of the original
+        return {attribute: getattr(self, attribute) for attribute in Reservation.__slots__ if attribute!='_change_listener' and hasattr(self, attribute)}
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_change_listener', None)
+        object.__setattr__(self, '__update_reservation__', None)
+        for attribute, value in state.items():
+            object.__setattr__(self, attribute, value)
 
     def to_dict(self):
-        obj_dict = self.__dict__.copy()
-        for attr in obj_dict:
-            if isinstance(obj_dict[attr], Reservation):
-                obj_dict[attr] = getattr(self, attr).to_dict()
+        obj_dict = {'timestamp': self.timestamp, 'reservation_id': self.reservation_id, 'user': self.user, 'start_time': self.start_time, 'end_time': self.end_time,
+                    'service_name': self.service_name, 'status_change_timestamp': self.status_change_timestamp, 'status': self.status,
+                    '_expires_at': self._expires_at, 'is_confirmed': self.is_confirmed, 'resource': self.resource}
+        if (update_reservation := self.__update_reservation__) is not None:
+            obj_dict['__update_reservation__'] = update_reservation.to_dict() if isinstance(update_reservation, Reservation) else update_reservation
         return obj_dict
         
-    def copy(self):
-        import copy
-        return copy.copy(self)
+    def copy(self): ## as copy.copy (no change listener), with no reduce protocol overhead
+        reservation_copy = object.__new__(type(self))
+        reservation_copy.__setstate__(self.__getstate__())
+        return reservation_copy
 
     def __repr__(self):
-        self_dct = self.to_dict()
         rep_str = f"reservation_id = {self.reservation_id} - " if self.reservation_id else ""
-        rep_str += ' - '.join(f'{k} = {v}' for k,v in self_dct.items() if k in ['service_name', 'user'])
-        rep_str += f". From {self_dct['start_time']} to {self_dct['end_time']}" 
-        if (expiry_t := getattr(self, '_expires_at', False)):
+        rep_str += f"user = {self.user} - service_name = {self.service_name}. From {self.start_time} to {self.end_time}"
+        if (expiry_t := self._expires_at):
             rep_str += f" Time limit to confirm: {expiry_t}"
         return rep_str
         
     def __eq__(self, other):
         if not isinstance(other, Reservation):
             return False
-        return all(getattr(self, attribute)==getattr(other, attribute) for attribute in ['reservation_id', 'user', 'service_name', 'start_time', 'end_time', 'status', 'timestamp'])
+        return all(getattr(self, attribute)==getattr(other, attribute) for attribute in ['reservation_id', 'user', 'service_name', 'start_time', 'end_time', 'status', '_timestamp_ns'])
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _ns_to_datetime(ns: int) -> datetime.datetime:
+    return (_EPOCH + datetime.timedelta(microseconds=ns // 1000)).astimezone(get_global_timezone()) if ns is not None else None
+
+def _datetime_to_ns(value: datetime.datetime) -> int:
+    if value is None or isinstance(value, int):
+        return value
+    return (value.astimezone(datetime.timezone.utc) - _EPOCH) // datetime.timedelta(microseconds=1) * 1000
 
         
 import asyncio
 from collections import defaultdict
 
+_ONE_DAY = datetime.timedelta(days=1)
+
 class ReservationManager:
 
     def __init__(self):
         self.reservations_id_mappings = {}
         self.reservations_by_user = defaultdict(set)
-        self.reservations_by_date = defaultdict(lambda: defaultdict(set))
+        self.reservations_by_date = defaultdict(lambda: defaultdict(set)) ## date -> start time (as epoch minutes) -> reservation ids
+        self.reservations_by_service = defaultdict(set)
+        self.reservations_by_status = defaultdict(set) ## kept updated by the reservations themselves, through _on_reservation_change
+        self.reservations_by_user_start = defaultdict(set) ## (user, start time as epoch minutes) -> reservation ids
+        self.reservations_by_user_service = defaultdict(set) ## (user, service name) -> reservation ids
+        self._user_start_minutes = defaultdict(list) ## user -> sorted start times (as epoch minutes) of its reservations
+        self._daily_start_minutes = defaultdict(list) ## date -> sorted start times (as epoch minutes) of its reservations
+        self._sorted_dates = [] ## sorted dates having any reservation
+        self._sorted_durations = [] ## sorted durations (in minutes) of the reservations, one per reservation: shrinks as they get removed
+        self._max_duration_minutes = 0 ## longest reservation duration, to look back for reservations overlapping a time
+        self._end_minutes = {} ## reservation id -> end time (as epoch minutes)
+        self._changed_ids = set() ## ids of the reservations inserted, removed or changed since the last pop_changed_reservation_ids
+
+        self.archive = None ## cold tier (e.g. a ReservationArchive) holding the evicted reservations, only read by the include_archived lookups
 
         self._date_locks = defaultdict(asyncio.Lock)
         self._user_locks = defaultdict(asyncio.Lock)
@@ -127,7 +193,7 @@ class ReservationManager:
         if reservation.reservation_id in self.reservations_id_mappings:
             raise KeyError('Reservation id already existing')
         
-        res_date = reservation.start_time.date()
+        res_date, res_start_minute = reservation.start_time.date(), to_epoch_minutes(reservation.start_time)
 
         date_lock = self._date_locks[res_date]
         user_lock = self._user_locks[reservation.user]
@@ -135,7 +201,23 @@ class ReservationManager:
             async with user_lock:
                 self.reservations_id_mappings[reservation.reservation_id] = reservation
                 self.reservations_by_user[reservation.user].add(reservation.reservation_id)
-                self.reservations_by_date[res_date][reservation.start_time].add(reservation.reservation_id)
+                if (reservation.user, res_start_minute) not in self.reservations_by_user_start:
+                    insort(self._user_start_minutes[reservation.user], res_start_minute)
+                self.reservations_by_user_start[(reservation.user, res_start_minute)].add(reservation.reservation_id)
+                self.reservations_by_user_service[(reservation.user, reservation.service_name)].add(reservation.reservation_id)
+                if res_date not in self.reservations_by_date:
+                    insort(self._sorted_dates, res_date)
+                if res_start_minute not in self.reservations_by_date[res_date]:
+                    insort(self._daily_start_minutes[res_date], res_start_minute)
+                self._end_minutes[reservation.reservation_id] = to_epoch_minutes(reservation.end_time)
+                insort(self._sorted_durations, self._end_minutes[reservation.reservation_id] - res_start_minute)
+                self._max_duration_minutes = self._sorted_durations[-1]
+                self.reservations_by_date[res_date][res_start_minute].add(reservation.reservation_id)
+                self.reservations_by_service[reservation.service_name].add(reservation.reservation_id)
+                self.reservations_by_status[reservation.status].add(reservation.reservation_id)
+                self._changed_ids.add(reservation.reservation_id)
+                record_reservation_change(reservation.reservation_id)
+                object.__setattr__(reservation, '_change_listener', self._on_reservation_change)
 
         return reservation
 
@@ -144,7 +226,7 @@ class ReservationManager:
         if reservation is None:
             raise KeyError(f'Non existing reservation id: {reservation_id}')
 
-        res_date = reservation.start_time.date()
+        res_date, res_start_minute = reservation.start_time.date(), to_epoch_minutes(reservation.start_time)
 
         date_lock = self._date_locks[res_date]
         user_lock = self._user_locks[reservation.user]
@@ -157,54 +239,181 @@ class ReservationManager:
                 daily_reservations = self.reservations_by_date[res_date]
                 user_reservations = self.reservations_by_user[reservation.user]
                 
-                daily_reservations[reservation.start_time].remove(reservation_id)
+                daily_reservations[res_start_minute].remove(reservation_id)
+                del self._sorted_durations[bisect_left(self._sorted_durations, self._end_minutes.pop(reservation_id) - res_start_minute)]
+                self._max_duration_minutes = self._sorted_durations[-1] if self._sorted_durations else 0
                 user_reservations.remove(reservation_id)
 
-                if not daily_reservations[reservation.start_time]:
-                    del daily_reservations[reservation.start_time]
+                if not daily_reservations[res_start_minute]:
+                    del daily_reservations[res_start_minute]
+                    daily_start_minutes = self._daily_start_minutes[res_date]
+                    del daily_start_minutes[bisect_left(daily_start_minutes, res_start_minute)]
                 if not daily_reservations:
                     del self.reservations_by_date[res_date]
+                    del self._daily_start_minutes[res_date]
                     del self._date_locks[res_date]
+                    del self._sorted_dates[bisect_left(self._sorted_dates, res_date)]
+                user_start_reservations = self.reservations_by_user_start[(reservation.user, res_start_minute)]
+                user_start_reservations.remove(reservation_id)
+                if not user_start_reservations:
+                    del self.reservations_by_user_start[(reservation.user, res_start_minute)]
+                    user_start_minutes = self._user_start_minutes[reservation.user]
+                    del user_start_minutes[bisect_left(user_start_minutes, res_start_minute)]
                 if not user_reservations:
                     del self.reservations_by_user[reservation.user]
                     del self._user_locks[reservation.user]
+                    del self._user_start_minutes[reservation.user]
+                _discard_from_index(self.reservations_by_user_service, (reservation.user, reservation.service_name), reservation_id)
+                _discard_from_index(self.reservations_by_service, reservation.service_name, reservation_id)
+                _discard_from_index(self.reservations_by_status, reservation.status, reservation_id)
+                self._changed_ids.add(reservation_id)
+                record_reservation_change(reservation_id)
+                object.__setattr__(reservation, '_change_listener', None)
 
         return reservation
 
-    
-    def get_reservations_by_user(self, user: str) -> list[Reservation]:
-        reservation_ids = self.reservations_by_user.get(user, [])
-        return [reservation for res_id,reservation in self.reservations_id_mappings.items() if res_id in reservation_ids]
+    def __setstate__(self, state): ## e.g. deepcopy: the copied reservations come without change listener
+        self.__dict__.update(state)
+        for reservation in self.reservations_id_mappings.values():
+            object.__setattr__(reservation, '_change_listener', self._on_reservation_change)
+
+    def _on_reservation_change(self, reservation: Reservation, previous_status: ReservationStatus):
+        if self.reservations_id_mappings.get(reservation.reservation_id) is not reservation: ## e.g. a copy of a managed reservation
+            return
+        self._changed_ids.add(reservation.reservation_id)
+        record_reservation_change(reservation.reservation_id)
+        if previous_status is not reservation.status:
+            _discard_from_index(self.reservations_by_status, previous_status, reservation.reservation_id)
+            self.reservations_by_status[reservation.status].add(reservation.reservation_id)
+
+    def pop_changed_reservation_ids(self) -> set[str]:
+        """ Returns (and forgets) the ids of the reservations inserted, removed or changed since the previous call, e.g. to bring a read snapshot up to date. """
+        changed_ids, self._changed_ids = self._changed_ids, set()
+        return changed_ids
+
+    async def evict_reservations_before(self, end_time: datetime.datetime) -> list[Reservation]:
+        """
+        Removes from the in-memory indexes the reservations fully past end_time (i.e. whose end_time <= end_time), returning them sorted by start_time.
+        Only the dates up to end_time are visited. Callers are responsible for moving the returned reservations to cold storage
+        (preferably before evicting them, see get_reservations_ended_before).
+        """
+        return [await self.remove_reservation(reservation.reservation_id) for reservation in self.get_reservations_ended_before(end_time)]
+
+    def get_reservations_ended_before(self, end_time: datetime.datetime) -> list[Reservation]:
+        """ The reservations evict_reservations_before(end_time) would evict, sorted by start_time. """
+        past_dates = self._sorted_dates[:bisect_right(self._sorted_dates, end_time.date())]
+        return [reservation for date in past_dates for start_minute in self._daily_start_minutes[date]
+                for res_id in self.reservations_by_date[date][start_minute] if (reservation := self.reservations_id_mappings[res_id]).end_time <= end_time]
+
+
+    def get_reservations_by_user(self, user: str, include_archived: bool = False) -> list[Reservation]:
+        user_reservations = [self.reservations_id_mappings[res_id] for res_id in self.reservations_by_user.get(user, ())]
+        if include_archived and self.archive is not None:
+            user_reservations.extend(r for r in self.archive.get_reservations_by_user(user) if r.reservation_id not in self.reservations_id_mappings) ## e.g. archived, then reloaded from a checkpoint preceding the eviction
+        return sorted(user_reservations, key=lambda x: x.start_time)
+
+    def get_all_reservations(self, include_archived: bool = False) -> list[Reservation]:
+        reservations = list(self.reservations_id_mappings.values())
+        if include_archived and self.archive is not None:
+            reservations.extend(r for r in self.archive.get_all_reservations() if r.reservation_id not in self.reservations_id_mappings)
+        return sorted(reservations, key=lambda x: x.start_time)
     
     def get_reservations_by_date(self, date: datetime.date) -> list[Reservation]:
-        reservation_ids = self.reservations_by_date.get(date, {}).values()
-        return [reservation for res_id,reservation in self.reservations_id_mappings.items() if res_id in reservation_ids]
+        daily_reservations = self.reservations_by_date.get(date, {})
+        return [self.reservations_id_mappings[res_id] for start_minute in self._daily_start_minutes.get(date, []) for res_id in daily_reservations[start_minute]]
+
+    def get_reservations_by_service(self, service_name: str) -> list[Reservation]:
+        return [self.reservations_id_mappings[res_id] for res_id in self.reservations_by_service.get(service_name, ())]
+
+    def get_reservations_by_status(self, status: ReservationStatus) -> list[Reservation]:
+        return [self.reservations_id_mappings[res_id] for res_id in self.reservations_by_status.get(status, ())]
 
     def get_reservations_by_start_time(self, start_time: datetime.datetime) -> Reservation:
         date = start_time.date()
         daily_reservations = self.reservations_by_date.get(date, {})
-        reservation_ids = daily_reservations.get(start_time, [])
+        reservation_ids = daily_reservations.get(to_epoch_minutes(start_time), [])
         return [self.get_reservation(res_id) for res_id in reservation_ids]
 
-    def get_reservation(self, reservation_id: str) -> Reservation:
-        return self.reservations_id_mappings.get(reservation_id, None)
+    def get_user_reservations_by_start_time(self, user: str, start_time: datetime.datetime, service_name: str = None) -> list[Reservation]:
+        """ The reservations of user starting at start_time (and of service_name, if given): direct lookups on the (user, start time) and (user, service) indexes. """
+        reservation_ids = self.reservations_by_user_start.get((user, to_epoch_minutes(start_time)), ())
+        if service_name is not None:
+            reservation_ids = self.reservations_by_user_service.get((user, service_name), set()).intersection(reservation_ids)
+        return [self.reservations_id_mappings[res_id] for res_id in reservation_ids]
+
+    def get_user_reservations_at(self, user: str, inner_time: datetime.datetime, service_name: str = None) -> list[Reservation]:
+        """
+        The reservations of user (and of service_name, if given) with start_time <= inner_time < end_time, sorted by start_time.
+        Only the user start times from inner_time minus the longest reservation duration are visited: O(log n_user + k).
+        """
+        inner_minute, user_start_minutes = to_epoch_minutes(inner_time), self._user_start_minutes.get(user)
+        if not user_start_minutes:
+            return []
+        service_ids = self.reservations_by_user_service.get((user, service_name), set()) if service_name is not None else None
+        reservations = []
+        for start_minute in user_start_minutes[bisect_left(user_start_minutes, inner_minute - self._max_duration_minutes):bisect_right(user_start_minutes, inner_minute)]:
+            matching_ids = [res_id for res_id in self.reservations_by_user_start[(user, start_minute)] if self._end_minutes[res_id] > inner_minute and (service_ids is None or res_id in service_ids)]
+            if len(matching_ids) > 1:
+                matching_ids.sort(key=self._end_minutes.__getitem__)
+            reservations.extend(self.reservations_id_mappings[res_id] for res_id in matching_ids)
+        return reservations
+
+    def get_reservations_by_user_service(self, user: str, service_name: str) -> list[Reservation]:
+        return [self.reservations_id_mappings[res_id] for res_id in self.reservations_by_user_service.get((user, service_name), ())]
+
+    def get_reservation(self, reservation_id: str, include_archived: bool = False) -> Reservation:
+        reservation = self.reservations_id_mappings.get(reservation_id, None)
+        if reservation is None and include_archived and self.archive is not None:
+            reservation = self.archive.get_reservation(reservation_id)
+        return reservation
 
     def get_all_reservation_ids(self):
         return list(self.reservations_id_mappings.keys())
 
+    def get_reservations_between(self, start_time: datetime.datetime, end_time: datetime.datetime) -> list[Reservation]:
+        """
+        Returns the reservations overlapping [start_time, end_time), sorted by start_time.
+        Only the reservations starting from start_time minus the longest reservation duration are visited: O(log n + k).
+        """
+        return self._get_overlapping_reservations(to_epoch_minutes(start_time), to_epoch_minutes(end_time), start_time.date(), end_time.date())
+
     def _find_reservations_by_inner_time(self, inner_time: datetime.datetime) -> Reservation:
-        from bisect import bisect_right
-        daily_reservations = sorted(self.reservations_by_date.get(inner_time.date(), {}).items(), key=lambda x: x[0])
-        matching_index = bisect_right(daily_reservations, inner_time, key=lambda x: x[0]) - 1
-        matched_reservations = []
-        if matching_index>=0:
-            potential_match_ids = daily_reservations[matching_index][1]
-            potential_match_reservations = [self.get_reservation(res_id) for res_id in potential_match_ids]
-            for reserv in potential_match_reservations:
-                if reserv.start_time <= inner_time < reserv.end_time:
-                    matched_reservations.append(reserv)
-        return matched_reservations
-        
+        inner_minute, inner_date = to_epoch_minutes(inner_time), inner_time.date()
+        return self._get_overlapping_reservations(inner_minute, inner_minute, inner_date, inner_date, include_end=True)
+
+    def _get_overlapping_reservations(self, from_minute: int|float, to_minute: int|float, from_date: datetime.date, to_date: datetime.date, include_end: bool = False) -> list[Reservation]:
+        """
+        Returns, sorted by start_time, the reservations starting before to_minute (or at to_minute, if include_end) and ending after from_minute.
+        from_date and to_date are the dates of the query bounds: they are widened by the longest reservation duration and by one day
+        on each side, as reservation dates are taken in the reservations timezone.
+        """
+        lookback = _ONE_DAY if self._max_duration_minutes < 1440 else datetime.timedelta(days=1 + int(self._max_duration_minutes // 1440))
+        first_date_pos = bisect_left(self._sorted_dates, from_date - lookback)
+        last_date_pos = bisect_right(self._sorted_dates, to_date + _ONE_DAY)
+        min_start_minute, end_minutes = from_minute - self._max_duration_minutes, self._end_minutes
+        reservations = []
+        for date in self._sorted_dates[first_date_pos:last_date_pos]:
+            daily_start_minutes = self._daily_start_minutes[date]
+            if daily_start_minutes[-1] < min_start_minute or daily_start_minutes[0] > to_minute: ## neighbour date out of the query
+                continue
+            daily_reservations = self.reservations_by_date[date]
+            end_pos = bisect_right(daily_start_minutes, to_minute) if include_end else bisect_left(daily_start_minutes, to_minute)
+            for start_minute in daily_start_minutes[bisect_left(daily_start_minutes, min_start_minute):end_pos]:
+                matching_ids = [res_id for res_id in daily_reservations[start_minute] if end_minutes[res_id] > from_minute]
+                if len(matching_ids) > 1:
+                    matching_ids.sort(key=end_minutes.__getitem__)
+                reservations.extend(self.reservations_id_mappings[res_id] for res_id in matching_ids)
+        return reservations
+
+
+def _discard_from_index(index: dict, key, reservation_id: str):
+    ids = index.get(key)
+    if ids is None:
+        return
+    ids.discard(reservation_id)
+    if not ids:
+        del index[key]
+
 
 def generate_new_reservation_id():
     import uuid
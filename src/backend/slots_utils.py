@@ -17,7 +17,7 @@ def get_consecutive_slots_join(slot_list, slot_list2, how):
         
     if how not in ['union', 'intersection', 'difference']:
         raise ValueError("How must be one of: ['union', 'intersection', 'difference']")
-    if not slot_list or not slot_list2:
+    if not slot_list or not slot_list2 or slot_list[0].segment is not slot_list2[0].segment: ##slots of different segments (e.g. of different resources) never overlap
         return __map_to_output__(l1_diff_at_start=slot_list, l2_diff_at_start=slot_list2, l_join=[], how=how,
                                 l1_diff_at_end=[], l2_diff_at_end=[])
     start_times = sorted(set(map(lambda x: x.start_time, slot_list)))
@@ -0,0 +1,57 @@
+import contextvars
+
+_current_write_log = contextvars.ContextVar('current_write_log', default=None)
+
+
+class WriteLog:
+    """
+    Changes made by a single write operation of a BusinessCore (see BusinessCore._begin_write), recorded by the calendars and the reservation manager while it runs:
+    the after images of the slots it booked/released (booked bit and expiry time of each slot, as the write left it), the ids of the reservations it inserted,
+    removed or changed, and whether it replaced any calendar segments (added, joined, removed, evicted).
+    The running write log is held in a context variable, so that concurrent writes (each one in its own task) keep separate logs.
+    Used to publish each write to the read snapshot as soon as it ends, while other writes are still in progress (see ReadSnapshot.publish).
+    """
+    __slots__ = ('slots', 'reservation_ids', 'segments_replaced', 'is_closed', '_token')
+
+    def __init__(self):
+        self.slots = {} ## (calendar, segment) -> slot index -> (is booked, expiry time)
+        self.reservation_ids = set()
+        self.segments_replaced = False
+        self.is_closed = False
+        self._token = None
+
+
+def begin_write_log() -> WriteLog|None:
+    """ Starts the write log of a write operation in the current context. None if the context is already running one: nested writes are logged by the outermost. """
+    running_log = _current_write_log.get()
+    if running_log is not None and not running_log.is_closed:
+        return None
+    write_log = WriteLog()
+    write_log._token = _current_write_log.set(write_log)
+    return write_log
+
+def end_write_log(write_log: WriteLog):
+    """ Closes write_log (e.g. for the tasks spawned by its write, which inherited it) and restores the context as it was before begin_write_log. """
+    write_log.is_closed = True
+    _current_write_log.reset(write_log._token)
+
+def _get_running_log() -> WriteLog|None:
+    write_log = _current_write_log.get()
+    return write_log if write_log is not None and not write_log.is_closed else None
+
+def record_slots_change(calendar, indexes_by_segment: dict):
+    """ Records the current status of the given slots (segment -> slot indexes) of calendar, just changed, in the running write log, if any. """
+    if (write_log := _get_running_log()) is None:
+        return
+    for segment, indexes in indexes_by_segment.items():
+        after_images = write_log.slots.setdefault((calendar, segment), {})
+        for i in indexes:
+            after_images[i] = (segment._is_index_booked(i), segment._expiries.get(i))
+
+def record_reservation_change(reservation_id: str):
+    if (write_log := _get_running_log()) is not None:
+        write_log.reservation_ids.add(reservation_id)
+
+def record_segments_replaced():
+    if (write_log := _get_running_log()) is not None:
+        write_log.segments_replaced = True
@@ -0,0 +1,108 @@
+"""
+Benchmark of BusinessCalendar.get_available_booking_slots against the previous per-start-position loop.
+Run from the src directory:
+    python -m benchmarks.availability_benchmark [--repeat N] [--density D]
+"""
+import argparse, asyncio, datetime, math, random, timeit
+from datetime import timedelta
+
+
+WINDOWS_DAYS = [1, 30, 365]
+SERVICES_MINUTES = [20, 30, 45]
+OPENING_HOURS = [((9, 0), (13, 0)), ((15, 0), (20, 0))]
+
+
+def build_calendar(n_days: int, start_date: datetime.date = None, slot_minutes_duration: int = 5):
+    from backend.business_calendar import BusinessCalendar, Segment
+    from utils.datetimes_utils import map_datetime_to_default
+
+    if start_date is None:
+        start_date = datetime.date.today() + timedelta(days=1)
+    calendar = BusinessCalendar(slot_minutes_duration=slot_minutes_duration)
+    for day in range(n_days):
+        curr_date = start_date + timedelta(days=day)
+        for (start_h, start_m), (end_h, end_m) in OPENING_HOURS:
+            start_time = map_datetime_to_default(datetime.datetime.combine(curr_date, datetime.time(start_h, start_m)))
+            end_time = map_datetime_to_default(datetime.datetime.combine(curr_date, datetime.time(end_h, end_m)))
+            calendar.add_segment(Segment(start_time=start_time, end_time=end_time, slot_duration=slot_minutes_duration))
+    return calendar
+
+
+def fill_calendar(calendar, density: float, seed: int = 0):
+    """ Books random (5-minutes aligned) services until roughly density*n_slots slots are booked. 1 booking out of 10 is left pending. """
+    rnd = random.Random(seed)
+    pending_expiry = datetime.datetime.now(tz=datetime.UTC) + timedelta(days=1)
+    for segment in calendar.segments:
+        n_to_book = int(segment.n_slots * density)
+        n_attempts = 0
+        while n_to_book > 0 and n_attempts < 4 * segment.n_slots:
+            n_attempts += 1
+            n_slots_needed = rnd.choice(SERVICES_MINUTES) // segment.slot_duration
+            start_idx = rnd.randrange(0, max(1, segment.n_slots - n_slots_needed))
+            indexes = list(range(start_idx, min(segment.n_slots, start_idx + n_slots_needed)))
+            if segment._any_booked_indexes(indexes):
+                continue
+            segment._book_indexes(indexes, pending_expiry if rnd.random() < 0.1 else None)
+            n_to_book -= len(indexes)
+    return calendar
+
+
+def legacy_get_available_booking_slots(calendar, minutes_duration: int, min_start_time: datetime.datetime, max_start_time: datetime.datetime, minutes_grid_span: int = 15):
+    """ Previous implementation: checks the whole slots' group for every start position. Kept as reference for results and timings. """
+    from backend.business_calendar import AlignMethod
+
+    n_slots_needed = math.ceil(minutes_duration / calendar.slot_minutes_duration)
+    available_default_slots, available_special_slots = [], []
+    for segment in calendar._get_segments_involved(start_time=min_start_time, end_time=max_start_time+timedelta(minutes=minutes_duration)):
+        aligned_min_start_time = segment.align_to_slot(min_start_time, how=AlignMethod.NEXT)
+        aligned_max_start_time = segment.align_to_slot(max_start_time, how=AlignMethod.PREVIOUS)
+        if aligned_min_start_time is None or aligned_max_start_time is None or aligned_min_start_time>aligned_max_start_time:
+            continue
+        slot_list = segment.get_slots_slice(start_time=aligned_min_start_time, end_time=aligned_max_start_time + timedelta(minutes=minutes_duration))
+        last_slot_booked = False
+        for i in range(len(slot_list) - n_slots_needed + 1):
+            current_slot = slot_list[i]
+            if not any(s.is_booked() for s in slot_list[i : i + n_slots_needed]):
+                if not segment.timedelta_mismatch_from_previous_default(datetime_obj=current_slot.start_time, default_minutes_grid_range=minutes_grid_span):
+                    available_default_slots.append(current_slot)
+                elif last_slot_booked:
+                    available_special_slots.append(current_slot)
+            last_slot_booked = current_slot.is_booked()
+    return available_default_slots, available_special_slots
+
+
+def run_benchmark(repeat: int = 5, density: float = 0.4, seed: int = 0):
+    calendar = fill_calendar(build_calendar(max(WINDOWS_DAYS)), density=density, seed=seed)
+    min_start_time = calendar.segments[0].start_time
+    results = []
+    for n_days in WINDOWS_DAYS:
+        max_start_time = min_start_time + timedelta(days=n_days) - timedelta(minutes=1)
+        for minutes_duration in SERVICES_MINUTES:
+            query_kwargs = dict(minutes_duration=minutes_duration, min_start_time=min_start_time, max_start_time=max_start_time, minutes_grid_span=15)
+
+            expected = legacy_get_available_booking_slots(calendar, **query_kwargs)
+            actual = calendar.get_available_booking_slots(split_by_segment=False, **query_kwargs)
+            if [[s.start_time for s in l] for l in expected] != [[s.start_time for s in l] for l in actual]:
+                raise AssertionError(f'Results mismatch for a {n_days} days window, {minutes_duration} minutes duration')
+
+            legacy_time = min(timeit.repeat(lambda: legacy_get_available_booking_slots(calendar, **query_kwargs), number=1, repeat=repeat))
+            current_time = min(timeit.repeat(lambda: calendar.get_available_booking_slots(split_by_segment=False, **query_kwargs), setup=calendar._availability_cache.clear, number=1, repeat=repeat))
+            results.append({'window_days': n_days, 'minutes_duration': minutes_duration, 'n_results': len(actual[0]) + len(actual[1]),
+                            'legacy_ms': 1000*legacy_time, 'current_ms': 1000*current_time, 'speedup': legacy_time / current_time if current_time else math.inf})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--density', type=float, default=0.4, help='fraction of booked slots')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'days':>5} {'minutes':>8} {'results':>8} {'legacy ms':>10} {'current ms':>11} {'speedup':>8}")
+    for r in run_benchmark(repeat=args.repeat, density=args.density, seed=args.seed):
+        print(f"{r['window_days']:>5} {r['minutes_duration']:>8} {r['n_results']:>8} {r['legacy_ms']:>10.2f} {r['current_ms']:>11.2f} {r['speedup']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Throughput benchmark of BusinessCore.make_reservations_bulk (single lock pass on the calendar), all-or-nothing and per item,
+against making the same reservations one by one through make_reservation: with a lock/unlock cycle each, and with optimistic commits (no lock).
+Run from the src directory:
+    python -m benchmarks.bulk_reservation_benchmark [--bookings N] [--days D] [--repeat R]
+"""
+import argparse, asyncio, datetime, random, time
+from datetime import timedelta
+
+
+SERVICES = {'haircut': 30, 'beard': 30}
+N_USERS = 500
+
+
+def build_core(n_days: int, optimistic_concurrency: bool = False):
+    from backend.business_core import BusinessCoreWithConfirmation
+    from backend.policy import PolicyManager, Service
+    from backend.reservations import ReservationManager
+    from benchmarks.availability_benchmark import build_calendar
+
+    services = [Service(service_name, 10, float(minutes_duration), '') for service_name, minutes_duration in SERVICES.items()]
+    policy_manager = PolicyManager(services=services, min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00'),('15:00','20:00')])
+    return BusinessCoreWithConfirmation(reservation_manager=ReservationManager(), calendar=build_calendar(n_days, start_date=datetime.date.today() + timedelta(days=1)),
+                                        policy_manager=policy_manager, default_grid_minutes=15, optimistic_concurrency=optimistic_concurrency)
+
+
+def random_bookings(calendar, n_bookings: int, seed: int = 0) -> list[dict]:
+    """ n_bookings not overlapping bookings, on 30 minutes aligned start times of the calendar segments, in random order. """
+    rnd = random.Random(seed)
+    start_times = [segment.start_time + timedelta(minutes=30*i) for segment in calendar.segments for i in range(int((segment.end_time - segment.start_time) / timedelta(minutes=30)))]
+    if n_bookings > len(start_times):
+        raise ValueError(f'Not enough room for {n_bookings} bookings: use more days')
+    return [{'service_name': rnd.choice(list(SERVICES)), 'start_time': start_time, 'user': f'user_{rnd.randrange(N_USERS)}'} for start_time in rnd.sample(start_times, n_bookings)]
+
+
+async def _one_by_one(core, bookings: list[dict]):
+    from shared.user_role import UserRole
+    return [await core.make_reservation(**booking, actor=UserRole.ADMIN) for booking in bookings]
+
+
+def _timed_run(n_days: int, bookings: list[dict], make, optimistic_concurrency: bool = False) -> tuple[float, list]:
+    """ Runs make(core, bookings) on a new core, returning the elapsed seconds (building the core excluded) and the results. """
+    core = build_core(n_days, optimistic_concurrency=optimistic_concurrency)
+    async def _run():
+        start = time.perf_counter()
+        results = await make(core, bookings)
+        return time.perf_counter() - start, results
+    return asyncio.run(_run())
+
+
+def run_benchmark(n_bookings: int = 1000, n_days: int = 90, repeat: int = 5, seed: int = 0) -> list[dict]:
+    from backend.business_event import BusinessEvent
+
+    bookings = random_bookings(build_core(n_days).calendar, n_bookings, seed=seed)
+    cases = [
+        ('one_by_one', _one_by_one, False),
+        ('one_by_one_optimistic', _one_by_one, True),
+        ('bulk_all_or_nothing', lambda core, bookings: core.make_reservations_bulk(bookings, all_or_nothing=True), False),
+        ('bulk_per_item', lambda core, bookings: core.make_reservations_bulk(bookings, all_or_nothing=False), False),
+    ]
+    results = []
+    for name, make, optimistic_concurrency in cases:
+        timings = []
+        for _ in range(repeat):
+            elapsed, outcomes = _timed_run(n_days, bookings, make, optimistic_concurrency=optimistic_concurrency)
+            if len(outcomes) != n_bookings or not all(isinstance(outcome, BusinessEvent) for outcome in outcomes):
+                raise AssertionError(f'{name}: not all the bookings were made')
+            timings.append(elapsed)
+        results.append({'case': name, 'bookings': n_bookings, 'min_ms': 1000*min(timings), 'bookings_per_s': n_bookings / min(timings)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90, help='calendar days of opening hours')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmark(n_bookings=args.bookings, n_days=args.days, repeat=args.repeat, seed=args.seed)
+    baseline_ms = results[0]['min_ms']
+    print(f"{'case':>22} {'bookings':>9} {'min ms':>9} {'bookings/s':>11} {'speedup':>8}")
+    for r in results:
+        print(f"{r['case']:>22} {r['bookings']:>9} {r['min_ms']:>9.1f} {r['bookings_per_s']:>11.0f} {baseline_ms / r['min_ms']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
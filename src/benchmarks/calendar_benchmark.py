@@ -0,0 +1,167 @@
+"""
+Micro-benchmark suite of the BusinessCalendar engine, by horizon (days of opening hours) and booking density:
+    - add_segment_days: building the calendar one segment at a time, day after day
+    - add_segment_adjacent: adding hourly segments adjacent to the previous one (joined at each insert)
+    - get_slots: random 5..45 minutes ranges
+    - get_available_booking_slots: whole horizon query, with and without the availability cache
+    - reserve_free_concurrent: concurrent clients reserving and freeing random slots through the range locks
+    - copy, join (interleaved segments), remove_segment (one inner hour by day)
+Writes a JSON report, that can be given back as --baseline to compare two versions.
+Run from the src directory:
+    python -m benchmarks.calendar_benchmark [--repeat N] [--horizons 7 30 365] [--densities 0.2 0.6] [--output report.json] [--baseline old.json]
+"""
+import argparse, asyncio, datetime, json, platform, random, statistics, time, warnings
+from datetime import timedelta
+
+
+HORIZONS_DAYS = [7, 30, 365]
+DENSITIES = [0.2, 0.6]
+SERVICES_MINUTES = [20, 30, 45]
+
+
+def _timings(func, repeat: int, setup=None) -> list[float]:
+    """ Runs func repeat times (after setup, not timed), returning the elapsed seconds of each run. """
+    timings = []
+    for _ in range(repeat):
+        setup_result = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(setup_result) if setup is not None else func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _random_ranges(calendar, n: int, rnd: random.Random) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    ranges = []
+    for _ in range(n):
+        segment = rnd.choice(calendar.segments)
+        minutes_duration = rnd.choice(SERVICES_MINUTES)
+        start_time = segment.start_time + timedelta(minutes=segment.slot_duration * rnd.randrange(0, segment.n_slots - minutes_duration // segment.slot_duration + 1))
+        ranges.append((start_time, start_time + timedelta(minutes=minutes_duration)))
+    return ranges
+
+
+def _build_adjacent(n_days: int, start_date: datetime.date):
+    """ Adds the opening hours of each day as hourly segments, each adjacent to the previous one. """
+    from backend.business_calendar import BusinessCalendar, Segment
+    from benchmarks.availability_benchmark import OPENING_HOURS
+    from utils.datetimes_utils import map_datetime_to_default
+
+    calendar = BusinessCalendar()
+    for day in range(n_days):
+        curr_date = start_date + timedelta(days=day)
+        for (start_h, _), (end_h, _) in OPENING_HOURS:
+            for hour in range(start_h, end_h):
+                start_time = map_datetime_to_default(datetime.datetime.combine(curr_date, datetime.time(hour)))
+                calendar.add_segment(Segment(start_time=start_time, end_time=start_time + timedelta(hours=1)))
+    return calendar
+
+
+async def _reserve_free_clients(calendar, ranges: list, n_clients: int):
+    from backend.domain_errors import AlreadyBookedError
+
+    async def _client(client_ranges):
+        for start_time, end_time in client_ranges:
+            slots = calendar.get_slots(start_time, end_time, same_segment_only=True)
+            try:
+                await calendar.reserve_slots(slots)
+            except AlreadyBookedError:
+                continue
+            await asyncio.sleep(0)
+            await calendar.free_slots(slots)
+    await asyncio.gather(*[_client(ranges[i::n_clients]) for i in range(n_clients)])
+
+
+def _split_interleaved(calendar):
+    """ Returns two calendars holding alternate segments of calendar (e.g. mornings and afternoons), to be joined back. """
+    from backend.business_calendar import BusinessCalendar
+
+    first, second = BusinessCalendar(calendar.slot_minutes_duration), BusinessCalendar(calendar.slot_minutes_duration)
+    first.segments = [segment.copy() for segment in calendar.segments[::2]]
+    second.segments = [segment.copy() for segment in calendar.segments[1::2]]
+    return first, second
+
+
+def run_case_set(n_days: int, density: float, repeat: int = 5, n_queries: int = 1000, n_clients: int = 50, seed: int = 0) -> list[dict]:
+    from benchmarks.availability_benchmark import build_calendar, fill_calendar
+
+    start_date = datetime.date.today() + timedelta(days=1)
+    rnd = random.Random(seed)
+    results = []
+    def _add(case: str, timings: list[float], n_ops: int = 1):
+        results.append({'case': case, 'horizon_days': n_days, 'density': density, 'n_ops': n_ops,
+                        'min_ms': 1000*min(timings), 'median_ms': 1000*statistics.median(timings)})
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') ## adjacency warnings of add_segment
+        _add('add_segment_days', _timings(lambda: build_calendar(n_days, start_date=start_date), repeat))
+        _add('add_segment_adjacent', _timings(lambda: _build_adjacent(n_days, start_date), repeat))
+    calendar = fill_calendar(build_calendar(n_days, start_date=start_date), density=density, seed=seed)
+
+    ranges = _random_ranges(calendar, n_queries, rnd)
+    _add('get_slots', _timings(lambda: [calendar.get_slots(s, e) for s, e in ranges], repeat), n_queries)
+
+    min_start_time, max_start_time = calendar.segments[0].start_time, calendar.segments[-1].end_time
+    query = lambda: calendar.get_available_booking_slots(30, min_start_time, max_start_time)
+    _add('get_available_booking_slots', _timings(lambda _: query(), repeat, setup=calendar._availability_cache.clear))
+    query()
+    _add('get_available_booking_slots_cached', _timings(query, repeat))
+
+    ranges = _random_ranges(calendar, n_queries, rnd)
+    _add('reserve_free_concurrent', _timings(lambda: asyncio.run(_reserve_free_clients(calendar, ranges, n_clients)), repeat), n_queries)
+
+    _add('copy', _timings(calendar.copy, repeat))
+    first, second = _split_interleaved(calendar)
+    _add('join', _timings(lambda: first.join(second), repeat))
+
+    days_inner_hours = [(s.start_time + timedelta(hours=1), s.start_time + timedelta(hours=2)) for s in calendar.segments[::2]]
+    def _remove_inner_hours(calendar_copy):
+        for start_time, end_time in days_inner_hours:
+            calendar_copy.remove_segment(start_time, end_time, raise_error_if_any_booking=False)
+    _add('remove_segment', _timings(_remove_inner_hours, repeat, setup=calendar.copy), len(days_inner_hours))
+    return results
+
+
+def run_benchmark(horizons: list[int] = HORIZONS_DAYS, densities: list[float] = DENSITIES, repeat: int = 5, n_queries: int = 1000, n_clients: int = 50, seed: int = 0) -> dict:
+    results = [r for n_days in horizons for density in densities
+               for r in run_case_set(n_days, density, repeat=repeat, n_queries=n_queries, n_clients=n_clients, seed=seed)]
+    return {'meta': {'created_at': datetime.datetime.now(tz=datetime.UTC).isoformat(timespec='seconds'), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'repeat': repeat, 'queries': n_queries, 'clients': n_clients, 'seed': seed},
+            'results': results}
+
+
+def _results_key(result: dict) -> tuple:
+    return result['case'], result['horizon_days'], result['density']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--horizons', type=int, nargs='+', default=HORIZONS_DAYS, help='calendar days of opening hours')
+    parser.add_argument('--densities', type=float, nargs='+', default=DENSITIES, help='fractions of booked slots')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=1000, help='get_slots lookups and reserve/free operations')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent clients of reserve/free')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON report to write')
+    parser.add_argument('--baseline', help='JSON report of a previous run, to compare median timings against')
+    args = parser.parse_args()
+
+    report = run_benchmark(horizons=args.horizons, densities=args.densities, repeat=args.repeat, n_queries=args.queries, n_clients=args.clients, seed=args.seed)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {_results_key(r): r for r in json.load(f)['results']}
+
+    print(f"{'case':>36} {'days':>5} {'density':>8} {'ops':>6} {'min ms':>10} {'median ms':>10}" + (f" {'baseline':>10} {'ratio':>7}" if baseline else ''))
+    for r in report['results']:
+        line = f"{r['case']:>36} {r['horizon_days']:>5} {r['density']:>8.2f} {r['n_ops']:>6} {r['min_ms']:>10.3f} {r['median_ms']:>10.3f}"
+        if baseline:
+            previous = baseline.get(_results_key(r))
+            line += f" {previous['median_ms']:>10.3f} {r['median_ms'] / previous['median_ms']:>6.2f}x" if previous and previous['median_ms'] else f" {'-':>10} {'-':>7}"
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Latency benchmark of the BookingService reservation resolution (find_reservation) and of the cancel/update operations built on it,
+with thousands of active reservations on several resources (many reservations of different users starting at the same times):
+direct lookups on the ReservationManager (user, start_time) and (user, service_name) indexes, against the previous lookup of all the reservations
+at the requested time, each resolved with its defaults and filtered by user, service and duration.
+Run from the src directory:
+    python -m benchmarks.find_reservation_benchmark [--days D] [--resources K] [--queries Q] [--repeat R]
+"""
+import argparse, asyncio, datetime, random, time, warnings
+from datetime import timedelta
+from backend.booking_service import BookingService
+
+
+SERVICES = {'haircut': 30, 'beard': 30}
+
+
+class LegacyBookingService(BookingService):
+    """ Previous reservation resolution: all the reservations at the requested time, filtered one by one. Kept as reference for results and timings. """
+    def _find_matching_reservations(self, user: str, reservation_id: str=None, start_time: datetime.datetime=None,  minutes_duration: int=None, service_name: str=None, match_inner_time: bool=False):
+        from utils.datetimes_utils import map_datetime_to_default, minutes_between
+
+        if reservation_id is None and start_time is None:
+            raise ValueError(f'Must provide one among reservation_id and start_time')
+        if start_time is not None:
+            start_time = map_datetime_to_default(start_time, ignore_seconds=True)
+        if reservation_id is not None:
+            matching_res = self.core.reservation_manager.get_reservation(reservation_id)
+            potential_matching_reservations = [matching_res] if matching_res is not None else []
+        else:
+            potential_matching_reservations = self.core.reservation_manager._find_reservations_by_inner_time(start_time) if match_inner_time else self.core.reservation_manager.get_reservations_by_start_time(start_time)
+
+        if not potential_matching_reservations:
+            return None
+        matching_reservations = []
+        for reservation in potential_matching_reservations:
+            reservation_params = self.core._resolve_reservation_params_with_defaults(existing_reservation=reservation, start_time=start_time, service_name=service_name, minutes_duration=minutes_duration)
+            validated_start_time, validated_service_name, validated_minutes_duration = reservation_params['start_time'], reservation_params['service_name'], reservation_params['minutes_duration']
+            reservation_duration = minutes_between(reservation.start_time, reservation.end_time)
+            if reservation.user!=user or reservation_duration!=validated_minutes_duration or reservation.service_name!=validated_service_name:
+                continue
+            if reservation.start_time!=validated_start_time:
+                if reservation_id is not None:
+                    if not match_inner_time or validated_start_time<reservation.start_time or validated_start_time>reservation.end_time:
+                        continue
+                warnings.warn(f'Actual start time is {reservation.start_time}')
+            matching_reservations.append(reservation)
+        return matching_reservations
+
+
+def build_service(service_class, n_days: int, n_resources: int):
+    """ A service on n_resources resources, with every 30 minutes start time booked on all the resources but one (by different users). """
+    from backend.business_core import BusinessCoreWithConfirmation
+    from backend.multi_resource_calendar import MultiResourceCalendar
+    from backend.policy import PolicyManager, Service
+    from backend.reservations import ReservationManager
+    from benchmarks.availability_benchmark import build_calendar
+    from shared.user_role import UserRole
+
+    calendar = MultiResourceCalendar(n_resources=n_resources, slot_minutes_duration=5)
+    calendar.add_segments(build_calendar(n_days, start_date=datetime.date.today() + timedelta(days=1)).segments)
+    services = [Service(service_name, 10, float(minutes_duration), '') for service_name, minutes_duration in SERVICES.items()]
+    policy_manager = PolicyManager(services=services, min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00'),('15:00','20:00')])
+    core = BusinessCoreWithConfirmation(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15)
+    start_times = _start_times(calendar)
+    bookings = [{'service_name': list(SERVICES)[resource % len(SERVICES)], 'start_time': start_time, 'user': f'user_{(i*(n_resources-1) + resource) % 1000}'}
+                for i, start_time in enumerate(start_times) for resource in range(n_resources - 1)]
+    asyncio.run(core.make_reservations_bulk(bookings, actor=UserRole.ADMIN))
+    for reservation in core.reservation_manager.get_all_reservations():
+        reservation.mark_as_confirmed()
+    core._end_write(core._begin_write()) ## brings the read snapshot up to date with the bookings: not to time its catch up on the first operation
+    return service_class(core)
+
+
+def _start_times(calendar) -> list[datetime.datetime]:
+    return [segment.start_time + timedelta(minutes=30*i) for segment in calendar.segments for i in range(int((segment.end_time - segment.start_time) / timedelta(minutes=30)))]
+
+
+def _queries(service, n_queries: int, seed: int) -> list:
+    """ n_queries distinct active reservations, each with a distinct free start time to move it to. """
+    rnd = random.Random(seed)
+    reservations = rnd.sample(service.core.reservation_manager.get_all_reservations(), n_queries)
+    new_start_times = rnd.sample(_start_times(service.core.calendar), n_queries)
+    return list(zip(reservations, new_start_times))
+
+
+def _time_finds(service, queries: list, match_inner_time: bool) -> tuple[float, bool]:
+    """ Seconds per find_reservation, and whether each query found its reservation. """
+    start = time.perf_counter()
+    found = [service.find_reservation(user=r.user, start_time=r.start_time + timedelta(minutes=15 if match_inner_time else 0), service_name=r.service_name, match_inner_time=match_inner_time)
+             for r, _ in queries]
+    return (time.perf_counter() - start) / len(queries), all(found_reservation is reservation for found_reservation, (reservation, _) in zip(found, queries))
+
+
+async def _time_operations(service, queries: list, operation: str) -> float:
+    from shared.user_role import UserRole
+
+    start = time.perf_counter()
+    for reservation, new_start_time in queries:
+        if operation == 'cancel':
+            await service.cancel_reservation(user=reservation.user, start_time=reservation.start_time, service_name=reservation.service_name, actor=UserRole.ADMIN)
+        else:
+            await service.update_reservation(user=reservation.user, existing_reservation_start_time=reservation.start_time, existing_reservation_service_name=reservation.service_name,
+                                             new_start_time=new_start_time, actor=UserRole.ADMIN)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def run_benchmark(n_days: int = 40, n_resources: int = 8, n_queries: int = 200, repeat: int = 3, seed: int = 0) -> list[dict]:
+    warnings.simplefilter('ignore')
+    results = []
+    for name, service_class in [('legacy', LegacyBookingService), ('indexed', BookingService)]:
+        timings = {'find_us': [], 'find_inner_us': [], 'cancel_us': [], 'update_us': []}
+        for _ in range(repeat):
+            service = build_service(service_class, n_days, n_resources)
+            queries = _queries(service, n_queries, seed)
+            find_s, all_found = _time_finds(service, queries, match_inner_time=False)
+            find_inner_s, all_inner_found = _time_finds(service, queries, match_inner_time=True)
+            if not all_found or not all_inner_found:
+                raise AssertionError(f'{name}: not all the reservations were found')
+            timings['find_us'].append(1e6*find_s)
+            timings['find_inner_us'].append(1e6*find_inner_s)
+            timings['cancel_us'].append(1e6*asyncio.run(_time_operations(service, queries[:n_queries//2], 'cancel')))
+            timings['update_us'].append(1e6*asyncio.run(_time_operations(service, queries[n_queries//2:], 'update')))
+        results.append({'lookup': name, 'reservations': len(service.core.reservation_manager.reservations_id_mappings)} | {k: min(v) for k, v in timings.items()})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=40, help='calendar days of opening hours')
+    parser.add_argument('--resources', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmark(n_days=args.days, n_resources=args.resources, n_queries=args.queries, repeat=args.repeat, seed=args.seed)
+    print(f"{'lookup':>8} {'reservations':>13} {'find us':>9} {'find inner us':>14} {'cancel us':>10} {'update us':>10}")
+    for r in results:
+        print(f"{r['lookup']:>8} {r['reservations']:>13} {r['find_us']:>9.1f} {r['find_inner_us']:>14.1f} {r['cancel_us']:>10.1f} {r['update_us']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Latency benchmark of the repeated BookingService operations (e.g. the chat layer retrying a processed message, the LLM emitting the same requests again):
+repeats with the idempotency key of the first run, answered from the idempotency table, against the previous repeats with no key,
+which run the whole operation again (validation, lookups, slots locks) before failing (AlreadyBookedError, NotPreviouslyBookedError).
+Run from the src directory:
+    python -m benchmarks.idempotency_benchmark [--bookings N] [--days D] [--repeat R]
+"""
+import argparse, asyncio, time
+
+
+def build_service(n_days: int):
+    from backend.booking_service import BookingService
+    from benchmarks.bulk_reservation_benchmark import build_core
+
+    return BookingService(build_core(n_days))
+
+
+async def _timed(operations: list) -> float:
+    """ Seconds per operation, the errors (expected on the repeats with no key) included. """
+    start = time.perf_counter()
+    for operation in operations:
+        try:
+            await operation()
+        except Exception:
+            pass
+    return (time.perf_counter() - start) / len(operations)
+
+
+async def _run_case(n_bookings: int, n_days: int, with_key: bool, seed: int) -> dict:
+    from shared.user_role import UserRole
+    from benchmarks.bulk_reservation_benchmark import random_bookings
+
+    service = build_service(n_days)
+    bookings = random_bookings(service.core.calendar, n_bookings, seed=seed)
+    keys = [f"{booking['user']}:{idx}:0" if with_key else None for idx, booking in enumerate(bookings)]
+    make = [lambda booking=booking, key=key: service.make_reservation(**booking, actor=UserRole.ADMIN, idempotency_key=key) for booking, key in zip(bookings, keys)]
+    first_make_s = await _timed(make)
+    repeat_make_s = await _timed(make)
+    cancel_keys = [f'{key}:cancel' if with_key else None for key in keys]
+    cancel = [lambda booking=booking, key=key: service.cancel_reservation(user=booking['user'], start_time=booking['start_time'], actor=UserRole.ADMIN, idempotency_key=key)
+              for booking, key in zip(bookings, cancel_keys)]
+    first_cancel_s = await _timed(cancel)
+    repeat_cancel_s = await _timed(cancel)
+    if service.core.reservation_manager.reservations_id_mappings:
+        raise AssertionError('Not all the reservations were canceled')
+    return {'keys': 'idempotency' if with_key else 'none', 'first_make_us': 1e6*first_make_s, 'repeat_make_us': 1e6*repeat_make_s,
+            'first_cancel_us': 1e6*first_cancel_s, 'repeat_cancel_us': 1e6*repeat_cancel_s}
+
+
+def run_benchmark(n_bookings: int = 500, n_days: int = 90, repeat: int = 3, seed: int = 0) -> list[dict]:
+    results = []
+    for with_key in [False, True]:
+        runs = [asyncio.run(_run_case(n_bookings, n_days, with_key, seed)) for _ in range(repeat)]
+        results.append({k: (min(run[k] for run in runs) if k.endswith('_us') else v) for k, v in runs[0].items()})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings', type=int, default=500)
+    parser.add_argument('--days', type=int, default=90, help='calendar days of opening hours')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmark(n_bookings=args.bookings, n_days=args.days, repeat=args.repeat, seed=args.seed)
+    print(f"{'keys':>12} {'make us':>9} {'repeat make us':>15} {'cancel us':>10} {'repeat cancel us':>17}")
+    for r in results:
+        print(f"{r['keys']:>12} {r['first_make_us']:>9.1f} {r['repeat_make_us']:>15.1f} {r['first_cancel_us']:>10.1f} {r['repeat_cancel_us']:>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
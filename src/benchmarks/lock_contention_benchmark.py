@@ -0,0 +1,125 @@
+"""
+Contention benchmark of the calendar slot locking: concurrent bookings (and updates, locking old + new slots) on the same morning segment.
+Compares BusinessCalendar range locks (one acquire per operation) against the previous one asyncio.Lock per slot, acquired in start time order.
+Run from the src directory:
+    python -m benchmarks.lock_contention_benchmark [--clients N] [--repeat R]
+"""
+import argparse, asyncio, datetime, random, time
+from datetime import timedelta
+
+
+SERVICES_MINUTES = [20, 30, 45]
+
+
+class LegacySlotLocks:
+    """ Previous locking: one asyncio.Lock per slot, acquired one at a time in start time order. Kept as reference for timings. """
+    def __init__(self):
+        self._locks = {}
+        self.n_acquires = 0
+
+    async def lock(self, slots):
+        acquired = []
+        for slot in sorted(set(slots), key=lambda s: s.start_time):
+            lock = self._locks.setdefault((id(slot.segment), slot.index), asyncio.Lock())
+            await lock.acquire()
+            self.n_acquires += 1
+            acquired.append(lock)
+        return acquired
+
+    def unlock(self, acquired):
+        for lock in reversed(acquired):
+            lock.release()
+
+
+class RangeLocks:
+    def __init__(self, calendar):
+        self.calendar = calendar
+        self.n_acquires = 0
+
+    async def lock(self, slots):
+        self.n_acquires += 1
+        return await self.calendar._lock_slots(slots)
+
+    def unlock(self, grant):
+        self.calendar._unlock_slots(grant)
+
+
+def _random_slots(segment, rnd: random.Random):
+    from backend.business_calendar import Slot
+    n_slots_needed = rnd.choice(SERVICES_MINUTES) // segment.slot_duration
+    start_idx = rnd.randrange(0, segment.n_slots - n_slots_needed + 1, 3)
+    return [Slot(segment, i) for i in range(start_idx, start_idx + n_slots_needed)]
+
+
+async def _client(calendar, locks, segment, rnd: random.Random, n_operations: int, update_ratio: float, outcomes: dict):
+    from backend.domain_errors import AlreadyBookedError
+
+    booked_slots = None
+    for _ in range(n_operations):
+        new_slots = _random_slots(segment, rnd)
+        is_update = booked_slots is not None and rnd.random() < update_ratio
+        slots_to_lock = new_slots + booked_slots if is_update else new_slots
+        grant = await locks.lock(slots_to_lock)
+        try:
+            await asyncio.sleep(0) ## yielding inside the critical section, as the core does while updating the reservations manager
+            if is_update:
+                calendar._free_slots_no_lock(booked_slots)
+            try:
+                calendar._reserve_slots_no_lock(new_slots)
+                booked_slots = new_slots
+                outcomes['booked'] += 1
+            except AlreadyBookedError:
+                if is_update:
+                    calendar._reserve_slots_no_lock(booked_slots)
+                outcomes['conflicts'] += 1
+        finally:
+            locks.unlock(grant)
+        if booked_slots is not None and rnd.random() < 0.5: ## releasing the booking, to keep the morning busy but not full
+            grant = await locks.lock(booked_slots)
+            try:
+                calendar._free_slots_no_lock(booked_slots)
+                booked_slots = None
+            finally:
+                locks.unlock(grant)
+
+
+async def _run_round(use_range_locks: bool, n_clients: int, n_operations: int, update_ratio: float, seed: int):
+    from benchmarks.availability_benchmark import build_calendar
+
+    calendar = build_calendar(1)
+    morning_segment = calendar.segments[0]
+    locks = RangeLocks(calendar) if use_range_locks else LegacySlotLocks()
+    outcomes = {'booked': 0, 'conflicts': 0}
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(calendar, locks, morning_segment, random.Random(seed + i), n_operations, update_ratio, outcomes) for i in range(n_clients)])
+    elapsed = time.perf_counter() - start
+    return elapsed, locks.n_acquires, outcomes
+
+
+def run_benchmark(n_clients: int = 200, n_operations: int = 20, update_ratio: float = 0.3, repeat: int = 3, seed: int = 0):
+    results = []
+    for use_range_locks in [False, True]:
+        rounds = [asyncio.run(_run_round(use_range_locks, n_clients, n_operations, update_ratio, seed)) for _ in range(repeat)]
+        elapsed, n_acquires, outcomes = min(rounds, key=lambda r: r[0])
+        results.append({'locking': 'range' if use_range_locks else 'per_slot', 'clients': n_clients, 'operations': n_clients * n_operations,
+                        'acquires': n_acquires, 'booked': outcomes['booked'], 'conflicts': outcomes['conflicts'],
+                        'total_ms': 1000*elapsed, 'ops_per_s': n_clients * n_operations / elapsed})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--operations', type=int, default=20, help='operations by client')
+    parser.add_argument('--update-ratio', type=float, default=0.3, help='fraction of operations moving the client booking (locking old + new slots)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'locking':>9} {'clients':>8} {'ops':>7} {'acquires':>9} {'booked':>7} {'conflicts':>10} {'total ms':>9} {'ops/s':>9}")
+    for r in run_benchmark(n_clients=args.clients, n_operations=args.operations, update_ratio=args.update_ratio, repeat=args.repeat, seed=args.seed):
+        print(f"{r['locking']:>9} {r['clients']:>8} {r['operations']:>7} {r['acquires']:>9} {r['booked']:>7} {r['conflicts']:>10} {r['total_ms']:>9.1f} {r['ops_per_s']:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Stress benchmark of the read snapshots: concurrent writers moving the users reservations (update_reservation) and readers listing all the reservations
+and counting the booked calendar slots. Every committed state has exactly one reservation by user, whose slots are the only booked ones: a read seeing
+anything else saw a half done write. The reservation manager yields on each insert/remove (as one backed by a database would), so writers get suspended mid-operation.
+Compares the read snapshots against the previous reads of the live state, then times sequential updates with and without the snapshot maintenance.
+Run from the src directory:
+    python -m benchmarks.read_snapshot_benchmark [--users U] [--writers W] [--readers R] [--updates N] [--days D]
+"""
+import argparse, asyncio, datetime, random, time
+from datetime import timedelta
+from backend.business_core import BusinessCore
+from backend.reservations import ReservationManager
+
+
+SERVICES = {'haircut': 30, 'beard': 20, 'color': 45}
+
+
+class YieldingReservationManager(ReservationManager):
+    """ Yields to the event loop before each insert/remove, as a reservation manager doing I/O would. """
+    async def insert_reservation(self, reservation):
+        await asyncio.sleep(0)
+        return await super().insert_reservation(reservation)
+
+    async def remove_reservation(self, reservation_id: str):
+        await asyncio.sleep(0)
+        return await super().remove_reservation(reservation_id)
+
+
+class LiveReadsCore(BusinessCore):
+    """ Previous reads: straight from the live calendar and reservations, with no snapshot. Kept as reference for results and timings. """
+    def _begin_write(self):
+        self._writes_in_progress += 1
+
+    def _get_read_view(self):
+        return self.calendar, self.reservation_manager
+
+
+def build_core(core_class, n_days: int, reservation_manager: ReservationManager):
+    from backend.policy import PolicyManager, Service
+    from benchmarks.availability_benchmark import build_calendar
+
+    services = [Service(service_name, 10, float(minutes_duration), '') for service_name, minutes_duration in SERVICES.items()]
+    policy_manager = PolicyManager(services=services, min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00'),('15:00','20:00')])
+    return core_class(reservation_manager=reservation_manager, calendar=build_calendar(n_days, start_date=datetime.date.today() + timedelta(days=1)),
+                      policy_manager=policy_manager, default_grid_minutes=15)
+
+
+def _start_times(calendar) -> list[datetime.datetime]:
+    return [segment.start_time + timedelta(minutes=15*i) for segment in calendar.segments for i in range(int((segment.end_time - segment.start_time) / timedelta(minutes=15)))]
+
+
+async def _book_users(core, n_users: int, rnd: random.Random) -> dict[str, str]:
+    """ Books one reservation by user, returning user -> reservation id. """
+    from shared.user_role import UserRole
+
+    reservation_ids = {}
+    for start_time in _start_times(core.calendar)[::4]:
+        if len(reservation_ids) == n_users:
+            break
+        user = f'user_{len(reservation_ids)}'
+        event = await core.make_reservation(service_name=rnd.choice(list(SERVICES)), start_time=start_time, user=user, actor=UserRole.ADMIN)
+        reservation_ids[user] = event.data.new.reservation_id
+    if len(reservation_ids) < n_users:
+        raise ValueError(f'Not enough room for {n_users} users: use more days')
+    return reservation_ids
+
+
+async def _writer(core, users: list[str], reservation_ids: dict[str, str], start_times: list, n_updates: int, rnd: random.Random, outcomes: dict):
+    from shared.user_role import UserRole
+
+    for _ in range(n_updates):
+        user = rnd.choice(users)
+        try:
+            event = await core.update_reservation(existing_reservation_id=reservation_ids[user], new_start_time=rnd.choice(start_times), actor=UserRole.ADMIN)
+        except Exception: ## e.g. the new time is already booked
+            outcomes['conflicts'] += 1
+            continue
+        reservation_ids[user] = event.data.new.reservation_id
+        outcomes['updates'] += 1
+
+
+def _check_read(core, n_users: int) -> bool:
+    """ One consistent read: the listed reservations (one by user) and the booked calendar slots come from the same committed state. """
+    reservations = core.get_all_reservations().data.new
+    calendar, _ = core._get_read_view()
+    n_booked_slots = sum(segment.n_slots - segment._n_free_slots for segment in calendar.segments)
+    expected_booked_slots = sum((r.end_time - r.start_time) // timedelta(minutes=calendar.slot_minutes_duration) for r in reservations)
+    return len(reservations) == n_users and len({r.user for r in reservations}) == n_users and n_booked_slots == expected_booked_slots
+
+
+async def _reader(core, n_users: int, writers_done: asyncio.Event, outcomes: dict):
+    while not writers_done.is_set():
+        start = time.perf_counter()
+        is_consistent = _check_read(core, n_users)
+        outcomes['read_s'] += time.perf_counter() - start
+        outcomes['reads'] += 1
+        outcomes['inconsistent_reads'] += not is_consistent
+        await asyncio.sleep(0)
+
+
+async def _stress_round(core_class, n_users: int, n_writers: int, n_readers: int, n_updates: int, n_days: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    core = build_core(core_class, n_days, YieldingReservationManager())
+    reservation_ids = await _book_users(core, n_users, rnd)
+    start_times = _start_times(core.calendar)
+    users = list(reservation_ids)
+    outcomes = {'updates': 0, 'conflicts': 0, 'reads': 0, 'inconsistent_reads': 0, 'read_s': 0.}
+    writers_done = asyncio.Event()
+
+    async def _writers():
+        await asyncio.gather(*[_writer(core, users[i::n_writers], reservation_ids, start_times, n_updates, random.Random(seed + i), outcomes) for i in range(n_writers)])
+        writers_done.set()
+    start = time.perf_counter()
+    await asyncio.gather(_writers(), *[_reader(core, n_users, writers_done, outcomes) for _ in range(n_readers)])
+    outcomes['total_s'] = time.perf_counter() - start
+    if not _check_read(core, n_users):
+        raise AssertionError('Inconsistent final state')
+    return outcomes
+
+
+async def _sequential_updates(core_class, n_users: int, n_updates: int, n_days: int, seed: int) -> float:
+    """ Seconds per update, with no reader and a plain reservation manager: the cost of the snapshot maintenance on the writes. """
+    rnd = random.Random(seed)
+    core = build_core(core_class, n_days, ReservationManager())
+    reservation_ids = await _book_users(core, n_users, rnd)
+    start_times, users, outcomes = _start_times(core.calendar), list(reservation_ids), {'updates': 0, 'conflicts': 0}
+    start = time.perf_counter()
+    await _writer(core, users, reservation_ids, start_times, n_updates, rnd, outcomes)
+    return (time.perf_counter() - start) / n_updates
+
+
+def run_benchmark(n_users: int = 100, n_writers: int = 20, n_readers: int = 5, n_updates: int = 50, n_days: int = 30, seed: int = 0) -> list[dict]:
+    results = []
+    for name, core_class in [('live', LiveReadsCore), ('snapshot', BusinessCore)]:
+        outcomes = asyncio.run(_stress_round(core_class, n_users, n_writers, n_readers, n_updates, n_days, seed))
+        update_s = asyncio.run(_sequential_updates(core_class, n_users, n_writers * n_updates, n_days, seed))
+        results.append({'reads': name, 'updates': outcomes['updates'], 'conflicts': outcomes['conflicts'], 'read_count': outcomes['reads'],
+                        'inconsistent_reads': outcomes['inconsistent_reads'], 'read_us': 1e6*outcomes['read_s'] / max(outcomes['reads'], 1),
+                        'total_ms': 1000*outcomes['total_s'], 'update_us': 1e6*update_s})
+    if results[1]['inconsistent_reads']:
+        raise AssertionError(f"{results[1]['inconsistent_reads']} inconsistent reads on the snapshots")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--writers', type=int, default=20)
+    parser.add_argument('--readers', type=int, default=5)
+    parser.add_argument('--updates', type=int, default=50, help='updates by writer')
+    parser.add_argument('--days', type=int, default=30, help='calendar days of opening hours')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmark(n_users=args.users, n_writers=args.writers, n_readers=args.readers, n_updates=args.updates, n_days=args.days, seed=args.seed)
+    print(f"{'reads':>9} {'updates':>8} {'conflicts':>10} {'reads':>7} {'inconsistent':>13} {'read us':>9} {'total ms':>9} {'seq update us':>14}")
+    for r in results:
+        print(f"{r['reads']:>9} {r['updates']:>8} {r['conflicts']:>10} {r['read_count']:>7} {r['inconsistent_reads']:>13} {r['read_us']:>9.1f} {r['total_ms']:>9.1f} {r['update_us']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
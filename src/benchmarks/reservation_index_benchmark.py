@@ -0,0 +1,96 @@
+"""
+Benchmark of the ReservationManager lookups (by user, date, service, status and time range) on many reservations,
+against the previous scans of all the reservations (by user and date) and plain filters (by service, status and time range).
+Run from the src directory:
+    python -m benchmarks.reservation_index_benchmark [--reservations N] [--queries Q] [--repeat R]
+"""
+import argparse, asyncio, datetime, math, random, timeit
+from datetime import timedelta
+
+
+SERVICES = {'haircut': 30, 'beard': 20, 'color': 45, 'wash': 15}
+N_USERS = 5000
+
+
+def legacy_get_reservations_by_user(reservation_manager, user: str):
+    """ Previous get_reservations_by_user: scans all the reservations. Kept as reference for results and timings. """
+    reservation_ids = reservation_manager.reservations_by_user.get(user, [])
+    return [reservation for res_id,reservation in reservation_manager.reservations_id_mappings.items() if res_id in reservation_ids]
+
+
+def scan_get_reservations_by_date(reservation_manager, date: datetime.date):
+    """ What the previous get_reservations_by_date was meant to return (it never matched): scans all the reservations. """
+    return [reservation for reservation in reservation_manager.reservations_id_mappings.values() if reservation.start_time.date()==date]
+
+
+def build_reservation_manager(n_reservations: int, seed: int = 0):
+    """ Inserts n_reservations reservations of random users and services, spread over one year. 1 out of 10 is pending confirmation. """
+    from backend.reservations import ReservationManager, Reservation
+    from utils.datetimes_utils import map_datetime_to_default
+
+    rnd = random.Random(seed)
+    first_time = map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(9)))
+    reservation_manager = ReservationManager()
+
+    async def _insert_all():
+        for i in range(n_reservations):
+            service_name = rnd.choice(list(SERVICES))
+            start_time = first_time + timedelta(days=rnd.randrange(365), minutes=5*rnd.randrange(120))
+            reservation = Reservation(f'res_{i}', f'user_{rnd.randrange(N_USERS)}', start_time, start_time + timedelta(minutes=SERVICES[service_name]), service_name)
+            await reservation_manager.insert_reservation(reservation)
+            if rnd.random() < 0.1:
+                reservation.mark_as_pending_confirmation()
+            else:
+                reservation.mark_as_confirmed()
+    asyncio.run(_insert_all())
+    return reservation_manager
+
+
+def run_benchmark(n_reservations: int = 100_000, n_queries: int = 50, repeat: int = 3, seed: int = 0):
+    from backend.reservations import ReservationStatus
+
+    reservation_manager = build_reservation_manager(n_reservations, seed=seed)
+    rnd = random.Random(seed)
+    users = [f'user_{rnd.randrange(N_USERS)}' for _ in range(n_queries)]
+    dates = sorted(reservation_manager.reservations_by_date)
+    dates = [rnd.choice(dates) for _ in range(n_queries)]
+    windows = [(start_time, start_time + timedelta(hours=2)) for start_time in (r.start_time for r in rnd.sample(list(reservation_manager.reservations_id_mappings.values()), n_queries))]
+    all_reservations = lambda: reservation_manager.reservations_id_mappings.values()
+    cases = [
+        ('by_user', users, lambda u: legacy_get_reservations_by_user(reservation_manager, u), reservation_manager.get_reservations_by_user),
+        ('by_date', dates, lambda d: scan_get_reservations_by_date(reservation_manager, d), reservation_manager.get_reservations_by_date),
+        ('by_service', list(SERVICES), lambda s: [r for r in all_reservations() if r.service_name==s], reservation_manager.get_reservations_by_service),
+        ('by_status', [ReservationStatus.PENDING_CONFIRMATION_STATUS], lambda s: [r for r in all_reservations() if r.status==s], reservation_manager.get_reservations_by_status),
+        ('between', windows, lambda w: [r for r in all_reservations() if r.start_time < w[1] and r.end_time > w[0]], lambda w: reservation_manager.get_reservations_between(*w)),
+    ]
+
+    results = []
+    for name, keys, scan_lookup, index_lookup in cases:
+        for key in keys:
+            if {r.reservation_id for r in scan_lookup(key)} != {r.reservation_id for r in index_lookup(key)}:
+                raise AssertionError(f'Results mismatch for {name} lookup of {key}')
+        scan_time = min(timeit.repeat(lambda: [scan_lookup(k) for k in keys], number=1, repeat=repeat))
+        index_time = min(timeit.repeat(lambda: [index_lookup(k) for k in keys], number=1, repeat=repeat))
+        results.append({'lookup': name, 'queries': len(keys), 'avg_results': sum(len(index_lookup(k)) for k in keys) / len(keys),
+                        'scan_ms': 1000*scan_time/len(keys), 'index_ms': 1000*index_time/len(keys),
+                        'speedup': scan_time / index_time if index_time else math.inf})
+    return len(reservation_manager.reservations_id_mappings), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reservations', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=50, help='lookups by user, by date and by time range')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_reservations, results = run_benchmark(n_reservations=args.reservations, n_queries=args.queries, repeat=args.repeat, seed=args.seed)
+    print(f'{n_reservations} reservations')
+    print(f"{'lookup':>11} {'queries':>8} {'results':>8} {'scan ms':>9} {'index ms':>9} {'speedup':>8}")
+    for r in results:
+        print(f"{r['lookup']:>11} {r['queries']:>8} {r['avg_results']:>8.0f} {r['scan_ms']:>9.3f} {r['index_ms']:>9.3f} {r['speedup']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark of the Reservation objects: memory per reservation, rendering (repr and to_dict) and status transitions,
+against the previous Reservation (attributes in __dict__, datetime timestamps, repr built over to_dict).
+Run from the src directory:
+    python -m benchmarks.reservation_memory_benchmark [--reservations N] [--repeat R]
+"""
+import argparse, datetime, gc, random, timeit, tracemalloc
+from datetime import timedelta
+from backend.reservations import ReservationStatus ## imported at module level (as the previous Reservation did), not to time the imports
+from utils.datetimes_utils import get_global_timezone
+
+
+SERVICES = {'haircut': 30, 'beard': 20, 'color': 45, 'wash': 15}
+N_USERS = 5000
+
+
+class LegacyReservation:
+    """ Previous Reservation (status listener included), reduced to what is measured here. Kept as reference for results and timings. """
+    def __init__(self, reservation_id: str, user: str, start_time: datetime.datetime, end_time: datetime.datetime, service_name: str, status=None, expires_at: datetime.datetime=None, resource: int = None):
+        object.__setattr__(self, 'timestamp', datetime.datetime.now(tz=get_global_timezone()) )
+        object.__setattr__(self, 'reservation_id', reservation_id)
+        object.__setattr__(self, 'user', user)
+        object.__setattr__(self, 'start_time', start_time)
+        object.__setattr__(self, 'end_time', end_time)
+        object.__setattr__(self, 'service_name', service_name)
+        self.status = status
+        self._expires_at = expires_at
+        self.is_confirmed = True if not expires_at else False
+        self.resource = resource
+        self._status_listener = None
+
+    def mark_as_pending_confirmation(self, expires_at: datetime.datetime = None):
+        self.status = ReservationStatus.PENDING_CONFIRMATION_STATUS
+        self.is_confirmed = False
+        self._expires_at = expires_at
+
+    def mark_as_confirmed(self):
+        self.status = ReservationStatus.CONFIRMED_STATUS
+        self.is_confirmed = True
+        self._expires_at = None
+
+    def __setattr__(self, attribute, value):
+        if attribute in ['reservation_id', 'user', 'start_time', 'end_time', 'service_name', 'timestamp']:
+            raise ValueError(f'Cannot set attribute {attribute}. It is final')
+        if attribute=='status':
+            self.status_change_timestamp = datetime.datetime.now(tz=get_global_timezone())
+            previous_status = getattr(self, 'status', None)
+            object.__setattr__(self, attribute, value)
+            if (status_listener := getattr(self, '_status_listener', None)) is not None:
+                status_listener(self, previous_status)
+            return
+        return object.__setattr__(self, attribute, value)
+
+    def to_dict(self):
+        obj_dict = self.__dict__.copy()
+        obj_dict.pop('_status_listener', None)
+        for attr in obj_dict:
+            if isinstance(obj_dict[attr], LegacyReservation):
+                obj_dict[attr] = getattr(self, attr).to_dict()
+        return obj_dict
+
+    def __repr__(self):
+        self_dct = self.to_dict()
+        rep_str = f"reservation_id = {self.reservation_id} - " if self.reservation_id else ""
+        rep_str += ' - '.join(f'{k} = {v}' for k,v in self_dct.items() if k in ['service_name', 'user'])
+        rep_str += f". From {self_dct['start_time']} to {self_dct['end_time']}"
+        if (expiry_t := getattr(self, '_expires_at', False)):
+            rep_str += f" Time limit to confirm: {expiry_t}"
+        return rep_str
+
+
+def _reservations_params(n_reservations: int, seed: int = 0) -> list[tuple]:
+    """ Parameters of n_reservations reservations over one year. Users and services are encoded, to be decoded as new strings by each reservation (as when parsed from requests). """
+    from utils.datetimes_utils import map_datetime_to_default
+
+    rnd = random.Random(seed)
+    first_time = map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(9)))
+    params = []
+    for i in range(n_reservations):
+        service_name = rnd.choice(list(SERVICES))
+        start_time = first_time + timedelta(days=rnd.randrange(365), minutes=5*rnd.randrange(120))
+        params.append((f'res_{i}', f'user_{rnd.randrange(N_USERS)}'.encode(), start_time, start_time + timedelta(minutes=SERVICES[service_name]), service_name.encode()))
+    return params
+
+
+def _build(reservation_class, params: list[tuple]) -> list:
+    reservations = [reservation_class(res_id, user.decode(), start_time, end_time, service_name.decode()) for res_id, user, start_time, end_time, service_name in params]
+    for reservation in reservations:
+        reservation.mark_as_confirmed()
+    return reservations
+
+
+def _memory_per_reservation(reservation_class, n_reservations: int, seed: int) -> float:
+    """ Bytes held by each reservation, its user and service strings included (the parameters are allocated before tracing). """
+    params = _reservations_params(n_reservations, seed=seed)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    reservations = _build(reservation_class, params)
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del reservations
+    return allocated / n_reservations
+
+
+def _transitions(reservations: list):
+    for reservation in reservations:
+        reservation.mark_as_pending_confirmation()
+        reservation.mark_as_confirmed()
+
+
+def run_benchmark(n_reservations: int = 100_000, repeat: int = 3, seed: int = 0) -> list[dict]:
+    from backend.reservations import Reservation
+
+    params = _reservations_params(n_reservations, seed=seed)
+    results = []
+    for name, reservation_class in [('legacy', LegacyReservation), ('slotted', Reservation)]:
+        reservations = _build(reservation_class, params)
+        results.append({'reservation': name,
+                        'bytes_per_reservation': _memory_per_reservation(reservation_class, n_reservations, seed),
+                        'build_ms': 1000*min(timeit.repeat(lambda: _build(reservation_class, params), number=1, repeat=repeat)),
+                        'repr_ms': 1000*min(timeit.repeat(lambda: [repr(r) for r in reservations], number=1, repeat=repeat)),
+                        'to_dict_ms': 1000*min(timeit.repeat(lambda: [r.to_dict() for r in reservations], number=1, repeat=repeat)),
+                        'transitions_ms': 1000*min(timeit.repeat(lambda: _transitions(reservations), number=1, repeat=repeat))})
+        if name=='legacy':
+            legacy_reprs = [repr(r) for r in reservations]
+        elif legacy_reprs != [repr(r) for r in reservations]:
+            raise AssertionError('repr mismatch between legacy and slotted reservations')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reservations', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmark(n_reservations=args.reservations, repeat=args.repeat, seed=args.seed)
+    print(f'{args.reservations} reservations')
+    print(f"{'reservation':>12} {'bytes/res':>10} {'build ms':>9} {'repr ms':>9} {'to_dict ms':>11} {'transitions ms':>15}")
+    for r in results:
+        print(f"{r['reservation']:>12} {r['bytes_per_reservation']:>10.0f} {r['build_ms']:>9.1f} {r['repr_ms']:>9.1f} {r['to_dict_ms']:>11.1f} {r['transitions_ms']:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
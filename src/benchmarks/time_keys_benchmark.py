@@ -0,0 +1,158 @@
+"""
+Benchmark of the epoch-minute internal time keys against the previous tz-aware datetime keys, on:
+    - BusinessCalendar.get_available_booking_slots (segments bisected by datetime key functions, align_to_slot through astimezone)
+    - ReservationManager._find_reservations_by_inner_time (daily start times sorted at each lookup, then bisected by datetime)
+Run from the src directory:
+    python -m benchmarks.time_keys_benchmark [--repeat N] [--queries Q]
+"""
+import argparse, asyncio, datetime, math, random, timeit
+from datetime import timedelta
+from bisect import bisect_left, bisect_right
+
+
+WINDOWS_DAYS = [1, 30, 365]
+SERVICES_MINUTES = [20, 30, 45]
+RESERVATIONS_BY_DAY = 20
+
+
+def _datetime_align_to_slot(segment, datetime_obj: datetime.datetime, how):
+    """ Previous Segment.align_to_slot, comparing tz-aware datetimes. """
+    from backend.business_calendar import AlignMethod
+
+    datetime_obj = datetime_obj.astimezone(segment.start_time.tzinfo)
+    if datetime_obj < segment.start_time:
+        return segment.start_time if how==AlignMethod.NEXT else None
+    if datetime_obj > segment.end_time:
+        return segment.end_time if how==AlignMethod.PREVIOUS else None
+    curr_timedelta_mismatch = timedelta(seconds=(datetime_obj - segment.start_time).total_seconds() % (60*segment.slot_duration))
+    if not curr_timedelta_mismatch:
+        return datetime_obj
+    prev_slot_dt = datetime_obj - curr_timedelta_mismatch
+    return prev_slot_dt if how==AlignMethod.PREVIOUS else prev_slot_dt + timedelta(minutes=segment.slot_duration)
+
+
+def _datetime_indexes_slice(segment, start_time: datetime.datetime, end_time: datetime.datetime):
+    offset = lambda t: (t - segment.start_time).total_seconds() / (60*segment.slot_duration)
+    return min(max(0, math.floor(offset(start_time))), segment.n_slots), min(max(0, math.ceil(offset(end_time))), segment.n_slots)
+
+
+def datetime_keys_get_available_booking_slots(calendar, minutes_duration: int, min_start_time: datetime.datetime, max_start_time: datetime.datetime, minutes_grid_span: int = 15):
+    """ Previous get_available_booking_slots (datetime keys). Kept as reference for results and timings. """
+    from backend.business_calendar import AlignMethod, Slot, _get_available_start_indexes
+
+    n_slots_needed = math.ceil(minutes_duration / calendar.slot_minutes_duration)
+    available_default_slots, available_special_slots = [], []
+    first_segment_pos = bisect_right(calendar.segments, min_start_time, key=lambda x: x.end_time)
+    last_segment_pos = bisect_left(calendar.segments, max_start_time + timedelta(minutes=minutes_duration), key=lambda x: x.start_time)
+    for segment in calendar.segments[first_segment_pos:last_segment_pos]:
+        aligned_min_start_time = _datetime_align_to_slot(segment, min_start_time, how=AlignMethod.NEXT)
+        aligned_max_start_time = _datetime_align_to_slot(segment, max_start_time, how=AlignMethod.PREVIOUS)
+        if aligned_min_start_time is None or aligned_max_start_time is None or aligned_min_start_time>aligned_max_start_time:
+            continue
+        start_idx, end_idx = _datetime_indexes_slice(segment, aligned_min_start_time, aligned_max_start_time + timedelta(minutes=minutes_duration))
+        default_indexes, special_indexes = _get_available_start_indexes(segment, start_idx=start_idx, end_idx=end_idx, n_slots_needed=n_slots_needed,
+                                                                        grid_step=minutes_grid_span // segment.slot_duration)
+        available_default_slots.extend(Slot(segment, i) for i in default_indexes)
+        available_special_slots.extend(Slot(segment, i) for i in special_indexes)
+    return available_default_slots, available_special_slots
+
+
+def datetime_keys_find_reservations_by_inner_time(reservations_by_start_time: dict, reservation_manager, inner_time: datetime.datetime):
+    """ Previous ReservationManager._find_reservations_by_inner_time, over a date -> start datetime -> ids index. Kept as reference for results and timings. """
+    daily_reservations = sorted(reservations_by_start_time.get(inner_time.date(), {}).items(), key=lambda x: x[0])
+    matching_index = bisect_right(daily_reservations, inner_time, key=lambda x: x[0]) - 1
+    matched_reservations = []
+    if matching_index>=0:
+        for reserv in [reservation_manager.get_reservation(res_id) for res_id in daily_reservations[matching_index][1]]:
+            if reserv.start_time <= inner_time < reserv.end_time:
+                matched_reservations.append(reserv)
+    return matched_reservations
+
+
+def build_reservation_manager(calendar, n_by_day: int = RESERVATIONS_BY_DAY, seed: int = 0):
+    """ Inserts up to n_by_day not overlapping reservations by day, on the calendar segments. Returns the manager and the datetime keyed index of the previous implementation. """
+    from backend.reservations import ReservationManager, Reservation
+
+    rnd = random.Random(seed)
+    reservation_manager, reservations_by_start_time = ReservationManager(), {}
+    n_segments_by_day = max(1, len(calendar.segments) // max(1, len({s.start_time.date() for s in calendar.segments})))
+    reservations = []
+    for segment in calendar.segments:
+        start_time = segment.start_time
+        for _ in range(n_by_day // n_segments_by_day):
+            end_time = start_time + timedelta(minutes=rnd.choice(SERVICES_MINUTES))
+            if end_time > segment.end_time:
+                break
+            reservations.append(Reservation(f'res_{len(reservations)}', f'user_{rnd.randrange(1000)}', start_time, end_time, 'service'))
+            reservations_by_start_time.setdefault(start_time.date(), {}).setdefault(start_time, set()).add(reservations[-1].reservation_id)
+            start_time = end_time + timedelta(minutes=5*rnd.randrange(0, 4))
+
+    async def _insert_all():
+        for reservation in reservations:
+            await reservation_manager.insert_reservation(reservation)
+    asyncio.run(_insert_all())
+    return reservation_manager, reservations_by_start_time
+
+
+def run_benchmark(repeat: int = 5, n_queries: int = 2000, density: float = 0.4, seed: int = 0):
+    from benchmarks.availability_benchmark import build_calendar, fill_calendar
+
+    calendar = fill_calendar(build_calendar(max(WINDOWS_DAYS)), density=density, seed=seed)
+    min_start_time = calendar.segments[0].start_time
+    availability_results = []
+    for n_days in WINDOWS_DAYS:
+        max_start_time = min_start_time + timedelta(days=n_days) - timedelta(minutes=1)
+        for minutes_duration in SERVICES_MINUTES:
+            query_kwargs = dict(minutes_duration=minutes_duration, min_start_time=min_start_time, max_start_time=max_start_time, minutes_grid_span=15)
+
+            expected = datetime_keys_get_available_booking_slots(calendar, **query_kwargs)
+            actual = calendar.get_available_booking_slots(split_by_segment=False, **query_kwargs)
+            if [[s.start_time for s in l] for l in expected] != [[s.start_time for s in l] for l in actual]:
+                raise AssertionError(f'Results mismatch for a {n_days} days window, {minutes_duration} minutes duration')
+
+            datetime_keys_time = min(timeit.repeat(lambda: datetime_keys_get_available_booking_slots(calendar, **query_kwargs), number=1, repeat=repeat))
+            minute_keys_time = min(timeit.repeat(lambda: calendar.get_available_booking_slots(split_by_segment=False, **query_kwargs), setup=calendar._availability_cache.clear, number=1, repeat=repeat))
+            availability_results.append({'window_days': n_days, 'minutes_duration': minutes_duration, 'n_results': len(actual[0]) + len(actual[1]),
+                                         'datetime_keys_ms': 1000*datetime_keys_time, 'minute_keys_ms': 1000*minute_keys_time,
+                                         'speedup': datetime_keys_time / minute_keys_time if minute_keys_time else math.inf})
+
+    reservation_manager, reservations_by_start_time = build_reservation_manager(calendar, seed=seed)
+    rnd = random.Random(seed)
+    segments = calendar.segments
+    inner_times = []
+    for _ in range(n_queries):
+        segment = rnd.choice(segments)
+        inner_times.append(segment.start_time + timedelta(minutes=rnd.randrange(int((segment.end_time - segment.start_time).total_seconds() // 60))))
+    for inner_time in inner_times[:200]:
+        expected = datetime_keys_find_reservations_by_inner_time(reservations_by_start_time, reservation_manager, inner_time)
+        if expected != reservation_manager._find_reservations_by_inner_time(inner_time):
+            raise AssertionError(f'Results mismatch for inner time {inner_time}')
+    datetime_keys_time = min(timeit.repeat(lambda: [datetime_keys_find_reservations_by_inner_time(reservations_by_start_time, reservation_manager, t) for t in inner_times], number=1, repeat=repeat))
+    minute_keys_time = min(timeit.repeat(lambda: [reservation_manager._find_reservations_by_inner_time(t) for t in inner_times], number=1, repeat=repeat))
+    inner_time_result = {'n_reservations': len(reservation_manager.reservations_id_mappings), 'queries': n_queries,
+                         'datetime_keys_us': 1e6*datetime_keys_time/n_queries, 'minute_keys_us': 1e6*minute_keys_time/n_queries,
+                         'speedup': datetime_keys_time / minute_keys_time if minute_keys_time else math.inf}
+    return availability_results, inner_time_result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=2000, help='inner time lookups')
+    parser.add_argument('--density', type=float, default=0.4, help='fraction of booked slots')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    availability_results, inner_time_result = run_benchmark(repeat=args.repeat, n_queries=args.queries, density=args.density, seed=args.seed)
+    print('get_available_booking_slots')
+    print(f"{'days':>5} {'minutes':>8} {'results':>8} {'datetime ms':>12} {'minutes ms':>11} {'speedup':>8}")
+    for r in availability_results:
+        print(f"{r['window_days']:>5} {r['minutes_duration']:>8} {r['n_results']:>8} {r['datetime_keys_ms']:>12.2f} {r['minute_keys_ms']:>11.2f} {r['speedup']:>7.1f}x")
+    r = inner_time_result
+    print('\n_find_reservations_by_inner_time')
+    print(f"{'reservations':>13} {'queries':>8} {'datetime us':>12} {'minutes us':>11} {'speedup':>8}")
+    print(f"{r['n_reservations']:>13} {r['queries']:>8} {r['datetime_keys_us']:>12.2f} {r['minute_keys_us']:>11.2f} {r['speedup']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -429,7 +429,7 @@ class UserProcessor:
         conversation_messages = [(str(self.user_id) if msg.role==conversation_manager.Role.USER else str(msg.role.value), msg.text) for msg in conv_context]
         user_id = self.user_id
         
-        return await self.app_system.handle_message(user_id=user_id, message=response.text, past_conversation_messages=conversation_messages)
+        return await self.app_system.handle_message(user_id=user_id, message=response.text, past_conversation_messages=conversation_messages, response_id=response.response_id)
         
 
     async def _run_pending(self, runtime=None):
@@ -164,6 +164,7 @@ def _generate_new_business_core_from_config(business_config: dict):
     from backend.reservations import ReservationManager
     from backend.business_core import BusinessCoreWithConfirmation
     from backend.business_calendar import BusinessCalendar
+    from backend.multi_resource_calendar import MultiResourceCalendar
     # =========================
     # SERVICES
     # =========================
@@ -193,7 +194,12 @@ def _generate_new_business_core_from_config(business_config: dict):
     # CALENDAR
     # =========================
 
-    calendar = BusinessCalendar(slot_minutes_duration=business_config["calendar"].get("slot_minutes_duration", 5))
+    slot_minutes_duration = business_config["calendar"].get("slot_minutes_duration", 5)
+    n_resources = business_config["calendar"].get("n_resources", 1)
+    if n_resources > 1:
+        calendar = MultiResourceCalendar(n_resources=n_resources, slot_minutes_duration=slot_minutes_duration)
+    else:
+        calendar = BusinessCalendar(slot_minutes_duration=slot_minutes_duration)
 
     segments = generate_calendar_segments(business_config["calendar"], business_config["opening_hours"])
     for segment in segments:
@@ -211,7 +217,8 @@ def _generate_new_business_core_from_config(business_config: dict):
         calendar=calendar,
         policy_manager=policy_manager,
         default_grid_minutes=business_config["booking"].get("default_grid_minutes", 15),
-        max_confirmation_minutes=policies_cfg.get("max_confirmation_minutes", 15)
+        max_confirmation_minutes=policies_cfg.get("max_confirmation_minutes", 15),
+        optimistic_concurrency=business_config["booking"].get("optimistic_concurrency", False)
     )
     return business_manager
 
@@ -258,6 +265,7 @@ async def initialize_application_orchestrator(load_if_existing: bool = True):
         requests_fp = backend_manager_fp.parent / "requests.jsonl"
         storage_manager = AppStoringManager(backend_manager_filepath=backend_manager_fp, requests_filepath=requests_fp)
 
+    business_manager.reservation_manager.archive = storage_manager.reservation_archive
     booking_service = BookingService(core=business_manager)
 
     # =========================
@@ -296,6 +304,11 @@ async def initialize_application_orchestrator(load_if_existing: bool = True):
             warnings.warn(f'Request {req._id} was not executed successfully!!! \t Error: {resp.error_code}; error_details: {resp.error_msg}')
     if bool(requests_to_execute) and all_successes:
         asyncio.create_task(orchestrator.checkpoint())
+
+    calendar_config = load_yaml(CONFIG_DIR / "business_config.yaml")["calendar"]
+    if calendar_config["generation_mode"] == "rolling_days":
+        orchestrator.start_calendar_maintenance(future_days=calendar_config["future_days"], archive_after_days=calendar_config.get("archive_after_days", 0))
+    orchestrator.start_pending_expiry_sweeper()
         
 
     return orchestrator
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Available days: a day is available only if the service can be booked there at a grid aligned start time, not merely if it has a long enough free run.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+import pytest
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCore
+from backend.domain_errors import AlreadyBookedError, PolicyError
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager
+from shared.user_role import UserRole
+from utils.datetimes_utils import map_datetime_to_default
+
+
+def _tomorrow(hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(hour, minute)))
+
+
+def _build_core() -> BusinessCore:
+    calendar = BusinessCalendar(slot_minutes_duration=5)
+    calendar.add_segments([Segment(_tomorrow(9), _tomorrow(10), 5)])
+    policy_manager = PolicyManager(services=[Service('haircut', 30, 30.0, '')], min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','10:00')])
+    return BusinessCore(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15)
+
+
+async def _book_off_grid(core: BusinessCore, start_time: datetime.datetime, minutes_duration: int):
+    await core.make_reservation(service_name='haircut', start_time=start_time, user='admin', minutes_duration=minutes_duration, actor=UserRole.ADMIN, force_default_grid=False)
+
+
+def _available_days(core: BusinessCore) -> list[str]:
+    tomorrow = datetime.date.today() + timedelta(days=1)
+    return core.get_available_days(service_name='haircut', from_date=tomorrow, to_date=tomorrow).data.new
+
+
+def test_free_run_with_no_grid_aligned_start_is_not_available():
+    async def run():
+        core = _build_core()
+        await _book_off_grid(core, _tomorrow(9), 25)
+        await _book_off_grid(core, _tomorrow(9, 55), 5)
+        assert core.calendar.get_daily_free_counters(_tomorrow(9).date(), _tomorrow(9).date())[_tomorrow(9).date()][1] == 6 ## 09:25-09:55 is free
+        assert _available_days(core) == []
+        assert core.get_available_datetimes(service_name='haircut', min_start_time=_tomorrow(9), max_start_time=_tomorrow(10), minutes_duration=30).data.new[0] == []
+        for start_time in (_tomorrow(9, 25), _tomorrow(9, 30)):
+            with pytest.raises((AlreadyBookedError, PolicyError)):
+                await core.make_reservation(service_name='haircut', start_time=start_time, user='bob')
+    asyncio.run(run())
+
+
+def test_free_run_with_grid_aligned_start_is_available():
+    async def run():
+        core = _build_core()
+        await _book_off_grid(core, _tomorrow(9), 25)
+        assert _available_days(core) == [str(_tomorrow(9).date())]
+        await core.make_reservation(service_name='haircut', start_time=_tomorrow(9, 30), user='bob')
+        assert _available_days(core) == []
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+"""
+Bulk reservations: all-or-nothing requests leave no booked slot nor reservation behind when any item fails, partial requests report the error of each failing item,
+and items colliding on the same slots are prepared again on the updated calendar (e.g. moving to another resource).
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+import pytest
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCore
+from backend.business_event import BusinessEvent
+from backend.domain_errors import AlreadyBookedError, PolicyError
+from backend.multi_resource_calendar import MultiResourceCalendar
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager
+from utils.datetimes_utils import map_datetime_to_default
+
+
+def _tomorrow(hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(hour, minute)))
+
+
+def _build_core(n_resources: int = 1) -> BusinessCore:
+    calendar = BusinessCalendar(slot_minutes_duration=5) if n_resources == 1 else MultiResourceCalendar(n_resources=n_resources, slot_minutes_duration=5)
+    calendar.add_segments([Segment(_tomorrow(9), _tomorrow(13), 5)])
+    policy_manager = PolicyManager(services=[Service('haircut', 30, 30.0, '')], min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00')])
+    return BusinessCore(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15)
+
+
+def _request(user: str, hour: int, minute: int = 0, service_name: str = 'haircut') -> dict:
+    return dict(service_name=service_name, start_time=_tomorrow(hour, minute), user=user)
+
+
+def _booked_slots(core: BusinessCore) -> list:
+    return [slot for slot in core.calendar.get_slots(_tomorrow(9), _tomorrow(13)) if slot.is_booked()]
+
+
+def test_all_or_nothing_failure_frees_the_booked_slots():
+    async def run():
+        core = _build_core()
+        with pytest.raises(AlreadyBookedError, match='Request 2'):
+            await core.make_reservations_bulk([_request('bob', 9), _request('alice', 11), _request('carl', 9, 15)])
+        assert _booked_slots(core) == [] and core.reservation_manager.get_all_reservations() == []
+        with pytest.raises(PolicyError, match='Request 1'):
+            await core.make_reservations_bulk([_request('bob', 9), _request('alice', 11, service_name='massage')])
+        assert _booked_slots(core) == [] and core.reservation_manager.get_all_reservations() == []
+        results = await core.make_reservations_bulk([_request('bob', 9), _request('carl', 9, 30)]) ## the freed slots can be booked again
+        assert [event.data.new.user for event in results] == ['bob', 'carl']
+    asyncio.run(run())
+
+
+def test_all_or_nothing_insert_failure_removes_the_inserted_reservations():
+    async def run():
+        core = _build_core()
+        insert_reservation = core.reservation_manager.insert_reservation
+        async def _failing_insert(reservation):
+            if reservation.user == 'alice':
+                raise KeyError('storage failure')
+            return await insert_reservation(reservation)
+        core.reservation_manager.insert_reservation = _failing_insert
+        with pytest.raises(KeyError):
+            await core.make_reservations_bulk([_request('bob', 9), _request('alice', 10), _request('carl', 11)])
+        assert _booked_slots(core) == [] and core.reservation_manager.get_all_reservations() == []
+    asyncio.run(run())
+
+
+def test_partial_bulk_returns_the_error_of_each_failing_item():
+    async def run():
+        core = _build_core()
+        results = await core.make_reservations_bulk([_request('bob', 9), _request('alice', 10, service_name='massage'), _request('carl', 9, 15),
+                                                     _request('bob', 9, 15), _request('dave', 12, 10), _request('erin', 11)], all_or_nothing=False)
+        assert isinstance(results[0], BusinessEvent) and isinstance(results[5], BusinessEvent)
+        assert [type(result) for result in results[1:5]] == [PolicyError, AlreadyBookedError, PolicyError, PolicyError]
+        assert sorted(r.user for r in core.reservation_manager.get_all_reservations()) == ['bob', 'erin']
+        assert len(_booked_slots(core)) == 12
+    asyncio.run(run())
+
+
+def test_colliding_items_are_prepared_again_on_another_resource():
+    async def run():
+        core = _build_core(n_resources=2)
+        results = await core.make_reservations_bulk([_request('bob', 10), _request('alice', 10), _request('carl', 10)], all_or_nothing=False)
+        made = [result.data.new for result in results[:2]]
+        assert sorted(reservation.resource for reservation in made) == [0, 1]
+        assert isinstance(results[2], AlreadyBookedError)
+        assert len(core.reservation_manager.get_all_reservations()) == 2
+        with pytest.raises(AlreadyBookedError, match='Request 1'):
+            await core.make_reservations_bulk([_request('dave', 11), _request('erin', 10)])
+        assert len(core.reservation_manager.get_all_reservations()) == 2
+        assert not any(slot.is_booked() for resource in core.calendar.resources for slot in resource.get_slots(_tomorrow(11), _tomorrow(11, 30)))
+    asyncio.run(run())
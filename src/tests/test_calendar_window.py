@@ -0,0 +1,85 @@
+"""
+Rolling calendar window maintenance (BusinessCore.roll_calendar_window): eviction of the past segments and reservations, append of the missing days,
+and the archive being written before anything is evicted (a failing archive leaves the core unchanged).
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+import pytest
+from application.storing_manager import AppStoringManager
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCoreWithConfirmation
+from backend.policy import PolicyManager, Service
+from backend.reservations import Reservation, ReservationManager, ReservationStatus
+from utils.datetimes_utils import map_datetime_to_default, to_default_tz
+
+TODAY = datetime.date.today()
+
+
+def _at(days: int, hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(TODAY + timedelta(days=days), datetime.time(hour, minute)))
+
+
+def _build_core(days: range = range(-3, 3)) -> BusinessCoreWithConfirmation:
+    """ One 09:00-13:00 segment per day in days, each with a 10:00-10:30 reservation (id 'r<day>'). """
+    calendar = BusinessCalendar(slot_minutes_duration=5)
+    calendar.add_segments([Segment(_at(day, 9), _at(day, 13), 5) for day in days])
+    policy_manager = PolicyManager(services=[Service('haircut', 30, 30.0, '')], opening_hours=[('09:00','13:00')])
+    core = BusinessCoreWithConfirmation(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager)
+    async def insert_all():
+        for day in days:
+            await core.reservation_manager.insert_reservation(Reservation(f'r{day}', 'bob', _at(day, 10), _at(day, 10, 30), 'haircut', status=ReservationStatus.CONFIRMED_STATUS))
+            await calendar.reserve_slots(calendar.get_slots(_at(day, 10), _at(day, 10, 30)))
+    asyncio.run(insert_all())
+    return core
+
+
+def _segment_dates(core: BusinessCoreWithConfirmation) -> list[datetime.date]:
+    return [to_default_tz(segment.start_time).date() for segment in core.calendar.segments]
+
+
+def test_roll_evicts_past_segments_and_reservations_and_appends_missing_days():
+    core = _build_core()
+    event = asyncio.run(core.roll_calendar_window(future_days=5, curr_time=_at(0, 12)))
+    assert [reservation.reservation_id for reservation in event.data.old] == ['r-3', 'r-2', 'r-1', 'r0']
+    assert sorted(core.reservation_manager.reservations_id_mappings) == ['r1', 'r2']
+    assert _segment_dates(core) == [TODAY + timedelta(days=day) for day in range(6)] ## today's segment is not fully past yet
+    assert [to_default_tz(segment.start_time).date() for segment in event.data.new] == [TODAY + timedelta(days=day) for day in range(3, 6)]
+    assert core.calendar.get_slots(_at(1, 10), _at(1, 10, 30))[0].is_booked() ## kept reservations keep their slots
+    event = asyncio.run(core.roll_calendar_window(future_days=5, curr_time=_at(0, 12)))
+    assert event.data.old == [] and event.data.new == [] ## nothing left to evict nor to append
+
+
+def test_roll_keeps_reservations_ended_within_archive_after_days():
+    core = _build_core()
+    event = asyncio.run(core.roll_calendar_window(future_days=2, curr_time=_at(0, 12), archive_after_days=2))
+    assert [reservation.reservation_id for reservation in event.data.old] == ['r-3', 'r-2'] ## r-2 ended at 10:30, two days before 12:00
+    assert sorted(core.reservation_manager.reservations_id_mappings) == ['r-1', 'r0', 'r1', 'r2']
+    assert _segment_dates(core) == [TODAY + timedelta(days=day) for day in range(3)]
+
+
+def test_roll_fills_an_empty_calendar():
+    core = _build_core(days=range(0))
+    event = asyncio.run(core.roll_calendar_window(future_days=3, curr_time=_at(0, 8)))
+    assert event.data.old == [] and _segment_dates(core) == [TODAY + timedelta(days=day) for day in range(4)]
+    assert core.calendar.segments[0].start_time == _at(0, 9) and core.calendar.segments[-1].end_time == _at(3, 13)
+
+
+def test_failing_archive_leaves_the_core_unchanged():
+    core = _build_core()
+    segments, reservation_ids = list(core.calendar.segments), sorted(core.reservation_manager.reservations_id_mappings)
+    async def _failing_archive(reservations):
+        raise OSError('disk full')
+    with pytest.raises(OSError):
+        asyncio.run(core.roll_calendar_window(future_days=5, curr_time=_at(0, 12), archive_reservations=_failing_archive))
+    assert core.calendar.segments == segments and sorted(core.reservation_manager.reservations_id_mappings) == reservation_ids
+
+
+def test_evicted_reservations_are_archived(tmp_path):
+    core = _build_core()
+    storage_manager = AppStoringManager(requests_filepath=tmp_path / 'requests.jsonl', backend_manager_filepath=tmp_path / 'manager.jsonl')
+    core.reservation_manager.archive = storage_manager.reservation_archive
+    asyncio.run(core.roll_calendar_window(future_days=5, curr_time=_at(0, 12), archive_reservations=storage_manager.archive_reservations))
+    assert [reservation.reservation_id for reservation in storage_manager.reservation_archive.get_all_reservations()] == ['r-3', 'r-2', 'r-1', 'r0']
+    assert [reservation.reservation_id for reservation in core.get_user_reservations('bob', include_archived=True).data.new] == ['r-3', 'r-2', 'r-1', 'r0', 'r1', 'r2']
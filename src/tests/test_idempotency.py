@@ -0,0 +1,115 @@
+"""
+Idempotent BookingService operations: a repeated idempotency key is answered with the recorded result without running the operation again,
+the idempotency table expires and evicts its entries, and it survives a store/load round trip of the core.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+import pytest
+from backend.backend_storing_utils import load_business_core, store_business_core
+from backend.booking_service import BookingService
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCoreWithConfirmation
+from backend.business_event import BusinessEvent
+from backend.domain_errors import AlreadyBookedError, PolicyError
+from backend.idempotency_table import IdempotencyTable
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager
+from utils.datetimes_utils import map_datetime_to_default
+
+
+def _tomorrow(hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(hour, minute)))
+
+
+def _build_service() -> BookingService:
+    calendar = BusinessCalendar(slot_minutes_duration=5)
+    calendar.add_segments([Segment(_tomorrow(9), _tomorrow(13), 5)])
+    policy_manager = PolicyManager(services=[Service('haircut', 30, 30.0, '')], min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00')])
+    return BookingService(BusinessCoreWithConfirmation(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15))
+
+
+def _count_core_runs(service: BookingService) -> list:
+    calls = []
+    run = service.__run__
+    async def _counting_run(operation, **kwargs):
+        calls.append(operation)
+        return await run(operation, **kwargs)
+    service.__run__ = _counting_run
+    return calls
+
+
+def test_repeated_key_returns_the_recorded_result_without_running_again():
+    async def run():
+        service = _build_service()
+        calls = _count_core_runs(service)
+        first = await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10), idempotency_key='bob:1')
+        repeated = await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10), idempotency_key='bob:1')
+        assert repeated is first and len(calls) == 1
+        assert service.core.reservation_manager.get_reservations_by_user('bob') == [first.data.new]
+        other = await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(11), idempotency_key='bob:1') ## same key, other arguments
+        assert other is not first and len(calls) == 2 and len(service.core.reservation_manager.get_reservations_by_user('bob')) == 2
+    asyncio.run(run())
+
+
+def test_failed_operation_is_not_recorded():
+    async def run():
+        service = _build_service()
+        await service.make_reservation(user='alice', service_name='haircut', start_time=_tomorrow(10))
+        calls = _count_core_runs(service)
+        for _ in range(2):
+            with pytest.raises(AlreadyBookedError):
+                await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10), idempotency_key='bob:1')
+        assert len(calls) == 2 and len(service.core.idempotency_table) == 0
+    asyncio.run(run())
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('backend.idempotency_table.time.time', lambda: now[0])
+    table = IdempotencyTable(max_entries=10, ttl_seconds=60)
+    table.record('k1', 'f1', 'result 1')
+    table.record('k2', 'f2', 'result 2', expires_at=now[0] + 120)
+    assert table.get('k1', 'f1') == ('f1', 'result 1') and table.get('k1', 'other') is None
+    now[0] += 61
+    assert table.get('k1', 'f1') is None and table.get('k2') == ('f2', 'result 2')
+    assert [key for key, *_ in table.items()] == ['k2']
+    now[0] += 60
+    table.record('k3', 'f3', 'result 3') ## expired entries are evicted from the front
+    assert len(table) == 1 and table.get('k2') is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    table = IdempotencyTable(max_entries=2)
+    table.record('k1', 'f1', 'result 1')
+    table.record('k2', 'f2', 'result 2')
+    assert table.get('k1') is not None
+    table.record('k3', 'f3', 'result 3')
+    assert table.get('k2') is None and table.get('k1') is not None and table.get('k3') is not None
+    assert len(table) == 2
+    with pytest.raises(ValueError):
+        IdempotencyTable(max_entries=0)
+
+
+def test_idempotency_table_store_load_round_trip(tmp_path):
+    async def run():
+        service = _build_service()
+        service.core.idempotency_table = IdempotencyTable(max_entries=5, ttl_seconds=3600)
+        first = await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10), idempotency_key='bob:1')
+        service.core.idempotency_table.record('admin:1', 'fingerprint', [first, PolicyError('Cannot reserve')])
+        store_business_core(service.core, tmp_path / 'core.json')
+        loaded = BookingService(await load_business_core(tmp_path / 'core.json'))
+        table = loaded.core.idempotency_table
+        assert (table.max_entries, table.ttl_seconds, len(table)) == (5, 3600, 2)
+        assert [(key, expires_at, fingerprint) for key, expires_at, fingerprint, _ in table.items()] == \
+               [(key, expires_at, fingerprint) for key, expires_at, fingerprint, _ in service.core.idempotency_table.items()]
+        event, error = table.get('admin:1')[1]
+        assert isinstance(event, BusinessEvent) and event.event_type == first.event_type and event.data.new.reservation_id == first.data.new.reservation_id
+        assert isinstance(error, PolicyError) and str(error) == 'Cannot reserve'
+        calls = _count_core_runs(loaded)
+        repeated = await loaded.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10), idempotency_key='bob:1')
+        assert calls == [] and repeated.data.new.reservation_id == first.data.new.reservation_id
+        assert repeated.data.new.start_time == first.data.new.start_time and repeated.actor == first.actor
+        assert len(loaded.core.reservation_manager.get_all_reservations()) == 1
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+"""
+Optimistic concurrency: reservations are committed with no slots lock, and an operation finding its slots locked by another commit is prepared again
+(after yielding to the event loop), until it falls back to committing under the slots locks.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+import pytest
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCore, _MAX_OPTIMISTIC_ATTEMPTS
+from backend.domain_errors import AlreadyBookedError
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager
+from utils.datetimes_utils import map_datetime_to_default
+
+
+def _tomorrow(hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(hour, minute)))
+
+
+def _build_core() -> BusinessCore:
+    calendar = BusinessCalendar(slot_minutes_duration=5)
+    calendar.add_segments([Segment(_tomorrow(9), _tomorrow(13), 5)])
+    policy_manager = PolicyManager(services=[Service('haircut', 30, 30.0, '')], min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00')])
+    return BusinessCore(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15, optimistic_concurrency=True)
+
+
+def _count_prepares(core: BusinessCore) -> list:
+    prepares = []
+    prepare = core._prepare_make_reservation
+    def _counting_prepare(**kwargs):
+        outcome = prepare(**kwargs)
+        prepares.append(outcome[1].lock_free_commit if outcome[0] else None)
+        return outcome
+    core._prepare_make_reservation = _counting_prepare
+    return prepares
+
+
+def test_uncontended_commit_takes_no_lock():
+    async def run():
+        core = _build_core()
+        lock_slots = core.calendar._lock_slots
+        async def _failing_lock_slots(slots):
+            raise AssertionError('slots locked by an uncontended optimistic commit')
+        core.calendar._lock_slots = _failing_lock_slots
+        prepares = _count_prepares(core)
+        await core.make_reservation(service_name='haircut', start_time=_tomorrow(10), user='bob')
+        assert prepares == [True]
+        core.calendar._lock_slots = lock_slots
+        assert core.calendar.get_slots(_tomorrow(10), _tomorrow(10, 30))[0].is_booked()
+    asyncio.run(run())
+
+
+def test_conflicting_commit_is_prepared_again_once_the_locks_are_released():
+    async def run():
+        core = _build_core()
+        slots = core.calendar.get_slots(_tomorrow(10), _tomorrow(10, 30))
+        locks_grant = await core.calendar._lock_slots(slots)
+        prepares = _count_prepares(core)
+        task = asyncio.create_task(core.make_reservation(service_name='haircut', start_time=_tomorrow(10), user='bob'))
+        await asyncio.sleep(0)
+        assert not task.done() and prepares == [True]
+        core.calendar._unlock_slots(locks_grant)
+        event = await task
+        assert prepares == [True, True]
+        assert event.data.new.start_time == _tomorrow(10) and all(slot.is_booked() for slot in slots)
+    asyncio.run(run())
+
+
+def test_last_attempt_waits_for_the_locks():
+    async def run():
+        core = _build_core()
+        slots = core.calendar.get_slots(_tomorrow(10), _tomorrow(10, 30))
+        locks_grant = await core.calendar._lock_slots(slots)
+        prepares = _count_prepares(core)
+        task = asyncio.create_task(core.make_reservation(service_name='haircut', start_time=_tomorrow(10), user='bob'))
+        for _ in range(2 * _MAX_OPTIMISTIC_ATTEMPTS):
+            await asyncio.sleep(0)
+        assert not task.done()
+        assert prepares == [True] * _MAX_OPTIMISTIC_ATTEMPTS ## the last attempt is waiting for the locks
+        core.calendar._reserve_slots_no_lock(slots) ## the lock holder books the slots
+        core.calendar._unlock_slots(locks_grant)
+        with pytest.raises(AlreadyBookedError):
+            await task
+        assert core.reservation_manager.get_reservations_by_user('bob') == []
+    asyncio.run(run())
+
+
+def test_confirmation_changes_the_segment_version():
+    segment = Segment(_tomorrow(9), _tomorrow(10), 5)
+    segment._book_indexes([0, 1], expiry_time=_tomorrow(8))
+    version = segment._version
+    segment._set_indexes_expiry_time([0, 1], expiry_time=None)
+    assert segment._version == version + 1
@@ -0,0 +1,104 @@
+"""
+Sweep of the expired pending reservation operations: expired pending reservations are deleted, pending cancelations and updates are reverted,
+while the expiry heap entries of operations confirmed or replaced meanwhile are skipped.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCoreWithConfirmation
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager, ReservationStatus
+from utils.datetimes_utils import map_datetime_to_default
+
+
+def _tomorrow(hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(hour, minute)))
+
+
+def _build_core() -> BusinessCoreWithConfirmation:
+    calendar = BusinessCalendar(slot_minutes_duration=5)
+    calendar.add_segments([Segment(_tomorrow(9), _tomorrow(13), 5)])
+    policy_manager = PolicyManager(services=[Service('haircut', 30, 30.0, '')], min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00')])
+    return BusinessCoreWithConfirmation(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15, max_confirmation_minutes=5)
+
+
+def _after_expiry() -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.now() + timedelta(minutes=10))
+
+
+def _is_booked(core: BusinessCoreWithConfirmation, start_time: datetime.datetime) -> bool:
+    return all(slot.is_booked() for slot in core.calendar.get_slots(start_time, start_time + timedelta(minutes=30)))
+
+
+def _is_free(core: BusinessCoreWithConfirmation, start_time: datetime.datetime) -> bool:
+    return not any(slot.is_booked() for slot in core.calendar.get_slots(start_time, start_time + timedelta(minutes=30)))
+
+
+async def _make_confirmed(core: BusinessCoreWithConfirmation, user: str, start_time: datetime.datetime):
+    reservation = (await core.make_reservation(service_name='haircut', start_time=start_time, user=user)).data.new
+    await core.confirm_pending_make_reservation(reservation.reservation_id)
+    return reservation
+
+
+def test_expired_pending_make_is_deleted():
+    async def run():
+        core = _build_core()
+        reservation = (await core.make_reservation(service_name='haircut', start_time=_tomorrow(10), user='bob')).data.new
+        assert core.get_next_pending_expiry() == reservation.get_pending_status_expiration()
+        assert await core.sweep_expired_pending_reservations() == [] ## not expired yet
+        events = await core.sweep_expired_pending_reservations(curr_time=_after_expiry())
+        assert len(events) >= 1 and core.reservation_manager.get_reservation(reservation.reservation_id) is None
+        assert _is_free(core, _tomorrow(10))
+        assert core.get_next_pending_expiry() is None
+    asyncio.run(run())
+
+
+def test_expired_pending_cancel_is_reverted():
+    async def run():
+        core = _build_core()
+        reservation = await _make_confirmed(core, 'bob', _tomorrow(10))
+        await core.cancel_reservation(reservation.reservation_id)
+        assert reservation.status is ReservationStatus.PENDING_CANCELATION_STATUS
+        events = await core.sweep_expired_pending_reservations(curr_time=_after_expiry())
+        assert len(events) == 1 and reservation.status is ReservationStatus.CONFIRMED_STATUS
+        assert core.reservation_manager.get_reservation(reservation.reservation_id) is reservation and _is_booked(core, _tomorrow(10))
+    asyncio.run(run())
+
+
+def test_expired_pending_update_is_reverted():
+    async def run():
+        core = _build_core()
+        reservation = await _make_confirmed(core, 'bob', _tomorrow(10))
+        await core.update_reservation(reservation.reservation_id, new_start_time=_tomorrow(11))
+        assert reservation.status is ReservationStatus.PENDING_UPDATE_STATUS and _is_booked(core, _tomorrow(11))
+        events = await core.sweep_expired_pending_reservations(curr_time=_after_expiry())
+        assert len(events) == 1 and reservation.status is ReservationStatus.CONFIRMED_STATUS
+        assert reservation.start_time == _tomorrow(10) and _is_booked(core, _tomorrow(10)) and _is_free(core, _tomorrow(11))
+    asyncio.run(run())
+
+
+def test_stale_heap_entries_are_skipped():
+    async def run():
+        core = _build_core()
+        confirmed = (await core.make_reservation(service_name='haircut', start_time=_tomorrow(9), user='alice')).data.new
+        assert core.get_next_pending_expiry() is not None ## heap built: later operations are pushed to it
+        await core.confirm_pending_make_reservation(confirmed.reservation_id)
+        updated = await _make_confirmed(core, 'bob', _tomorrow(10))
+        await core.update_reservation(updated.reservation_id, new_start_time=_tomorrow(11))
+        await asyncio.sleep(0.01) ## the replacing update expires later than the first one
+        await core.update_reservation(updated.reservation_id, new_start_time=_tomorrow(12))
+        n_entries = len(core._pending_expiries)
+        canceled = []
+        cancel_pending_update_reservation = core.cancel_pending_update_reservation
+        async def _counting_cancel(reservation_id, actor):
+            canceled.append(reservation_id)
+            return await cancel_pending_update_reservation(reservation_id, actor=actor)
+        core.cancel_pending_update_reservation = _counting_cancel
+        events = await core.sweep_expired_pending_reservations(curr_time=_after_expiry())
+        assert canceled == [updated.reservation_id] and len(events) == 1 ## the confirmed make and the replaced update are skipped
+        assert n_entries == 4 and core._pending_expiries == [] ## 2 makes and 2 updates
+        assert confirmed.status is ReservationStatus.CONFIRMED_STATUS and updated.status is ReservationStatus.CONFIRMED_STATUS
+        assert _is_booked(core, _tomorrow(9)) and _is_booked(core, _tomorrow(10)) and _is_free(core, _tomorrow(11)) and _is_free(core, _tomorrow(12))
+    asyncio.run(run())
@@ -0,0 +1,190 @@
+"""
+Reads served while writes are in progress: each read sees a committed state (never a half done write), and each write is visible as soon as it ends,
+even while other writes are still in progress.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime, random
+from datetime import timedelta
+import pytest
+from backend.business_calendar import BusinessCalendar, Segment
+from backend.business_core import BusinessCore, BusinessCoreWithConfirmation
+from backend.domain_errors import AlreadyBookedError, ClosingTimeError, PolicyError
+from backend.multi_resource_calendar import MultiResourceCalendar
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager
+from shared.user_role import UserRole
+from utils.datetimes_utils import map_datetime_to_default
+
+SERVICES = {'haircut': 30, 'beard': 20, 'color': 45}
+
+
+class YieldingReservationManager(ReservationManager):
+    """ Yields to the event loop before each insert/remove, as a reservation manager doing I/O would: writers get suspended mid-operation. """
+    async def insert_reservation(self, reservation):
+        await asyncio.sleep(0)
+        return await super().insert_reservation(reservation)
+
+    async def remove_reservation(self, reservation_id: str):
+        await asyncio.sleep(0)
+        return await super().remove_reservation(reservation_id)
+
+
+def _at(days: int, hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=days), datetime.time(hour, minute)))
+
+
+def _build_core(core_class=BusinessCore, n_resources: int = 1, n_days: int = 1) -> BusinessCore:
+    calendar = BusinessCalendar(5) if n_resources == 1 else MultiResourceCalendar(n_resources=n_resources, slot_minutes_duration=5)
+    calendar.add_segments([Segment(_at(day, 9), _at(day, 13), 5) for day in range(1, n_days+1)] + [Segment(_at(day, 15), _at(day, 20), 5) for day in range(1, n_days+1)])
+    services = [Service(service_name, 10, float(minutes_duration), '') for service_name, minutes_duration in SERVICES.items()]
+    policy_manager = PolicyManager(services=services, min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00'),('15:00','20:00')])
+    return core_class(reservation_manager=YieldingReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15)
+
+
+def _available_start_times(core: BusinessCore) -> list[str]:
+    return core.get_available_datetimes('haircut', _at(1, 9), _at(1, 19), minutes_duration=30).data.new[0]
+
+
+def _user_reservation_ids(core: BusinessCore, user: str) -> list[str]:
+    return [reservation.reservation_id for reservation in core.get_user_reservations(user).data.new]
+
+
+@pytest.mark.parametrize('core_class', [BusinessCore, BusinessCoreWithConfirmation])
+@pytest.mark.parametrize('n_resources', [1, 2])
+def test_ended_write_is_visible_while_another_write_is_blocked(core_class, n_resources):
+    async def run():
+        core = _build_core(core_class, n_resources)
+        await core.make_reservation('haircut', _at(1, 9), 'carl', actor=UserRole.ADMIN)
+        locks_grant = await core.calendar._lock_slots(core.calendar.get_slots(_at(1, 10), _at(1, 10, 30), same_segment_only=True))
+        blocked = asyncio.ensure_future(core.make_reservation('haircut', _at(1, 10), 'alice', actor=UserRole.ADMIN))
+        await asyncio.sleep(0)
+        assert not blocked.done() and core._writes_in_progress == 1
+
+        bob_reservation = (await core.make_reservation('haircut', _at(1, 11), 'bob', actor=UserRole.ADMIN)).data.new
+        assert core._writes_in_progress == 1
+        assert _user_reservation_ids(core, 'bob') == [bob_reservation.reservation_id]
+        assert _user_reservation_ids(core, 'alice') == []
+        assert sorted(r.user for r in core.get_all_reservations().data.new) == ['bob', 'carl']
+        assert [r.user for r in core.get_daily_reservations(_at(1, 9).date()).data.new] == ['carl', 'bob']
+        if n_resources == 1:
+            assert str(_at(1, 11)) not in _available_start_times(core) and str(_at(1, 10)) in _available_start_times(core)
+
+        await core.cancel_reservation(bob_reservation.reservation_id, actor=UserRole.ADMIN)
+        assert _user_reservation_ids(core, 'bob') == [] and str(_at(1, 11)) in _available_start_times(core)
+
+        core.calendar._unlock_slots(locks_grant)
+        alice_reservation = (await blocked).data.new
+        assert core._writes_in_progress == 0
+        assert _user_reservation_ids(core, 'alice') == [alice_reservation.reservation_id]
+        if n_resources == 1:
+            assert str(_at(1, 10)) not in _available_start_times(core)
+    asyncio.run(run())
+
+
+def test_half_done_write_is_not_visible():
+    async def run():
+        core = _build_core()
+        reservation = (await core.make_reservation('haircut', _at(1, 10), 'bob', actor=UserRole.ADMIN)).data.new
+        before = (_available_start_times(core), _user_reservation_ids(core, 'bob'))
+        update = asyncio.ensure_future(core.update_reservation(reservation.reservation_id, new_start_time=_at(1, 16), actor=UserRole.ADMIN))
+        while not update.done():
+            await asyncio.sleep(0)
+            if not update.done():
+                assert (_available_start_times(core), _user_reservation_ids(core, 'bob')) == before
+        new_reservation = (await update).data.new
+        assert _user_reservation_ids(core, 'bob') == [new_reservation.reservation_id] and str(_at(1, 10)) in _available_start_times(core)
+    asyncio.run(run())
+
+
+def test_calendar_change_ended_while_another_write_is_in_progress():
+    """ A write replacing calendar segments is not published alone: the reads keep the previous state, the writes ending after it included, until no write is in progress. """
+    async def run():
+        core = _build_core(n_days=1)
+        closed_day_hours = core.get_daily_opening_hours(_at(3, 9).date()).data.new
+        calendar_changed, release_calendar_write = asyncio.Event(), asyncio.Event()
+        async def calendar_write():
+            write_log = core._begin_write()
+            try:
+                core.calendar.add_segment(Segment(_at(2, 9), _at(2, 13), 5))
+                calendar_changed.set()
+                await release_calendar_write.wait()
+            finally:
+                core._end_write(write_log)
+        pending_calendar_write = asyncio.ensure_future(calendar_write())
+        await calendar_changed.wait()
+        bob_reservation = (await core.make_reservation('haircut', _at(1, 11), 'bob', actor=UserRole.ADMIN)).data.new
+        assert _user_reservation_ids(core, 'bob') == [bob_reservation.reservation_id] ## not depending on the pending calendar change
+        assert core.get_daily_opening_hours(_at(2, 9).date()).data.new == closed_day_hours
+
+        locks_grant = await core.calendar._lock_slots(core.calendar.get_slots(_at(1, 10), _at(1, 10, 30), same_segment_only=True))
+        blocked = asyncio.ensure_future(core.make_reservation('haircut', _at(1, 10), 'alice', actor=UserRole.ADMIN))
+        release_calendar_write.set()
+        await pending_calendar_write
+        assert core._writes_in_progress == 1 and core.get_daily_opening_hours(_at(2, 9).date()).data.new == closed_day_hours
+        carl_reservation = (await core.make_reservation('haircut', _at(2, 10), 'carl', actor=UserRole.ADMIN)).data.new
+        assert _user_reservation_ids(core, 'carl') == [] and _user_reservation_ids(core, 'bob') == [bob_reservation.reservation_id]
+
+        core.calendar._unlock_slots(locks_grant)
+        await blocked
+        assert _user_reservation_ids(core, 'carl') == [carl_reservation.reservation_id] and len(_user_reservation_ids(core, 'alice')) == 1
+        assert core.get_daily_opening_hours(_at(2, 9).date()).data.new != closed_day_hours
+    asyncio.run(run())
+
+
+def _check_read(core: BusinessCore, n_users: int):
+    """ A committed state has exactly one reservation by user, whose slots are the only booked ones: anything else comes from a half done write. """
+    reservations = core.get_all_reservations().data.new
+    calendar, _ = core._get_read_view()
+    resource_calendars = getattr(calendar, 'resources', [calendar])
+    n_booked_slots = sum(segment.n_slots - segment._n_free_slots for resource_calendar in resource_calendars for segment in resource_calendar.segments)
+    assert len(reservations) == n_users and len({r.user for r in reservations}) == n_users
+    assert n_booked_slots == sum((r.end_time - r.start_time) // timedelta(minutes=calendar.slot_minutes_duration) for r in reservations)
+
+
+@pytest.mark.parametrize('n_resources', [1, 3])
+def test_concurrent_readers_and_writers(n_resources):
+    """ Writers moving the users reservations, readers checking each read is a committed state: each writer reads its own update as soon as it ends. """
+    n_users, n_writers, n_readers, n_updates = 40, 8, 4, 25
+    async def run():
+        core, rnd = _build_core(n_resources=n_resources, n_days=6), random.Random(0)
+        start_times = [segment.start_time + timedelta(minutes=15*i) for segment in core.calendar.segments for i in range(int((segment.end_time - segment.start_time) / timedelta(minutes=15)) - 3)]
+        reservation_ids = {}
+        assert len(start_times[::4]) >= n_users
+        for user_idx, start_time in enumerate(start_times[::4][:n_users]):
+            reservation_ids[f'user_{user_idx}'] = (await core.make_reservation(rnd.choice(list(SERVICES)), start_time, f'user_{user_idx}', actor=UserRole.ADMIN)).data.new.reservation_id
+        users = list(reservation_ids)
+        outcomes = {'updates': 0, 'reads': 0, 'reads_during_writes': 0, 'own_updates_read_during_writes': 0}
+        writers_done = asyncio.Event()
+
+        async def writer(writer_users: list[str], writer_rnd: random.Random):
+            for _ in range(n_updates):
+                user = writer_rnd.choice(writer_users)
+                new_start_time = writer_rnd.choice([start_time for start_time in start_times if start_time != core.reservation_manager.get_reservation(reservation_ids[user]).start_time])
+                try:
+                    event = await core.update_reservation(reservation_ids[user], new_start_time=new_start_time, actor=UserRole.ADMIN)
+                except (AlreadyBookedError, ClosingTimeError, PolicyError): ## e.g. the new time is already booked, or the service ends after closing time
+                    continue
+                reservation_ids[user] = event.data.new.reservation_id
+                outcomes['updates'] += 1
+                assert _user_reservation_ids(core, user) == [reservation_ids[user]]
+                outcomes['own_updates_read_during_writes'] += core._writes_in_progress > 0
+
+        async def reader():
+            while not writers_done.is_set():
+                _check_read(core, n_users)
+                outcomes['reads'] += 1
+                outcomes['reads_during_writes'] += core._writes_in_progress > 0
+                await asyncio.sleep(0)
+
+        async def writers():
+            await asyncio.gather(*[writer(users[i::n_writers], random.Random(i)) for i in range(n_writers)])
+            writers_done.set()
+        await asyncio.gather(writers(), *[reader() for _ in range(n_readers)])
+        _check_read(core, n_users)
+        assert sorted(r.reservation_id for r in core.get_all_reservations().data.new) == sorted(reservation_ids.values())
+        return outcomes
+
+    outcomes = asyncio.run(run())
+    assert outcomes['updates'] > 2 * n_writers
+    assert outcomes['reads_during_writes'] > 0 and outcomes['own_updates_read_during_writes'] > 0
@@ -0,0 +1,63 @@
+"""
+ReservationArchive (the cold tier of the evicted reservations) and the include_archived lookups of ReservationManager:
+a reservation both archived and held in memory, or archived twice, is returned once.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+from application.storing_manager import ReservationArchive
+from backend.reservations import Reservation, ReservationManager
+from utils.datetimes_utils import map_datetime_to_default
+
+START = map_datetime_to_default(datetime.datetime(2030, 1, 7, 10, 0))
+
+
+def _reservation(reservation_id: str, user: str = 'u1', hours: int = 0) -> Reservation:
+    return Reservation(reservation_id, user, START + timedelta(hours=hours), START + timedelta(hours=hours, minutes=30), 'haircut')
+
+
+def _ids(reservations: list[Reservation]) -> list[str]:
+    return [reservation.reservation_id for reservation in reservations]
+
+
+def test_lookups_read_back_the_archived_reservations(tmp_path):
+    archive = ReservationArchive(tmp_path / 'archive.jsonl')
+    archive.append([_reservation('r1'), _reservation('r2', user='u2', hours=1), _reservation('r3', hours=2)])
+    assert len(archive) == 3
+    assert archive.get_reservation('r2').user == 'u2' and archive.get_reservation('missing') is None
+    assert _ids(archive.get_reservations_by_user('u1')) == ['r1', 'r3']
+    assert _ids(ReservationArchive(tmp_path / 'archive.jsonl').get_all_reservations()) == ['r1', 'r2', 'r3'] ## index rebuilt from the file
+
+
+def test_rearchiving_is_a_noop(tmp_path):
+    archive = ReservationArchive(tmp_path / 'archive.jsonl')
+    archive.append([_reservation('r1'), _reservation('r2', hours=1)])
+    file_size = (tmp_path / 'archive.jsonl').stat().st_size
+    archive.append([_reservation('r1'), _reservation('r1'), _reservation('r2', hours=1)])
+    assert (tmp_path / 'archive.jsonl').stat().st_size == file_size
+    archive.append([_reservation('r1'), _reservation('r3', hours=2)])
+    assert len(archive) == 3
+    assert _ids(archive.get_reservations_by_user('u1')) == ['r1', 'r2', 'r3']
+    assert _ids(archive.get_all_reservations()) == ['r1', 'r2', 'r3']
+
+
+def test_file_with_duplicate_records_is_indexed_once(tmp_path):
+    filepath = tmp_path / 'archive.jsonl'
+    ReservationArchive(filepath).append([_reservation('r1'), _reservation('r2', hours=1)])
+    filepath.write_bytes(filepath.read_bytes() * 2) ## as written by a previous version re-archiving the same reservations
+    archive = ReservationArchive(filepath)
+    assert len(archive) == 2
+    assert _ids(archive.get_reservations_by_user('u1')) == ['r1', 'r2']
+    assert _ids(archive.get_all_reservations()) == ['r1', 'r2']
+
+
+def test_manager_lookups_do_not_repeat_live_reservations_also_archived(tmp_path):
+    manager = ReservationManager()
+    manager.archive = ReservationArchive(tmp_path / 'archive.jsonl')
+    manager.archive.append([_reservation('r1'), _reservation('r0', hours=-24)])
+    asyncio.run(manager.insert_reservation(_reservation('r1'))) ## e.g. reloaded from a checkpoint taken before its eviction
+    asyncio.run(manager.insert_reservation(_reservation('r2', hours=1)))
+    assert _ids(manager.get_reservations_by_user('u1', include_archived=True)) == ['r0', 'r1', 'r2']
+    assert _ids(manager.get_all_reservations(include_archived=True)) == ['r0', 'r1', 'r2']
+    assert _ids(manager.get_reservations_by_user('u1')) == ['r1', 'r2']
@@ -0,0 +1,162 @@
+"""
+ReservationManager lookups by user, date, service and status, and the consistency of its indexes through insertions, removals, status changes and evictions.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from collections import defaultdict
+from datetime import timedelta
+import pytest
+from backend.reservations import Reservation, ReservationManager, ReservationStatus
+from utils.datetimes_utils import map_datetime_to_default, to_epoch_minutes
+
+DAY = datetime.date(2030, 1, 7)
+
+
+def _at(days: int, hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(DAY + timedelta(days=days), datetime.time(hour, minute)))
+
+
+def _reservation(reservation_id: str, user: str, start_time: datetime.datetime, minutes: int = 30, service_name: str = 'haircut', status: ReservationStatus = ReservationStatus.CONFIRMED_STATUS) -> Reservation:
+    return Reservation(reservation_id, user, start_time, start_time + timedelta(minutes=minutes), service_name, status=status)
+
+
+RESERVATIONS = [('r1', 'bob', (0, 10), 30, 'haircut'), ('r2', 'alice', (0, 10), 30, 'beard'), ('r3', 'bob', (0, 9), 60, 'beard'),
+                ('r4', 'carl', (1, 15), 30, 'haircut'), ('r5', 'bob', (1, 11, 30), 45, 'haircut'), ('r6', 'alice', (2, 9), 30, 'haircut')]
+
+
+def _build_manager() -> ReservationManager:
+    manager = ReservationManager()
+    async def insert_all():
+        for reservation_id, user, start, minutes, service_name in RESERVATIONS:
+            await manager.insert_reservation(_reservation(reservation_id, user, _at(*start), minutes, service_name))
+    asyncio.run(insert_all())
+    return manager
+
+
+def _ids(reservations: list[Reservation]) -> list[str]:
+    return [reservation.reservation_id for reservation in reservations]
+
+
+def _assert_indexes_consistent(manager: ReservationManager):
+    """ Every index equals the one rebuilt from scratch from reservations_id_mappings, with no empty entries left. """
+    by_user, by_date, by_service, by_status, by_user_start, by_user_service = (defaultdict(set) for _ in range(6))
+    for reservation_id, reservation in manager.reservations_id_mappings.items():
+        start_minute = to_epoch_minutes(reservation.start_time)
+        by_user[reservation.user].add(reservation_id)
+        by_date[reservation.start_time.date()].add((start_minute, reservation_id))
+        by_service[reservation.service_name].add(reservation_id)
+        by_status[reservation.status].add(reservation_id)
+        by_user_start[(reservation.user, start_minute)].add(reservation_id)
+        by_user_service[(reservation.user, reservation.service_name)].add(reservation_id)
+    assert dict(manager.reservations_by_user) == by_user
+    assert {date: {(start_minute, res_id) for start_minute, ids in daily.items() for res_id in ids} for date, daily in manager.reservations_by_date.items()} == by_date
+    assert all(ids for daily in manager.reservations_by_date.values() for ids in daily.values())
+    assert {service: ids for service, ids in manager.reservations_by_service.items() if ids} == by_service
+    assert {status: ids for status, ids in manager.reservations_by_status.items() if ids} == by_status
+    assert dict(manager.reservations_by_user_start) == by_user_start
+    assert {key: ids for key, ids in manager.reservations_by_user_service.items() if ids} == by_user_service
+    assert manager._sorted_dates == sorted(by_date)
+    assert {date: minutes for date, minutes in manager._daily_start_minutes.items()} == {date: sorted({m for m, _ in entries}) for date, entries in by_date.items()}
+    assert dict(manager._user_start_minutes) == {user: sorted({m for u, m in by_user_start if u == user}) for user in by_user}
+    assert manager._end_minutes == {res_id: to_epoch_minutes(r.end_time) for res_id, r in manager.reservations_id_mappings.items()}
+    durations = sorted(to_epoch_minutes(r.end_time) - to_epoch_minutes(r.start_time) for r in manager.reservations_id_mappings.values())
+    assert manager._sorted_durations == durations and manager._max_duration_minutes == (durations[-1] if durations else 0)
+
+
+def test_get_reservations_by_user_sorted_by_start_time():
+    manager = _build_manager()
+    assert _ids(manager.get_reservations_by_user('bob')) == ['r3', 'r1', 'r5']
+    assert _ids(manager.get_reservations_by_user('alice')) == ['r2', 'r6']
+    assert manager.get_reservations_by_user('nobody') == []
+
+
+def test_get_reservations_by_date_matches_the_day_reservations():
+    manager = _build_manager()
+    first_day = manager.get_reservations_by_date(_at(0, 9).date())
+    assert _ids(first_day[:1]) == ['r3'] and sorted(_ids(first_day[1:])) == ['r1', 'r2']
+    assert _ids(manager.get_reservations_by_date(_at(1, 9).date())) == ['r5', 'r4']
+    assert _ids(manager.get_reservations_by_date(_at(2, 9).date())) == ['r6']
+    assert manager.get_reservations_by_date(_at(5, 9).date()) == []
+
+
+def test_get_reservations_by_service_and_status():
+    manager = _build_manager()
+    assert sorted(_ids(manager.get_reservations_by_service('haircut'))) == ['r1', 'r4', 'r5', 'r6']
+    assert sorted(_ids(manager.get_reservations_by_service('beard'))) == ['r2', 'r3']
+    assert manager.get_reservations_by_service('massage') == []
+    assert sorted(_ids(manager.get_reservations_by_status(ReservationStatus.CONFIRMED_STATUS))) == ['r1', 'r2', 'r3', 'r4', 'r5', 'r6']
+    assert manager.get_reservations_by_status(ReservationStatus.PENDING_CONFIRMATION_STATUS) == []
+    _assert_indexes_consistent(manager)
+
+
+def test_indexes_after_insert_and_remove():
+    manager = _build_manager()
+    async def run():
+        await manager.insert_reservation(_reservation('r7', 'bob', _at(0, 10), 30, 'beard'))
+        _assert_indexes_consistent(manager)
+        assert sorted(_ids(manager.get_reservations_by_start_time(_at(0, 10)))) == ['r1', 'r2', 'r7']
+        for reservation_id in ['r1', 'r4', 'r6']:
+            removed = await manager.remove_reservation(reservation_id)
+            assert removed.reservation_id == reservation_id
+            _assert_indexes_consistent(manager)
+        with pytest.raises(KeyError):
+            await manager.remove_reservation('r1')
+        with pytest.raises(KeyError):
+            await manager.insert_reservation(_reservation('r2', 'alice', _at(3, 10)))
+    asyncio.run(run())
+    assert _ids(manager.get_reservations_by_user('bob')) == ['r3', 'r7', 'r5']
+    assert manager.get_reservations_by_user('carl') == [] and 'carl' not in manager.reservations_by_user
+    assert manager.get_reservations_by_date(_at(2, 9).date()) == [] and _at(2, 9).date() not in manager._sorted_dates
+    assert sorted(_ids(manager.get_reservations_by_service('haircut'))) == ['r5']
+
+
+def test_status_index_follows_status_changes():
+    manager = _build_manager()
+    reservation = manager.get_reservation('r1')
+    reservation.mark_as_pending_delete()
+    assert _ids(manager.get_reservations_by_status(ReservationStatus.PENDING_CANCELATION_STATUS)) == ['r1']
+    assert 'r1' not in _ids(manager.get_reservations_by_status(ReservationStatus.CONFIRMED_STATUS))
+    _assert_indexes_consistent(manager)
+    reservation.mark_as_pending_update(_reservation('r1b', 'bob', _at(0, 11)))
+    reservation.mark_as_deleted()
+    assert _ids(manager.get_reservations_by_status(ReservationStatus.DELETED_STATUS)) == ['r1']
+    _assert_indexes_consistent(manager)
+    reservation.copy().mark_as_confirmed() ## copies are not tracked by the manager
+    assert _ids(manager.get_reservations_by_status(ReservationStatus.DELETED_STATUS)) == ['r1']
+    removed = asyncio.run(manager.remove_reservation('r1'))
+    removed.mark_as_confirmed() ## removed reservations are not tracked anymore
+    assert manager.get_reservations_by_status(ReservationStatus.DELETED_STATUS) == []
+    _assert_indexes_consistent(manager)
+
+
+def test_evict_reservations_before():
+    manager = _build_manager()
+    to_evict = manager.get_reservations_ended_before(_at(1, 12))
+    _assert_indexes_consistent(manager)
+    evicted = asyncio.run(manager.evict_reservations_before(_at(1, 12)))
+    assert _ids(evicted) == _ids(to_evict)
+    assert _ids(evicted[:1]) == ['r3'] and sorted(_ids(evicted[1:])) == ['r1', 'r2']
+    _assert_indexes_consistent(manager)
+    assert sorted(manager.reservations_id_mappings) == ['r4', 'r5', 'r6'] ## r5 ends at 12:15
+    assert _ids(manager.get_reservations_by_user('bob')) == ['r5']
+    assert manager.get_reservations_by_date(_at(0, 9).date()) == []
+    evicted = asyncio.run(manager.evict_reservations_before(_at(1, 12, 15)))
+    assert _ids(evicted) == ['r5']
+    _assert_indexes_consistent(manager)
+    assert asyncio.run(manager.evict_reservations_before(_at(1, 12, 15))) == []
+
+
+def test_lookback_shrinks_when_the_longest_reservation_is_removed():
+    manager = _build_manager()
+    async def run():
+        await manager.insert_reservation(_reservation('r7', 'bob', _at(3, 9), 3 * 24 * 60, 'beard'))
+        assert manager._max_duration_minutes == 3 * 24 * 60
+        await manager.remove_reservation('r7')
+        assert manager._max_duration_minutes == 60
+        _assert_indexes_consistent(manager)
+        await manager.evict_reservations_before(_at(0, 23))
+        assert manager._max_duration_minutes == 45 ## r3 (60 minutes) evicted
+        _assert_indexes_consistent(manager)
+        assert _ids(manager.get_user_reservations_at('bob', _at(1, 12))) == ['r5']
+    asyncio.run(run())
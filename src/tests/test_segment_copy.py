@@ -0,0 +1,160 @@
+"""
+Segment copies (copy, join, get_subsegment) are copy-on-write: bookings, releases and expiries applied to either side after the copy must not leak into the other.
+Run from the src directory:
+    python -m pytest tests
+"""
+import datetime
+from datetime import timedelta
+import pytest
+from backend.business_calendar import Segment, BusinessCalendar, Slot
+
+START = datetime.datetime(2030, 1, 7, 9, 0, tzinfo=datetime.timezone.utc)
+EXPIRY = START - timedelta(hours=1)
+
+
+def _state(segment: Segment) -> tuple:
+    return (segment.start_time, segment.end_time, segment.n_slots, segment._booked, dict(segment._expiries), list(segment._free_intervals), segment._n_free_slots, segment._max_free_run)
+
+
+def _segment(hours: int = 2, start_time: datetime.datetime = START, booked: list[int] = (), pending: list[int] = ()) -> Segment:
+    """ A segment with the booked slots indexes, and the pending (expiring) ones. """
+    segment = Segment(start_time, start_time + timedelta(hours=hours), 5)
+    if booked:
+        segment._book_indexes(list(booked))
+    if pending:
+        segment._book_indexes(list(pending), EXPIRY)
+    return segment
+
+
+def _assert_consistent(segment: Segment):
+    assert segment._free_intervals == segment._scan_free_intervals()
+    assert segment._n_free_slots == segment.n_slots - bin(segment._booked).count('1')
+    assert segment._max_free_run == max((e-s for s, e in segment._free_intervals), default=0)
+
+
+def _reserve(segment: Segment):
+    segment._book_indexes([3, 4, 5])
+
+def _reserve_pending(segment: Segment):
+    segment._book_indexes([6, 7], EXPIRY + timedelta(hours=3))
+
+def _free(segment: Segment):
+    segment._free_indexes([0, 1])
+
+def _set_expiry(segment: Segment):
+    Slot(segment, 0)._booking_expires_at = EXPIRY
+
+def _clear_expired(segment: Segment):
+    segment._clear_expired(curr_time=START)
+
+MUTATIONS = [_reserve, _reserve_pending, _free, _set_expiry, _clear_expired]
+
+
+@pytest.mark.parametrize('mutate', MUTATIONS)
+@pytest.mark.parametrize('untouched', [False, True], ids=['booked', 'untouched'])
+def test_copy_mutations_do_not_leak_into_original(mutate, untouched):
+    original = _segment() if untouched else _segment(booked=[0, 1, 2], pending=[10, 11])
+    before = _state(original)
+    copied = original.copy()
+    mutate(copied)
+    assert _state(original) == before
+    _assert_consistent(copied)
+
+
+@pytest.mark.parametrize('mutate', MUTATIONS)
+@pytest.mark.parametrize('untouched', [False, True], ids=['booked', 'untouched'])
+def test_original_mutations_do_not_leak_into_copy(mutate, untouched):
+    original = _segment() if untouched else _segment(booked=[0, 1, 2], pending=[10, 11])
+    copied = original.copy()
+    before = _state(copied)
+    mutate(original)
+    assert _state(copied) == before
+    _assert_consistent(original)
+
+
+@pytest.mark.parametrize('mutate', MUTATIONS)
+def test_copies_of_copies_are_isolated(mutate):
+    original = _segment(booked=[0, 1, 2], pending=[10, 11])
+    first_copy = original.copy()
+    second_copy = first_copy.copy()
+    before = _state(original)
+    mutate(first_copy)
+    assert _state(original) == before and _state(second_copy) == before
+
+
+def test_expired_bookings_cleared_only_on_the_cleared_side():
+    original = _segment(booked=[0], pending=[10, 11])
+    copied = original.copy()
+    copied._clear_expired(curr_time=START)
+    assert not copied._is_index_booked(10) and not copied._expiries
+    assert original._is_index_booked(10) and original._expiries == {10: EXPIRY, 11: EXPIRY}
+    original._clear_expired(curr_time=START)
+    assert not original._expiries and copied._is_index_booked(0) and original._is_index_booked(0)
+
+
+@pytest.mark.parametrize('mutate', MUTATIONS)
+@pytest.mark.parametrize('backward', [False, True], ids=['forward', 'backward'])
+def test_join_is_isolated_from_its_segments(mutate, backward):
+    first = _segment(booked=[0, 1, 2], pending=[10, 11])
+    second = _segment(start_time=first.end_time, booked=[0, 1, 2], pending=[20])
+    joined = second.join(first) if backward else first.join(second)
+    _assert_consistent(joined)
+    joined_before, first_before, second_before = _state(joined), _state(first), _state(second)
+    mutate(joined)
+    assert _state(first) == first_before and _state(second) == second_before
+    _assert_consistent(joined)
+    joined = second.join(first) if backward else first.join(second)
+    mutate(first)
+    mutate(second)
+    assert _state(joined) == joined_before
+
+
+@pytest.mark.parametrize('mutate', MUTATIONS)
+def test_join_of_untouched_segments_is_isolated(mutate):
+    first, second = _segment(), _segment(start_time=START + timedelta(hours=2))
+    joined = first.join(second)
+    mutate(joined)
+    assert _state(first) == _state(_segment()) and _state(second) == _state(_segment(start_time=START + timedelta(hours=2)))
+
+
+@pytest.mark.parametrize('mutate', MUTATIONS)
+def test_subsegment_is_isolated_from_its_segment(mutate):
+    segment = _segment(booked=[0, 1, 2, 8], pending=[10, 11])
+    subsegment = segment.get_subsegment(START, START + timedelta(hours=1))
+    _assert_consistent(subsegment)
+    segment_before, subsegment_before = _state(segment), _state(subsegment)
+    mutate(subsegment)
+    assert _state(segment) == segment_before
+    _assert_consistent(subsegment)
+    subsegment = segment.get_subsegment(START, START + timedelta(hours=1))
+    mutate(segment)
+    assert _state(subsegment) == subsegment_before
+
+
+def test_inner_subsegment_shifts_bookings_and_expiries():
+    segment = _segment(booked=[12, 13], pending=[14])
+    subsegment = segment.get_subsegment(START + timedelta(hours=1), START + timedelta(hours=2))
+    assert subsegment.n_slots == 12 and subsegment._expiries == {2: EXPIRY}
+    assert [i for i in range(subsegment.n_slots) if subsegment._is_index_booked(i)] == [0, 1, 2]
+    subsegment._free_indexes([0, 1, 2])
+    assert segment._is_index_booked(12) and segment._expiries == {14: EXPIRY}
+
+
+def test_whole_subsegment_is_a_copy():
+    segment = _segment(booked=[0], pending=[1])
+    subsegment = segment.get_subsegment(segment.start_time, segment.end_time)
+    assert subsegment is not segment and _state(subsegment) == _state(segment)
+    subsegment._free_indexes([0, 1])
+    assert segment._is_index_booked(0) and segment._expiries == {1: EXPIRY}
+
+
+def test_calendar_copy_is_isolated():
+    calendar = BusinessCalendar(5)
+    calendar.add_segments([_segment(booked=[0], pending=[5]), _segment(start_time=START + timedelta(days=1))])
+    before = [_state(segment) for segment in calendar.segments]
+    copied = calendar.copy()
+    copied._reserve_slots_no_lock([Slot(copied.segments[1], 0)], EXPIRY)
+    copied._free_slots_no_lock([Slot(copied.segments[0], 0)])
+    assert [_state(segment) for segment in calendar.segments] == before
+    calendar._free_slots_no_lock([Slot(calendar.segments[0], 5)])
+    assert copied.segments[0]._expiries == {5: EXPIRY} and copied.segments[0]._is_index_booked(5)
@@ -0,0 +1,87 @@
+"""
+On calendars with several resources, the same user cannot hold overlapping active reservations, even if another resource is free at the requested time.
+Run from the src directory:
+    python -m pytest tests
+"""
+import asyncio, datetime
+from datetime import timedelta
+import pytest
+from backend.booking_service import BookingService
+from backend.business_calendar import Segment
+from backend.business_core import BusinessCoreWithConfirmation
+from backend.domain_errors import PolicyError
+from backend.multi_resource_calendar import MultiResourceCalendar
+from backend.policy import PolicyManager, Service
+from backend.reservations import ReservationManager
+from shared.user_role import UserRole
+from utils.datetimes_utils import map_datetime_to_default
+
+
+def _tomorrow(hour: int, minute: int = 0) -> datetime.datetime:
+    return map_datetime_to_default(datetime.datetime.combine(datetime.date.today() + timedelta(days=1), datetime.time(hour, minute)))
+
+
+def _build_service(n_resources: int = 3) -> BookingService:
+    calendar = MultiResourceCalendar(n_resources=n_resources, slot_minutes_duration=5)
+    calendar.add_segments([Segment(_tomorrow(9), _tomorrow(13), 5)])
+    policy_manager = PolicyManager(services=[Service('haircut', 18, 30.0, ''), Service('beard', 10, 20.0, '')], min_advance_booking_minutes=0, min_advance_cancelation_minutes=0, opening_hours=[('09:00','13:00')])
+    return BookingService(BusinessCoreWithConfirmation(reservation_manager=ReservationManager(), calendar=calendar, policy_manager=policy_manager, default_grid_minutes=15))
+
+
+@pytest.mark.parametrize('start_time, service_name', [(_tomorrow(10), 'haircut'), (_tomorrow(10, 15), 'beard'), (_tomorrow(9, 45), 'haircut')], ids=['same', 'inner', 'partial'])
+def test_retried_make_reservation_is_rejected(start_time, service_name):
+    async def run():
+        service = _build_service()
+        first = (await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10), idempotency_key='bob:1')).data.new
+        with pytest.raises(PolicyError):
+            await service.make_reservation(user='bob', service_name=service_name, start_time=start_time, idempotency_key='bob:2')
+        assert service.core.reservation_manager.get_reservations_by_user('bob') == [first]
+        assert service.find_reservation(user='bob', start_time=_tomorrow(10)) is first
+        await service.finalize_make_reservation('confirm', user='bob', start_time=_tomorrow(10))
+        assert first.is_confirmed
+    asyncio.run(run())
+
+
+def test_other_users_and_adjacent_times_are_allowed():
+    async def run():
+        service = _build_service()
+        await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10))
+        await service.make_reservation(user='alice', service_name='haircut', start_time=_tomorrow(10))
+        await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10, 30))
+        await service.make_reservation(user='bob', service_name='beard', start_time=_tomorrow(9, 30))
+        assert len(service.core.reservation_manager.get_reservations_by_user('bob')) == 3
+    asyncio.run(run())
+
+
+def test_canceled_reservation_does_not_block_rebooking():
+    async def run():
+        service = _build_service()
+        await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10))
+        await service.cancel_reservation(user='bob', start_time=_tomorrow(10))
+        assert (await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10))).data.new.user == 'bob'
+    asyncio.run(run())
+
+
+def test_update_onto_another_own_reservation_is_rejected():
+    async def run():
+        service = _build_service()
+        await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(10))
+        await service.make_reservation(user='bob', service_name='haircut', start_time=_tomorrow(11))
+        with pytest.raises(PolicyError):
+            await service.update_reservation(user='bob', existing_reservation_start_time=_tomorrow(11), new_start_time=_tomorrow(10, 15))
+        event = await service.update_reservation(user='bob', existing_reservation_start_time=_tomorrow(11), new_start_time=_tomorrow(11, 15))
+        assert event.data.new.start_time == _tomorrow(11, 15)
+    asyncio.run(run())
+
+
+def test_bulk_rejects_overlapping_requests_of_the_same_user():
+    async def run():
+        core = _build_service().core
+        bookings = [{'service_name': 'haircut', 'start_time': _tomorrow(10), 'user': 'bob'}, {'service_name': 'beard', 'start_time': _tomorrow(10, 15), 'user': 'bob'},
+                    {'service_name': 'haircut', 'start_time': _tomorrow(10), 'user': 'alice'}]
+        results = await core.make_reservations_bulk(bookings, actor=UserRole.ADMIN, all_or_nothing=False)
+        assert isinstance(results[1], PolicyError) and not isinstance(results[0], Exception) and not isinstance(results[2], Exception)
+        with pytest.raises(PolicyError):
+            await core.make_reservations_bulk([{'service_name': 'haircut', 'start_time': _tomorrow(12), 'user': 'carl'}, {'service_name': 'haircut', 'start_time': _tomorrow(12), 'user': 'carl'}])
+        assert not core.reservation_manager.get_reservations_by_user('carl')
+    asyncio.run(run())
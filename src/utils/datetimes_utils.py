@@ -34,6 +34,18 @@ def map_datetime_to_default(ts: dt.datetime, ignore_seconds: bool = False, map_t
         ts = to_default_tz(ts, replace_tz_only=False)
     return ts
 
+def to_epoch_minutes(ts: dt.datetime) -> int|float:
+    """
+    Returns the minutes elapsed since epoch (UTC) at ts: an int for whole minutes times, a float otherwise.
+    Naive datetimes are taken as local times (as astimezone does). Used as internal time key, with no timezone conversion.
+    """
+    seconds = ts.timestamp()
+    return int(seconds) // 60 if not seconds % 60 else seconds / 60
+
+def from_epoch_minutes(minutes: int|float, tz: dt.tzinfo = None) -> dt.datetime:
+    """ Inverse of to_epoch_minutes: returns the datetime (in the business timezone if tz is not given) at the given minutes since epoch. """
+    return dt.datetime.fromtimestamp(minutes * 60, tz=tz or get_business_timezone())
+
 def validate_hhmm(time_str):
     try:
         dt.datetime.strptime(time_str, "%H:%M")
@@ -0,0 +1,103 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+def _ranges_to_masks(ranges: list[tuple]) -> dict:
+    """ Maps the (key, start, end) half-open ranges to a bitmask of the covered positions by key. """
+    masks = {}
+    for key, start, end in ranges:
+        if start < end:
+            masks[key] = masks.get(key, 0) | (((1 << (end - start)) - 1) << start)
+    return masks
+
+
+class RangeLockGrant:
+    __slots__ = ('masks', 'waiters')
+
+    def __init__(self, masks: dict):
+        self.masks = masks
+        self.waiters = [] ## (masks, future) of the requests waiting for this grant to be released
+
+
+class RangeLockManager:
+    """
+    Grants exclusive locks on half-open integer ranges [start, end) of hashable keys (e.g. a calendar segment and a range of its slot indexes).
+    Held positions are kept as a bitmask by key, so that conflicts are detected with a single AND by key.
+    A request made of several ranges is granted all at once or not at all, so holders never wait for further ranges while holding some:
+    no deadlock can arise, whatever the order of the ranges.
+    A conflicting request waits on (one of) the grants it overlaps with: when such grant is released, the request is either granted straight away
+    or moved to the next grant it still overlaps with, so no request is woken up just to find its ranges still locked.
+    """
+    def __init__(self):
+        self._held = {} ## key -> bitmask of the locked positions
+        self._grants_by_key = {} ## key -> list of the active grants on such key
+
+    def _find_conflicting_grant(self, masks: dict) -> RangeLockGrant:
+        """ Returns the most recent active grant overlapping the masks (i.e. the one likely to be released last), None if there is none. """
+        for key, mask in masks.items():
+            if mask & self._held.get(key, 0):
+                for grant in reversed(self._grants_by_key[key]):
+                    if grant.masks[key] & mask:
+                        return grant
+        return None
+
+    def locked(self, key, start: int, end: int) -> bool:
+        return self._find_conflicting_grant(_ranges_to_masks([(key, start, end)])) is not None
+
+    def any_locked(self, ranges: list[tuple]) -> bool:
+        """ True if any of the (key, start, end) ranges overlaps a held one. """
+        return bool(self._held) and self._find_conflicting_grant(_ranges_to_masks(ranges)) is not None
+
+    async def acquire(self, ranges: list[tuple]) -> RangeLockGrant:
+        """ Waits until none of the (key, start, end) ranges overlaps a held one, then grants them together. Returns the grant to be released. """
+        masks = _ranges_to_masks(ranges)
+        conflicting_grant = self._find_conflicting_grant(masks)
+        if conflicting_grant is None:
+            return self._grant(masks)
+
+        waiter = asyncio.get_running_loop().create_future()
+        conflicting_grant.waiters.append((masks, waiter))
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled(): ## granted right before being cancelled
+                self.release(waiter.result())
+            raise
+
+    def _grant(self, masks: dict) -> RangeLockGrant:
+        grant = RangeLockGrant(masks)
+        for key, mask in masks.items():
+            self._held[key] = self._held.get(key, 0) | mask
+            self._grants_by_key.setdefault(key, []).append(grant)
+        return grant
+
+    def release(self, grant: RangeLockGrant):
+        for key, mask in grant.masks.items():
+            remaining = self._held[key] & ~mask
+            if remaining:
+                self._held[key] = remaining
+                self._grants_by_key[key].remove(grant)
+            else:
+                del self._held[key]
+                del self._grants_by_key[key]
+        waiters, grant.waiters = grant.waiters, []
+        for masks, waiter in waiters: ## in arrival order
+            if waiter.done(): ## cancelled
+                continue
+            conflicting_grant = self._find_conflicting_grant(masks)
+            if conflicting_grant is None:
+                waiter.set_result(self._grant(masks))
+            else:
+                conflicting_grant.waiters.append((masks, waiter))
+
+    @asynccontextmanager
+    async def get_lock(self, ranges: list[tuple]):
+        grant = await self.acquire(ranges)
+        try:
+            yield
+        finally:
+            self.release(grant)
+
+    def __deepcopy__(self, memo):
+        ## locks are runtime state only: copies (e.g. checkpoints) start with no holders nor waiters
+        return RangeLockManager()